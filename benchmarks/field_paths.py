@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+注入式翻译字段路径生成的微基准。
+
+构造一个带有数千个 li 子节点的合成 Def（comps、嵌套 stages、hediffGivers），
+分别用旧版逐节点回溯 + preceding-sibling 计数的实现与当前的 extract_field_paths 生成路径，
+校验两者产出的 key 完全一致并打印耗时。
+
+用法: python benchmarks/field_paths.py [li数量]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lxml import etree
+
+from rimworld_translator import extract_field_paths
+
+TRANSLATABLE_TAGS = ['label', 'description', 'reportString', 'verb', 'letterText']
+
+
+def legacy_field_paths(element: etree._Element, translatable_tags: list) -> dict:
+    """旧实现：对每个可翻译节点向上回溯，并在每一层 li 用 preceding-sibling 计算序号。"""
+    fields = {}
+    for sub in element.xpath(".//*"):
+        if sub.tag in translatable_tags and sub.text and sub.text.strip():
+            path_parts = []
+            curr = sub
+            while curr is not None and curr != element:
+                parent = curr.getparent()
+                if parent is None: break
+                if curr.tag == 'li':
+                    path_parts.insert(0, str(len(curr.xpath("preceding-sibling::li"))))
+                else:
+                    path_parts.insert(0, curr.tag)
+                curr = parent
+            fields[".".join(path_parts)] = sub.text.strip()
+    return fields
+
+
+def build_synthetic_def(li_count: int) -> etree._Element:
+    root = etree.Element("HediffDef")
+    etree.SubElement(root, "defName").text = "SyntheticHediff"
+    etree.SubElement(root, "label").text = "synthetic hediff"
+    comps = etree.SubElement(root, "comps")
+    stages = etree.SubElement(root, "stages")
+    givers = etree.SubElement(root, "hediffGivers")
+    for i in range(li_count):
+        comp = etree.SubElement(comps, "li")
+        etree.SubElement(comp, "label").text = f"comp {i}"
+        if i % 10 == 0:
+            comps.append(etree.Comment(f"comment {i}"))
+        stage = etree.SubElement(stages, "li")
+        etree.SubElement(stage, "label").text = f"stage {i}"
+        nested = etree.SubElement(stage, "capMods")
+        for j in range(3):
+            etree.SubElement(etree.SubElement(nested, "li"), "reportString").text = f"cap {i}.{j}"
+        giver = etree.SubElement(givers, "li")
+        etree.SubElement(giver, "letterText").text = f"giver {i}"
+    return root
+
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    li_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    element = build_synthetic_def(li_count)
+    legacy, legacy_seconds = timed(legacy_field_paths, element, TRANSLATABLE_TAGS)
+    current, current_seconds = timed(extract_field_paths, element, TRANSLATABLE_TAGS)
+
+    if legacy != current or list(legacy) != list(current):
+        print("错误: 两种实现生成的字段路径不一致！")
+        sys.exit(1)
+    print(f"li 数量: {li_count}，生成字段: {len(current)} 个，key 完全一致。")
+    print(f"  旧实现 (preceding-sibling): {legacy_seconds * 1000:.1f} ms")
+    print(f"  新实现 (单次自顶向下遍历): {current_seconds * 1000:.1f} ms")
+    print(f"  加速比: {legacy_seconds / current_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
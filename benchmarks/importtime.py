@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准：用 `python -X importtime -c "import rimworld_translator"` 在全新的解释器中多次导入脚本，
+报告导入耗时（中位数）以及脚本直接导入的耗时最多的模块。
+
+google-genai、pydantic、Pillow、lxml、tqdm 等重量级依赖应在第一次使用时才加载；
+若它们出现在导入链中则视为回退，以退出码 1 结束。也可用 --max-ms 设置导入耗时上限。
+
+用法:
+  python benchmarks/importtime.py
+  python benchmarks/importtime.py --runs 10 --top 15 --max-ms 150
+"""
+import argparse
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MODULE = "rimworld_translator"
+HEAVY_MODULES = ("google.genai", "pydantic", "PIL", "lxml", "tqdm")
+
+
+def parse_importtime(stderr: str) -> list:
+    """解析 -X importtime 的输出，返回 [(模块名, 自身耗时us, 累计耗时us, 缩进层级)]，按导入完成的顺序排列。"""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return records
+
+
+def measure_once() -> list:
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        print(f"错误: 导入 {MODULE} 失败。")
+        sys.exit(1)
+    return parse_importtime(result.stderr)
+
+
+def module_subtree(records: list) -> list:
+    """取出 MODULE 自身及其导入链上的记录（-X importtime 中子模块先于父模块输出，且缩进更深）。"""
+    index = next(i for i, record in reversed(list(enumerate(records))) if record[0] == MODULE)
+    depth = records[index][3]
+    start = index
+    while start > 0 and records[start - 1][3] > depth:
+        start -= 1
+    return records[start:index + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"测量 import {MODULE} 的启动耗时。")
+    parser.add_argument("--runs", type=int, default=5, help="重复测量的次数，报告中位数")
+    parser.add_argument("--top", type=int, default=10, help="列出累计耗时最多的直接依赖数量")
+    parser.add_argument("--max-ms", type=float, help="导入耗时(中位数)超过此值时以退出码 1 结束")
+    args = parser.parse_args()
+
+    # 预先编译字节码，避免把源码编译时间计入导入耗时（PYTHONDONTWRITEBYTECODE 环境下尤其重要）
+    py_compile.compile(str(ROOT / f"{MODULE}.py"), doraise=True)
+
+    runs = [module_subtree(measure_once()) for _ in range(max(1, args.runs))]
+    totals_ms = [subtree[-1][2] / 1000 for subtree in runs]
+    median_run = sorted(runs, key=lambda subtree: subtree[-1][2])[len(runs) // 2]
+
+    print(f"import {MODULE}: 中位数 {statistics.median(totals_ms):.1f} ms "
+          f"(最快 {min(totals_ms):.1f} ms，最慢 {max(totals_ms):.1f} ms，共 {len(runs)} 次)")
+    module_depth = median_run[-1][3]
+    direct = [record for record in median_run if record[3] == module_depth + 1]
+    print(f"  累计耗时最多的直接依赖 (中位数那一次):")
+    for name, _, cumulative_us, _ in sorted(direct, key=lambda record: record[2], reverse=True)[:args.top]:
+        print(f"    {name:<32} {cumulative_us / 1000:8.1f} ms")
+
+    failed = False
+    loaded = sorted({heavy for heavy in HEAVY_MODULES for name, *_ in median_run
+                     if name == heavy or name.startswith(heavy + ".")})
+    if loaded:
+        print(f"  回退: 以下重量级依赖在导入时就被加载: {', '.join(loaded)}")
+        failed = True
+    if args.max_ms is not None and statistics.median(totals_ms) > args.max_ms:
+        print(f"  回退: 导入耗时超过上限 {args.max_ms:.1f} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("  重量级依赖均未在导入时加载。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+端到端性能基准：生成合成的创意工坊目录，用离线模拟后端完整运行一次 main()。
+
+合成的每个Mod包含 About.xml、带版本文件夹的 LoadFolders.xml、带多层 ParentName 继承链与
+stuffCategories 的 Defs、带 value 块的 Patches，以及 Keyed / DefInjected 英文语言文件；
+另生成一个旧汉化包，其 translation_cache.json 覆盖一部分条目，用于构建翻译记忆库。
+下载阶段通过 benchmarks/steamcmd_stub.py 走完整的 SteamCMD 流程。
+
+从运行报告 (<汉化包名>.run.json) 中读取各阶段的墙钟耗时（下载、构建知识库、构建记忆库、提取条目、
+等待翻译、写出文件、生成元数据）与API请求统计，报告峰值内存 (RSS)、条目总数，以及每千个条目的API请求数与token数。
+可用 --save 保存结果，之后用 --baseline 对比；任何指标超出基线的容差时以退出码 1 结束，便于在夜间运行前发现性能回退。
+
+用法:
+  python benchmarks/pipeline.py --size medium --save bench.json
+  python benchmarks/pipeline.py --size medium --baseline bench.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rimworld_translator as rt
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+APP_ID = "294100"
+PREVIOUS_MOD_ID = "900000"
+STEAMCMD_STUB = Path(__file__).resolve().parent / "steamcmd_stub.py"
+TRANSLATABLE_TAGS = ['label', 'description', 'jobString', 'reportString', 'verb', 'letterLabel', 'letterText']
+
+# 每个规模: (Mod数, 每个Mod的Def文件数, 每个文件的具体Def数, 继承链深度, 每个Mod的Patch文件数, 每个Mod的Keyed条目数)
+SIZES = {
+    "small": (2, 2, 20, 3, 1, 30),
+    "medium": (6, 5, 60, 5, 3, 200),
+    "large": (20, 10, 150, 8, 6, 800),
+}
+
+WORDS = ("steel reinforced plasteel ancient mechanoid tribal psychic glowing heavy light small large "
+         "rifle blade armor helmet turret bed table lamp drug serum implant gene hive colony raid "
+         "caravan prisoner slave animal insect toxic frozen burning wounded").split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def write(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def generate_mod(mod_root: Path, index: int, size: tuple, rng: random.Random, memory_entries: dict):
+    """生成一个合成Mod，并把其中一部分条目（Keyed 与具体Def的 label）记入 memory_entries 供旧汉化包使用。"""
+    _, def_files, defs_per_file, chain_depth, patch_files, keyed_count = size
+    prefix = f"Syn{index}"
+    write(mod_root / "About" / "About.xml",
+          f"<ModMetaData><name>Synthetic Mod {index}</name><author>Bench</author>"
+          f"<packageId>bench.synthetic{index}</packageId></ModMetaData>")
+    write(mod_root / "LoadFolders.xml",
+          "<loadFolders>\n  <v1.5><li>/</li><li>Common</li><li>1.5</li></v1.5>\n"
+          "  <v1.6><li>/</li><li>Common</li><li>1.6</li></v1.6>\n</loadFolders>")
+
+    # 抽象继承链: Base_0 <- Base_1 <- ... ；链末端的模板带 stuffCategories，会按材质生成物品
+    bases = []
+    for chain in range(3):
+        lines = []
+        for depth in range(chain_depth):
+            name = f"{prefix}Base{chain}_{depth}"
+            parent = f' ParentName="{prefix}Base{chain}_{depth - 1}"' if depth else ""
+            body = f"<description>{sentence(rng, 8)}</description>" if depth % 2 == 0 else \
+                f"<comps><li><reportString>{sentence(rng, 4)}</reportString></li></comps>"
+            if depth == chain_depth - 1 and chain == 0:
+                body += "<label>synthetic furniture</label><stuffCategories><li>Woody</li><li>Metallic</li></stuffCategories>"
+            lines.append(f'  <ThingDef Name="{name}"{parent} Abstract="True">{body}</ThingDef>')
+            bases.append(name)
+        write(mod_root / "Common" / "Defs" / f"Bases{chain}.xml", "<Defs>\n" + "\n".join(lines) + "\n</Defs>")
+
+    for file_index in range(def_files):
+        version = "1.5" if file_index % 2 == 0 else "1.6"
+        lines = []
+        for def_index in range(defs_per_file):
+            def_name = f"{prefix}Thing{file_index}_{def_index}"
+            label = " ".join(rng.choice(WORDS) for _ in range(2))
+            stages = "".join(f"<li><label>{rng.choice(WORDS)} stage {stage}</label></li>" for stage in range(rng.randint(0, 3)))
+            lines.append(f'  <ThingDef ParentName="{rng.choice(bases)}"><defName>{def_name}</defName>'
+                         f"<label>{label}</label><description>{sentence(rng, 12)}</description>"
+                         f"<comps><li><verb>{rng.choice(WORDS)}</verb></li><li><stages>{stages}</stages></li></comps>"
+                         f"</ThingDef>")
+            memory_entries[f"{def_name}.label"] = {"en": label, "context": f"Path: label in Def '{def_name}'"}
+        write(mod_root / version / "Defs" / f"Things{file_index}.xml", "<Defs>\n" + "\n".join(lines) + "\n</Defs>")
+
+    for file_index in range(patch_files):
+        operations = []
+        for op_index in range(max(1, defs_per_file // 4)):
+            def_name = f"{prefix}Hediff{file_index}_{op_index}"
+            operations.append(
+                f'  <Operation Class="PatchOperationAdd"><xpath>/Defs</xpath><value>'
+                f"<HediffDef><defName>{def_name}</defName><label>{rng.choice(WORDS)} sickness</label>"
+                f"<description>{sentence(rng, 10)}</description>"
+                f"<stages><li><label>minor</label></li><li><label>major</label><letterText>{sentence(rng, 6)}</letterText></li></stages>"
+                f"</HediffDef></value></Operation>")
+        write(mod_root / "1.5" / "Patches" / f"Patches{file_index}.xml", "<Patch>\n" + "\n".join(operations) + "\n</Patch>")
+
+    keyed = []
+    for key_index in range(keyed_count):
+        key = f"{prefix}_Key{key_index}"
+        text = sentence(rng, rng.randint(3, 15))
+        if key_index % 5 == 0: text = "{0} " + text
+        if key_index % 7 == 0: text += " [PAWN_nameDef] is here."
+        keyed.append(f"  <{key}>{text}</{key}>")
+        memory_entries[key] = {"en": text, "context": None}
+    write(mod_root / "Languages" / "English" / "Keyed" / "Keys.xml",
+          "<LanguageData>\n" + "\n".join(keyed) + "\n</LanguageData>")
+    write(mod_root / "Languages" / "English" / "DefInjected" / "ThingDef" / "Extra.xml",
+          "<LanguageData>\n" + "\n".join(f"  <{prefix}Extra{i}.label>{sentence(rng, 3)}</{prefix}Extra{i}.label>"
+                                         for i in range(max(1, keyed_count // 10))) + "\n</LanguageData>")
+
+
+def generate_workshop(root: Path, size: tuple, memory_ratio: float, seed: int) -> list:
+    """生成创意工坊 content 目录，返回待翻译的Mod ID列表。"""
+    rng = random.Random(seed)
+    content = root / "workshop" / "content" / APP_ID
+    mod_ids, memory_entries = [], {}
+    for index in range(size[0]):
+        mod_id = str(100000 + index)
+        generate_mod(content / mod_id, index, size, rng, memory_entries)
+        mod_ids.append(mod_id)
+
+    previous = content / PREVIOUS_MOD_ID
+    write(previous / "About" / "About.xml", "<ModMetaData><name>Previous Pack</name></ModMetaData>")
+    cache = {key: dict(entry, cn=f"旧译文 {entry['en']}") for key, entry in memory_entries.items()
+             if rng.random() < memory_ratio}
+    write(previous / "Cont" / "Previous" / "translation_cache.json", json.dumps(cache, ensure_ascii=False))
+    return mod_ids
+
+
+def write_config(root: Path, mod_ids: list, args: argparse.Namespace) -> Path:
+    """写出基准运行使用的项目配置文件 (TOML)，所有产出都放在临时目录中。"""
+    def path(*parts) -> str:
+        return json.dumps((root.joinpath(*parts)).as_posix())
+
+    config_path = root / "bench.toml"
+    write(config_path, f"""
+[pack_info]
+name = "Bench Pack"
+author = "Bench"
+description = "benchmark"
+
+[versions]
+targets = ["1.5", "1.6"]
+
+[mod_ids]
+translate = "{','.join(mod_ids)}"
+previous = "{PREVIOUS_MOD_ID}"
+
+[rules]
+translatable_def_tags = {json.dumps(TRANSLATABLE_TAGS)}
+
+[system]
+steamcmd_path = {json.dumps(STEAMCMD_STUB.as_posix())}
+download_refresh_hours = 0
+download_state_file = {path("steam_downloads.json")}
+output_base_dir = {path("output")}
+translation_memory_db = {path("translation_memory.sqlite3")}
+parse_cache_dir = {path("parse_cache")}
+file_index_cache = {path("file_index.json")}
+helper_files_root = ""
+scan_workers = {args.scan_workers}
+streaming_extraction = {str(args.streaming).lower()}
+translation_backend = "mock"
+
+[system.mock_backend]
+latency = {args.latency}
+
+[ai_settings]
+concurrency = {args.concurrency}
+""")
+    return config_path
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None: return None
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return usage / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run(args: argparse.Namespace) -> dict:
+    size = SIZES[args.size]
+    root = Path(tempfile.mkdtemp(prefix="rimworld_bench_"))
+    try:
+        start = time.perf_counter()
+        mod_ids = generate_workshop(root, size, args.memory_ratio, args.seed)
+        generate_seconds = time.perf_counter() - start
+
+        config_path = write_config(root, mod_ids, args)
+        rt.get_workshop_content_path = lambda: root / "workshop" / "content"
+        shared = rt.BatchSharedState()
+        log_path = root / "run.log"
+        with log_path.open("w", encoding="utf-8") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            rt.main(rt.load_config(config_path), shared)
+        rt.close_translation_memory_stores()
+        report = json.loads((root / "output" / "Bench_Pack.run.json").read_text(encoding="utf-8"))
+
+        entries = 0
+        for cache_file in (root / "output" / "Bench_Pack" / "Cont").glob("*/translation_cache.json"):
+            entries += len(json.loads(cache_file.read_text(encoding="utf-8")))
+        requests = report["requests"]
+        per_k = 1000 / entries if entries else 0.0
+        if args.keep:
+            print(f"合成目录与运行日志保留在: {root}")
+        return {
+            "size": args.size, "mods": len(mod_ids), "entries": entries,
+            "generate_seconds": round(generate_seconds, 3),
+            "phases": report["phases"],
+            "peak_rss_mb": None if peak_rss_mb() is None else round(peak_rss_mb(), 1),
+            "api_requests": requests["calls"],
+            "requests_per_1k_entries": round(requests["calls"] * per_k, 2),
+            "prompt_tokens_per_1k_entries": round(requests["prompt_tokens"] * per_k),
+            "response_tokens_per_1k_entries": round(requests["response_tokens"] * per_k),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def print_report(result: dict):
+    print(f"规模: {result['size']}，{result['mods']} 个Mod，{result['entries']} 个条目 (生成耗时 {result['generate_seconds']:.2f}s)")
+    for name, seconds in result["phases"].items():
+        label = rt.PhaseTimer.LABELS.get(name, {"other": "其它", "total": "合计"}.get(name, name))
+        print(f"  {label:<8} {seconds:8.3f}s")
+    rss = result["peak_rss_mb"]
+    print(f"  峰值内存: {'不可用' if rss is None else f'{rss:.1f} MB'}")
+    print(f"  API请求: {result['api_requests']} 次；每千条目 {result['requests_per_1k_entries']} 次请求、"
+          f"{result['prompt_tokens_per_1k_entries']} 个输入token、{result['response_tokens_per_1k_entries']} 个输出token")
+
+
+def compare(result: dict, baseline: dict, tolerance: float, min_seconds: float) -> list:
+    """返回超出基线容差的指标。耗时很短的阶段噪声较大，低于 min_seconds 的不参与比较。"""
+    regressions = []
+    metrics = {f"phases.{name}": (seconds, baseline.get("phases", {}).get(name)) for name, seconds in result["phases"].items()}
+    for name in ("peak_rss_mb", "requests_per_1k_entries", "prompt_tokens_per_1k_entries", "response_tokens_per_1k_entries"):
+        metrics[name] = (result.get(name), baseline.get(name))
+    for name, (current, previous) in metrics.items():
+        if current is None or previous is None: continue
+        if name.startswith("phases.") and max(current, previous) < min_seconds: continue
+        if current > previous * (1 + tolerance):
+            regressions.append(f"{name}: {previous} -> {current} (+{(current / previous - 1) * 100 if previous else float('inf'):.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端性能基准（合成Mod + 离线模拟后端）。")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small", help="合成创意工坊的规模")
+    parser.add_argument("--memory-ratio", type=float, default=0.3, help="旧汉化包覆盖的条目比例")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的模拟请求数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟后端每个请求的平均延迟(秒)")
+    parser.add_argument("--scan-workers", type=int, default=1, help="全局学习阶段的扫描进程数 (0 为全部CPU核心)")
+    parser.add_argument("--streaming", action="store_true", help="启用流式提取 (streaming_extraction)")
+    parser.add_argument("--seed", type=int, default=0, help="合成内容的随机种子")
+    parser.add_argument("--keep", action="store_true", help="保留合成目录与运行日志")
+    parser.add_argument("--save", type=Path, help="把结果保存为JSON，作为以后对比的基线")
+    parser.add_argument("--baseline", type=Path, help="与之前保存的基线对比，超出容差时以退出码 1 结束")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许相对基线变慢/变大的比例")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="耗时低于此值的阶段不参与基线对比")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.save:
+        args.save.write_text(json.dumps(result, ensure_ascii=False, indent=4), encoding="utf-8")
+        print(f"结果已保存到: {args.save}")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("size") != result["size"]:
+            print(f"错误: 基线的规模 ({baseline.get('size')}) 与本次 ({result['size']}) 不同，无法对比。")
+            sys.exit(2)
+        regressions = compare(result, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"发现 {len(regressions)} 项指标超出基线 {args.tolerance:.0%} 的容差:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("所有指标均在基线容差范围内。")
+
+
+if __name__ == "__main__":
+    main()
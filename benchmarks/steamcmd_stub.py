@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+离线测试用的 SteamCMD 桩脚本。
+
+接受与 SteamCMD 相同的命令行 (+login ... +workshop_download_item <appid> <id> ... +quit)，
+不联网，按 SteamCMD 的格式逐个输出下载结果。把配置中的 steamcmd_path 指向本文件即可
+（.py 文件会用当前的 Python 解释器运行）。与 SteamCMD 一样，在 +force_install_dir 指定的目录下的
+steamapps/workshop 中创建物品，并在其中的 appworkshop_<appid>.acf 里记录已安装的版本。
+
+环境变量:
+  STEAMCMD_STUB_CONTENT  创意工坊 content 目录（未指定 +force_install_dir 时使用）；设置后为每个成功的物品
+                         创建 <appid>/<id>/About/About.xml，并更新 content 目录旁的acf
+  STEAMCMD_STUB_FAIL     逗号分隔的物品ID，这些物品输出失败信息
+  STEAMCMD_STUB_DELAY    每个物品的模拟下载耗时（秒），默认 0
+  STEAMCMD_STUB_TIMEUPDATED  写入acf的物品发布时间，默认 1700000000
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from rimworld_translator import format_vdf, parse_vdf  # noqa: E402
+
+
+def record_installed(content_dir: Path, app_id: str, item_ids: list):
+    """像 SteamCMD 一样在 content 目录旁的acf中记录已安装的物品（读取-修改-写回，不加锁）。"""
+    if not item_ids: return
+    acf_file = content_dir.parent / f"appworkshop_{app_id}.acf"
+    acf = parse_vdf(acf_file.read_text(encoding="utf-8")) if acf_file.is_file() else {}
+    app_workshop = acf.setdefault("AppWorkshop", {"appid": app_id})
+    timeupdated = os.environ.get("STEAMCMD_STUB_TIMEUPDATED", "1700000000")
+    for item_id in item_ids:
+        app_workshop.setdefault("WorkshopItemsInstalled", {})[item_id] = {
+            "size": "1024", "timeupdated": timeupdated, "manifest": f"{item_id}{timeupdated}"}
+        app_workshop.setdefault("WorkshopItemDetails", {})[item_id] = {
+            "manifest": f"{item_id}{timeupdated}", "timeupdated": timeupdated, "timetouched": str(int(time.time())),
+            "latest_timeupdated": timeupdated, "latest_manifest": f"{item_id}{timeupdated}"}
+    acf_file.parent.mkdir(parents=True, exist_ok=True)
+    acf_file.write_text(format_vdf(acf), encoding="utf-8")
+
+
+def main():
+    args = sys.argv[1:]
+    content_dir = os.environ.get("STEAMCMD_STUB_CONTENT")
+    downloaded = {}
+    failing = {item.strip() for item in os.environ.get("STEAMCMD_STUB_FAIL", "").split(",") if item.strip()}
+    delay = float(os.environ.get("STEAMCMD_STUB_DELAY", "0"))
+
+    print("Redirecting stderr to 'stderr.txt'")
+    print("Loading Steam API...OK")
+    i = 0
+    while i < len(args):
+        if args[i] == "+force_install_dir":
+            content_dir = str(Path(args[i + 1]) / "steamapps" / "workshop" / "content")
+            i += 2
+        elif args[i] == "+login":
+            print(f"Logging in user '{args[i + 1]}' to Steam Public...OK")
+            i += 3
+        elif args[i] == "+workshop_download_item":
+            app_id, item_id = args[i + 1], args[i + 2]
+            i += 3
+            time.sleep(delay)
+            if item_id in failing:
+                print(f"ERROR! Download item {item_id} failed (Failure).")
+                continue
+            item_path = Path(content_dir) / app_id / item_id if content_dir else Path(item_id)
+            if content_dir:
+                (item_path / "About").mkdir(parents=True, exist_ok=True)
+                (item_path / "About" / "About.xml").write_text(
+                    f"<ModMetaData><name>Stub {item_id}</name><packageId>stub.{item_id}</packageId></ModMetaData>",
+                    encoding="utf-8")
+                downloaded.setdefault(app_id, []).append(item_id)
+            print(f'Success. Downloaded item {item_id} to "{item_path}" (1024 bytes)')
+        else:
+            i += 1
+    if content_dir:
+        for app_id, item_ids in downloaded.items():
+            record_installed(Path(content_dir), app_id, item_ids)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+大型Def文件解析的内存基准。
+
+生成一个指定大小的合成Def文件（每个 ThingDef 带有大量不可翻译的 statBases、graphicData 与 comps），
+分别在独立的子进程中用完整解析 (parse_def_tree)、流式解析并组装整个文件的中间表示 (stream_def_file)、
+边解析边消费 (iter_def_file) 与流式提取模式的实际做法 (ParsedDefCache：解析一次写出分块文件，
+全局学习与注入阶段各读取一遍) 提取中间表示，校验四者结果完全一致，并报告耗时与峰值内存 (RSS) 的增量。
+前两者的峰值内存都随文件中的可翻译文本增长，后两者与文件大小基本无关。
+
+用法: python benchmarks/streaming_parse.py [文件大小MB ...]
+"""
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+TRANSLATABLE_TAGS = ['label', 'description', 'reportString']
+
+WORKER = """
+import hashlib, json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+import rimworld_translator as rt
+from lxml import etree  # 预先导入，避免把模块加载计入内存增量
+def chunks(path, tags):
+    if sys.argv[2] == "iter":
+        yield from rt.iter_def_file(path, tags)
+    elif sys.argv[2] == "spill":
+        rt.CONFIG = {"rules": {"translatable_def_tags": tags}, "system": {}}
+        cache = rt.ParsedDefCache(None, streaming=True)
+        for _ in cache.iter_chunks(path): pass  # 全局学习阶段（首次读取时解析并写出分块文件）
+        yield from cache.iter_chunks(path)  # 注入阶段
+    else:
+        ir = {"tree": rt.parse_def_tree, "stream": rt.stream_def_file}[sys.argv[2]](path, tags)
+        yield ir["templates"], ir["defs"]
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+# 按文档顺序逐条求哈希，三种方式的结果可直接比较
+template_digest, def_digest, count = hashlib.sha1(), hashlib.sha1(), 0
+for templates, defs in chunks(rt.Path(sys.argv[3]), json.loads(sys.argv[4])):
+    for template in templates:
+        template_digest.update(json.dumps(template, sort_keys=True).encode("utf-8"))
+    for def_ir in defs:
+        def_digest.update(json.dumps(def_ir, sort_keys=True).encode("utf-8"))
+    count += len(defs)
+seconds = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+digest = template_digest.hexdigest() + def_digest.hexdigest()
+print(json.dumps({"seconds": seconds, "peak_kb": peak, "defs": count, "digest": digest}))
+"""
+
+
+def write_def_file(path: Path, size_mb: float):
+    target_bytes = size_mb * 1024 * 1024
+    with path.open("w", encoding="utf-8") as f:
+        f.write("<Defs>\n")
+        i = 0
+        while f.tell() < target_bytes:
+            f.write(f'<ThingDef ParentName="BaseThing"><defName>Big{i}</defName><label>big thing {i}</label>'
+                    f'<description>description {i} ' + "lorem ipsum " * 10 + '</description>')
+            f.write("<statBases>" + "".join(f"<Stat{j}>{j}</Stat{j}>" for j in range(30)) + "</statBases>")
+            f.write("<graphicData><texPath>Things/Item</texPath><graphicClass>Graphic_Single</graphicClass>"
+                    "</graphicData>")
+            f.write("<comps>" + "".join(f'<li Class="CompProperties_X{j}"><compClass>Comp{j}</compClass>'
+                                        f'<reportString>report {i}.{j}</reportString></li>' for j in range(8)))
+            f.write("</comps></ThingDef>\n")
+            i += 1
+        f.write("</Defs>\n")
+
+
+def measure(mode: str, path: Path) -> dict:
+    result = subprocess.run([sys.executable, "-c", WORKER, str(ROOT), mode, str(path), json.dumps(TRANSLATABLE_TAGS)],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or [4, 16, 64]
+    with tempfile.TemporaryDirectory(prefix="rimworld_stream_") as tmp:
+        for size_mb in sizes:
+            path = Path(tmp) / f"Defs_{size_mb:g}MB.xml"
+            write_def_file(path, size_mb)
+            tree, stream, iterated, spilled = (measure("tree", path), measure("stream", path), measure("iter", path),
+                                               measure("spill", path))
+            if not tree["digest"] == stream["digest"] == iterated["digest"] == spilled["digest"]:
+                print(f"错误: {path.name} 的完整解析与流式解析结果不一致！")
+                sys.exit(1)
+            print(f"{path.name}: {tree['defs']} 个定义，四种解析结果完全一致。")
+            for name, result in (("完整解析", tree), ("流式解析并组装", stream), ("边解析边消费", iterated),
+                                 ("分块文件 (学习+注入)", spilled)):
+                print(f"  {name}: {result['seconds']:.2f}s，峰值内存增量 {result['peak_kb'] / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,55 @@
 # -*- coding: utf-8 -*-
+from __future__ import annotations
+
 import argparse
+import bisect
+import contextlib
+import difflib
+import hashlib
+import importlib
 import json
+import math
+import multiprocessing
 import os
+import posixpath
 import random
+import re
+import shutil
+import sqlite3
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import traceback
 import tomllib
+import weakref
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Protocol
+
+
+class LazyModule:
+    """
+    首次访问属性时才导入的模块代理。google-genai、lxml 等重量级依赖只在真正用到时加载，
+    禁用的配置、全部条目来自翻译记忆的运行等不会为它们付出导入耗时。
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)  # 之后的访问直接命中实例属性
+        return value
 
-from PIL import Image, ImageDraw, ImageFont
-import google.genai as genai
-from google.genai import types
-from google.genai.errors import APIError
-from lxml import etree
-from pydantic import BaseModel, Field
-from tqdm import tqdm
+
+genai = LazyModule("google.genai")
+types = LazyModule("google.genai.types")
+genai_errors = LazyModule("google.genai.errors")
+etree = LazyModule("lxml.etree")
 
 # --- 默认配置 ---
 # 这些值会在配置文件缺失相应条目时被使用
@@ -31,12 +64,44 @@ DEFAULT_CONFIG = {
         "slow_mode": False,
         "slow_mode_delay": 2,
         "helper_files_root": "project_helpers",
-        "output_base_dir": "translation_output"
+        "output_base_dir": "translation_output",
+        "translation_memory_db": "translation_output/translation_memory.sqlite3",
+        "incremental": True,
+        "parse_cache_dir": "translation_output/parse_cache",
+        "file_index_cache": "translation_output/file_index.json",
+        "streaming_extraction": False,
+        "scan_workers": 1,
+        "steamcmd_sessions": 1,
+        "download_refresh_hours": 0,
+        "download_state_file": "translation_output/steam_downloads.json",
+        "requests_per_minute": 0,
+        "tokens_per_minute": 0,
+        "rate_limits": {},
+        "run_report": True,
+        "translation_backend": "gemini",
+        "mock_backend": {
+            "latency": 0.0,
+            "rate_limit_probability": 0.0,
+            "retry_after": 1.0,
+            "failure_probability": 0.0,
+            "truncate_probability": 0.0,
+            "seed": 0
+        }
     },
     "ai_settings": {
         "temperature": 0.2,
         "max_retries": 5,
-        "retry_delay": 5
+        "retry_delay": 5,
+        "concurrency": 1,
+        "batch_token_budget": 6000,
+        "history_policy": "window",
+        "history_max_exchanges": 4,
+        "history_max_tokens": 12000,
+        "history_digest_size": 300,
+        "glossary_mode": "filtered",
+        "deduplicate": True,
+        "fuzzy_match_threshold": 0.8,
+        "item_max_attempts": 3
     },
     "image_generation": {
         "background_color_hex": "#334155",
@@ -189,18 +254,187 @@ VANILLA_STUFFS = {
     ]
 }
 
+# 当前项目实际使用的术语表与材质库：内置表加上项目配置中的自定义条目，由 main() 为每个项目重新生成，
+# 内置表本身不被修改，批量运行时前一个项目的自定义条目不会带入后一个项目
+PROJECT_GLOSSARY: Dict[str, str] = dict(RIMWORLD_GLOSSARY)
+PROJECT_STUFFS: Dict[str, List[dict]] = {category: list(stuffs) for category, stuffs in VANILLA_STUFFS.items()}
+
 
 # --- Pydantic模型定义 ---
-class TranslationItem(BaseModel):
-    key: str = Field(description="The original XML tag or injection key. This field MUST NOT be changed or translated.")
-    source_text: str = Field(description="The original English text to be translated.")
-    translated_text: str = Field(
-        description="The translated Simplified Chinese text. This is the field you need to fill.")
-    context_info: Optional[str] = Field(None, description="Contextual information for more accurate translation.")
+_RESPONSE_MODELS: Optional[tuple] = None
+_RESPONSE_MODELS_LOCK = threading.Lock()
+
+
+def response_models() -> tuple[type, type]:
+    """
+    返回 (TranslationItem, TranslationResponse)。模型在第一次需要时才定义，避免启动时导入 pydantic。
+    多个翻译线程可能同时首次调用，加锁保证全程只定义一次（否则会得到互不兼容的两套模型类）。
+    """
+    global _RESPONSE_MODELS
+    with _RESPONSE_MODELS_LOCK:
+        if _RESPONSE_MODELS is None:
+            _RESPONSE_MODELS = _define_response_models()
+        return _RESPONSE_MODELS
+
+
+def _define_response_models() -> tuple[type, type]:
+    from pydantic import BaseModel, Field
+
+    class TranslationItem(BaseModel):
+        key: str = Field(
+            description="The original XML tag or injection key. This field MUST NOT be changed or translated.")
+        source_text: str = Field(description="The original English text to be translated.")
+        translated_text: str = Field(
+            description="The translated Simplified Chinese text. This is the field you need to fill.")
+        context_info: Optional[str] = Field(None, description="Contextual information for more accurate translation.")
+
+    class TranslationResponse(BaseModel):
+        translations: List[TranslationItem] = Field(description="A list of all the translated items.")
+
+    return TranslationItem, TranslationResponse
+
+
+class TranslationRecord(Protocol):
+    """
+    模型返回的单条译文，即 response_models() 中 TranslationItem 的字段，仅用于类型标注。
+    TranslationItem 在运行时才定义，标注中引用它会使 typing.get_type_hints 无法解析。
+    """
+    key: str
+    source_text: str
+    translated_text: str
+    context_info: Optional[str]
+
+
+def __getattr__(name: str):
+    # 兼容直接引用 rimworld_translator.TranslationItem / TranslationResponse 的外部代码
+    if name == "TranslationItem":
+        return response_models()[0]
+    if name == "TranslationResponse":
+        return response_models()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# --- 运行指标 ---
 
+class PhaseTimer:
+    """
+    按阶段累计主线程的墙钟耗时。阶段可以嵌套：进入内层阶段时外层暂停计时，
+    因此各阶段的耗时互不重叠，与未归入任何阶段的“其它”耗时相加等于整次运行的耗时。
+    """
+
+    LABELS = {"download": "下载", "knowledge": "构建知识库", "memory": "构建记忆库", "extraction": "提取条目",
+              "translation": "等待翻译", "write": "写出文件", "packaging": "生成元数据"}
+
+    def __init__(self):
+        self.reset()
 
-class TranslationResponse(BaseModel):
-    translations: List[TranslationItem] = Field(description="A list of all the translated items.")
+    def reset(self):
+        self.started = time.perf_counter()
+        self.totals = {}
+        self.stack = []  # [阶段名, 本段计时的起点]
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        now = time.perf_counter()
+        if self.stack:
+            outer = self.stack[-1]
+            self.totals[outer[0]] = self.totals.get(outer[0], 0.0) + now - outer[1]
+        self.stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, start = self.stack.pop()
+            self.totals[name] = self.totals.get(name, 0.0) + now - start
+            if self.stack:
+                self.stack[-1][1] = now
+
+    def summary(self) -> Dict[str, float]:
+        """返回 {阶段: 秒数}，按 LABELS 的顺序排列，最后是 other（未归入任何阶段的耗时）与 total。"""
+        total = time.perf_counter() - self.started
+        result = {name: self.totals.get(name, 0.0) for name in self.LABELS}
+        result["other"] = max(0.0, total - sum(self.totals.values()))
+        result["total"] = total
+        return result
+
+    def report(self):
+        summary = self.summary()
+        parts = [f"{self.LABELS.get(name, '其它')} {seconds:.2f}s" for name, seconds in summary.items()
+                 if name != "total" and seconds >= 0.005]
+        print(f"阶段耗时 (共 {summary['total']:.2f}s): " + "，".join(parts))
+
+
+class RunMetrics:
+    """
+    一次项目运行中每次 translate_with_json_mode 调用的明细：条目数、估算/实际输入token数、输出token数、
+    请求次数（含重试）、收到的429次数、后端调用耗时（latency，不含限流等待）与总耗时（elapsed）。
+    调用来自多个翻译工作线程，记录时加锁。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        with self.lock:
+            self.requests = []
+
+    @contextlib.contextmanager
+    def request(self, items: int, estimated_tokens: int):
+        """记录一次调用；调用方在返回前填写记录中的各项。"""
+        record = {"start": round(time.perf_counter() - self.started, 3), "items": items,
+                  "estimated_tokens": estimated_tokens, "prompt_tokens": None, "response_tokens": None,
+                  "attempts": 0, "rate_limited": 0, "latency": 0.0, "ok": False, "error": None}
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["latency"] = round(record["latency"], 3)
+            record["elapsed"] = round(time.perf_counter() - started, 3)
+            with self.lock:
+                self.requests.append(record)
+
+    def request_summary(self) -> dict:
+        with self.lock:
+            records = list(self.requests)
+        latencies = sorted(record["latency"] for record in records)
+
+        def percentile(fraction: float) -> Optional[float]:
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else None
+
+        return {
+            "calls": len(records),
+            "failed": sum(1 for record in records if not record["ok"]),
+            "retries": sum(record["attempts"] - 1 for record in records if record["attempts"]),
+            "rate_limited": sum(record["rate_limited"] for record in records),
+            "items": sum(record["items"] for record in records),
+            "estimated_tokens": sum(record["estimated_tokens"] for record in records),
+            "prompt_tokens": sum(record["prompt_tokens"] or 0 for record in records),
+            "response_tokens": sum(record["response_tokens"] or 0 for record in records),
+            "latency_total": round(sum(latencies), 3),
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+    def write_report(self, report_path: Path, details: dict):
+        """写出运行报告 (JSON) 与逐次调用的明细 (同名的 .requests.jsonl)。"""
+        report = {**details, "phases": {name: round(seconds, 3) for name, seconds in PHASE_TIMER.summary().items()},
+                  "requests": self.request_summary()}
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with report_path.open('w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        with self.lock:
+            records = list(self.requests)
+        with report_path.with_name(report_path.name.replace(".run.json", ".requests.jsonl")).open('w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"运行报告已写入: {report_path}")
+
+
+PHASE_TIMER = PhaseTimer()
+RUN_METRICS = RunMetrics()
 
 
 # --- 核心函数 ---
@@ -225,19 +459,28 @@ def get_workshop_content_path() -> Path:
     return path
 
 
-def setup_environment():
-    print("--- 环境设置 ---")
+def get_api_key() -> str:
     api_key = os.environ.get('GEMINI_API_KEY')
     if not api_key:
         print("错误: 找不到环境变量 'GEMINI_API_KEY'。")
         sys.exit(1)
+    return api_key
+
 
+def create_client() -> genai.Client:
+    api_key = get_api_key()
     try:
         client = genai.Client(api_key=api_key)
         print("Gemini API 客户端初始化成功。")
     except Exception as e:
         print(f"错误: Gemini API 客户端初始化失败: {e}")
         sys.exit(1)
+    return client
+
+
+def setup_environment() -> 'TranslationBackend':
+    print("--- 环境设置 ---")
+    backend = create_backend()
 
     if not Path(CONFIG['system']['steamcmd_path']).is_file():
         print(f"错误: 在路径 '{CONFIG['system']['steamcmd_path']}' 未找到 SteamCMD。")
@@ -248,7 +491,7 @@ def setup_environment():
         sys.exit(1)
 
     # 输出目录的创建移至main函数，因为它依赖于每个项目的配置
-    return client
+    return backend
 
 
 def parse_ids(id_string: str) -> List[str]:
@@ -256,39 +499,258 @@ def parse_ids(id_string: str) -> List[str]:
     return [item.strip() for item in id_string.split(',') if item.strip()]
 
 
-def download_with_steamcmd(mod_ids: List[str]):
-    if not mod_ids: return
-    print(f"--- 开始使用 SteamCMD 下载 {len(mod_ids)} 个 Mod ---")
+def parse_vdf(text: str) -> dict:
+    """解析Steam的KeyValues(VDF)文本（如 appworkshop_294100.acf），返回嵌套字典。"""
+    root, stack, key = {}, [], None
+    current = root
+    for match in re.finditer(r'"((?:[^"\\]|\\.)*)"|([{}])', text):
+        token, brace = match.group(1), match.group(2)
+        if brace == '{':
+            child = {}
+            current[key] = child
+            stack.append(current)
+            current, key = child, None
+        elif brace == '}':
+            if stack: current = stack.pop()
+        elif key is None:
+            key = token
+        else:
+            current[key] = token
+            key = None
+    return root
+
+
+def format_vdf(data: dict, depth: int = 0) -> str:
+    """把 parse_vdf 的结果写回VDF文本（键与值原样写出，parse_vdf 也不做反转义，因此可以无损往返）。"""
+    tabs = "\t" * depth
+    parts = []
+    for key, value in data.items():
+        if isinstance(value, dict):
+            parts.append(f'{tabs}"{key}"\n{tabs}{{\n{format_vdf(value, depth + 1)}{tabs}}}\n')
+        else:
+            parts.append(f'{tabs}"{key}"\t\t"{value}"\n')
+    return "".join(parts)
+
+
+def load_workshop_acf(workshop_path: Path) -> Dict[str, dict]:
+    """
+    读取Steam记录的创意工坊状态 (steamapps/workshop/appworkshop_<appid>.acf)。
+    返回 {mod_id: {"installed": {...}, "details": {...}}}，文件不存在或无法解析时返回空字典。
+    """
+    app_id = CONFIG['system']['rimworld_app_id']
+    acf_file = workshop_path.parent / f"appworkshop_{app_id}.acf"
+    if not acf_file.is_file(): return {}
+    try:
+        data = parse_vdf(acf_file.read_text(encoding='utf-8', errors='replace')).get("AppWorkshop", {})
+    except OSError:
+        return {}
+    installed, details = data.get("WorkshopItemsInstalled", {}), data.get("WorkshopItemDetails", {})
+    return {mod_id: {"installed": installed.get(mod_id, {}), "details": details.get(mod_id, {})}
+            for mod_id in set(installed) | set(details)}
 
+
+def is_workshop_item_current(mod_id: str, mod_content_path: Path, acf_item: Optional[dict],
+                             last_downloaded: Optional[float], refresh_seconds: float, now: float) -> bool:
+    """
+    判断本地的创意工坊物品是否无需重新下载：
+    - 物品目录必须存在且非空；
+    - Steam已知有更新版本（acf中 latest_manifest/latest_timeupdated 比已安装的新）时需要下载；
+    - acf同时记录了已安装版本与已发布版本的 timeupdated，且已发布的不比已安装的新时视为最新；
+    - 仅在设置了刷新间隔时：acf中没有该物品的记录，但最近一次成功下载（本地记录）
+      或Steam最近一次检查（acf的 timetouched）距今未超过刷新间隔，也视为最新。
+    """
+    item_path = mod_content_path / mod_id
+    if not item_path.is_dir() or not any(item_path.iterdir()): return False
+
+    installed = (acf_item or {}).get("installed", {})
+    details = (acf_item or {}).get("details", {})
+    latest_manifest = details.get("latest_manifest")
+    if latest_manifest and latest_manifest != installed.get("manifest", details.get("manifest")):
+        return False
+    try:
+        installed_timeupdated = int(installed.get("timeupdated", details.get("timeupdated", 0)))
+        published_timeupdated = int(details.get("latest_timeupdated", details.get("timeupdated", 0)))
+        if published_timeupdated > installed_timeupdated:
+            return False
+        if installed_timeupdated and published_timeupdated:
+            return True
+        last_checked = max(last_downloaded or 0, int(details.get("timetouched", 0)))
+    except ValueError:
+        last_checked = last_downloaded or 0
+    return refresh_seconds > 0 and now - last_checked < refresh_seconds
+
+
+def get_steamcmd_command() -> List[str]:
+    """SteamCMD的启动命令。steamcmd_path 指向 .py 文件时用当前解释器运行（可替换为离线测试用的桩脚本）。"""
     steamcmd_path = CONFIG['system']['steamcmd_path']
+    if steamcmd_path.endswith(".py"):
+        return [sys.executable, steamcmd_path]
+    return [steamcmd_path]
+
+
+class ProgressBar(Protocol):
+    """下载进度条（tqdm）的类型标注；tqdm 在需要时才导入。"""
+
+    def update(self, n: int = 1) -> object: ...
+
+
+def run_steamcmd_session(mod_ids: List[str], pbar: ProgressBar, install_dir: Optional[Path] = None
+                         ) -> Dict[str, Optional[str]]:
+    """
+    启动一个SteamCMD进程下载一组物品，逐行解析输出中每个物品的结果。
+    指定 install_dir 时以 +force_install_dir 下载到该目录（其下的 steamapps/workshop），不触碰正式的创意工坊目录。
+    返回 {mod_id: None(成功) 或 失败原因}。输出中未出现结果的物品视为失败。
+    """
     steam_user = CONFIG['system']['steam_user']
     steam_password = CONFIG['system']['steam_password']
     rimworld_app_id = CONFIG['system']['rimworld_app_id']
 
-    command = [steamcmd_path, "+login", steam_user, steam_password]
+    command = get_steamcmd_command()
+    if install_dir is not None:
+        command += ["+force_install_dir", str(install_dir)]
+    command += ["+login", steam_user, steam_password]
     for mod_id in mod_ids:
-        print(f"准备下载 Mod ID: {mod_id}")
         command.extend(["+workshop_download_item", rimworld_app_id, mod_id])
     command.append("+quit")
 
+    results = {}
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                               encoding='utf-8', errors='replace')
+    for line in process.stdout:
+        success = re.search(r"Success\. Downloaded item (\d+)", line)
+        failure = re.search(r"ERROR! Download item (\d+) failed \(([^)]*)\)", line)
+        if success and success.group(1) in mod_ids:
+            results[success.group(1)] = None
+            pbar.update(1)
+        elif failure and failure.group(1) in mod_ids:
+            results[failure.group(1)] = failure.group(2)
+            pbar.update(1)
+    process.wait()
+    for mod_id in mod_ids:
+        if mod_id not in results:
+            results[mod_id] = f"SteamCMD 未报告结果 (退出代码 {process.returncode})"
+    return results
+
+
+def merge_staged_downloads(sessions: List[tuple[Path, List[str]]], workshop_path: Path) -> Dict[str, str]:
+    """
+    把各SteamCMD进程在独立安装目录中下载成功的物品移入创意工坊目录，并把它们在各自acf中的记录
+    合并进正式的 appworkshop_<appid>.acf（先写临时文件再替换）。只在所有进程结束后由主线程调用，
+    正式的acf只有这一个写入者。返回 {mod_id: 失败原因}，即下载成功但无法合并的物品。
+    """
+    app_id = CONFIG['system']['rimworld_app_id']
+    mod_content_path = workshop_path / app_id
+    failed, staged_records = {}, {}
+    for install_dir, mod_ids in sessions:
+        staged_workshop = install_dir / "steamapps" / "workshop"
+        staged_acf = staged_workshop / f"appworkshop_{app_id}.acf"
+        staged_items = {}
+        if staged_acf.is_file():
+            data = parse_vdf(staged_acf.read_text(encoding='utf-8', errors='replace')).get("AppWorkshop", {})
+            staged_items = {section: data.get(section, {}) for section in ("WorkshopItemsInstalled", "WorkshopItemDetails")}
+        for mod_id in mod_ids:
+            source = staged_workshop / "content" / app_id / mod_id
+            if not source.is_dir():
+                failed[mod_id] = f"在独立安装目录中找不到下载的物品: {source}"
+                continue
+            target = mod_content_path / mod_id
+            if target.exists():
+                shutil.rmtree(target)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(source), str(target))
+            for section, items in staged_items.items():
+                if mod_id in items:
+                    staged_records.setdefault(section, {})[mod_id] = items[mod_id]
+
+    if staged_records:
+        acf_file = workshop_path.parent / f"appworkshop_{app_id}.acf"
+        acf = parse_vdf(acf_file.read_text(encoding='utf-8', errors='replace')) if acf_file.is_file() else {}
+        app_workshop = acf.setdefault("AppWorkshop", {"appid": app_id})
+        for section, items in staged_records.items():
+            app_workshop.setdefault(section, {}).update(items)
+        tmp_path = acf_file.with_name(f"{acf_file.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(format_vdf(acf), encoding='utf-8')
+        os.replace(tmp_path, acf_file)
+    return failed
+
+
+def download_with_steamcmd(mod_ids: List[str], workshop_path: Path):
+    if not mod_ids: return
+    system_config = CONFIG['system']
+    mod_content_path = workshop_path / system_config['rimworld_app_id']
+    state_file_str = system_config.get('download_state_file', DEFAULT_CONFIG['system']['download_state_file'])
+    state_file = BASE_WORKING_DIR / state_file_str if state_file_str else None
+    refresh_hours = system_config.get('download_refresh_hours', DEFAULT_CONFIG['system']['download_refresh_hours'])
+
+    download_state = {}
+    if state_file is not None and state_file.is_file():
+        try:
+            with state_file.open('r', encoding='utf-8') as f:
+                download_state = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            download_state = {}
+
+    # 跳过本地已是最新版本的物品
+    acf_items = load_workshop_acf(workshop_path)
+    now = time.time()
+    to_download = [mod_id for mod_id in mod_ids
+                   if not is_workshop_item_current(mod_id, mod_content_path, acf_items.get(mod_id),
+                                                   download_state.get(mod_id), refresh_hours * 3600, now)]
+    if len(to_download) < len(mod_ids):
+        print(f"--- {len(mod_ids) - len(to_download)} 个 Mod 已是最新，跳过下载 ---")
+    if not to_download:
+        print()
+        return
+
+    sessions = max(1, min(system_config.get('steamcmd_sessions', DEFAULT_CONFIG['system']['steamcmd_sessions']),
+                          len(to_download)))
+    print(f"--- 开始使用 SteamCMD 下载 {len(to_download)} 个 Mod ({sessions} 个进程) ---")
+    for mod_id in to_download:
+        print(f"准备下载 Mod ID: {mod_id}")
+    # 轮流分配给各个SteamCMD进程
+    groups = [to_download[i::sessions] for i in range(sessions)]
+    # 多个进程同时写同一个安装目录与acf会相互覆盖，因此并行时每个进程使用独立的安装目录，
+    # 全部结束后再由主线程把物品与acf记录合并进正式目录；只有一个进程时照常直接下载
+    staging_root = workshop_path.parent / "rimworld_translator_staging" if sessions > 1 else None
+    install_dirs = [staging_root / f"session{i}" for i in range(sessions)] if staging_root else [None]
+    if staging_root is not None:
+        shutil.rmtree(staging_root, ignore_errors=True)
+
+    results = {}
     try:
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
-                                   encoding='utf-8')
-        with tqdm(total=len(mod_ids), desc="SteamCMD 下载中", unit="item") as pbar:
-            for line in process.stdout:
-                if "Success. Downloaded item" in line:
-                    pbar.update(1)
-        process.wait()
-        if process.returncode != 0:
-            print(f"\n警告: SteamCMD 进程以非零代码 {process.returncode} 退出。")
-        else:
-            print("\n所有 Mod 下载任务已提交。")
+        from tqdm import tqdm
+        with tqdm(total=len(to_download), desc="SteamCMD 下载中", unit="item") as pbar, \
+                ThreadPoolExecutor(max_workers=sessions) as executor:
+            for group_results in executor.map(lambda group, install_dir: run_steamcmd_session(group, pbar, install_dir),
+                                              groups, install_dirs):
+                results.update(group_results)
+        if staging_root is not None:
+            results.update(merge_staged_downloads(
+                [(install_dir, [mod_id for mod_id in group if results[mod_id] is None])
+                 for install_dir, group in zip(install_dirs, groups)], workshop_path))
+            shutil.rmtree(staging_root, ignore_errors=True)
     except FileNotFoundError:
-        print(f"错误: 无法执行 SteamCMD。路径 '{steamcmd_path}' 是否正确？")
+        print(f"错误: 无法执行 SteamCMD。路径 '{system_config['steamcmd_path']}' 是否正确？")
         sys.exit(1)
     except Exception as e:
         print(f"SteamCMD 执行时发生未知错误: {e}")
         sys.exit(1)
+
+    failed = {mod_id: reason for mod_id, reason in results.items() if reason is not None}
+    for mod_id in to_download:
+        if results[mod_id] is None:
+            download_state[mod_id] = now
+    if state_file is not None:
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        with state_file.open('w', encoding='utf-8') as f:
+            json.dump(download_state, f, ensure_ascii=False, indent=4, sort_keys=True)
+
+    if failed:
+        print(f"\n警告: {len(failed)} 个 Mod 下载失败，将使用本地已有的版本（如果存在）:")
+        for mod_id, reason in failed.items():
+            print(f"  -> {mod_id}: {reason}")
+    else:
+        print(f"\n所有 {len(to_download)} 个 Mod 下载成功。")
     print("--- 下载完成 ---\n")
 
 
@@ -316,6 +778,8 @@ def get_mod_info(mod_path: Path) -> Optional[Dict[str, str]]:
 
 def create_placeholder_images(about_dir: Path):
     """根据配置创建占位符图片。"""
+    from PIL import Image, ImageDraw, ImageFont
+
     print("正在生成占位符图片...")
     img_config = CONFIG.get('image_generation', DEFAULT_CONFIG['image_generation'])
     author_name = CONFIG['pack_info']['author']
@@ -468,65 +932,481 @@ def load_xml_as_dict(file_path: Path) -> Dict[str, str]:
     return translations
 
 
-def find_source_files(mod_path: Path, target_subfolders: List[str]) -> List[Path]:
+# --- 文件索引 ---
+
+class ModFileIndex:
+    """
+    一个Mod（或辅助文件）目录的文件索引：用 os.scandir 一次遍历整个目录树，记录其中的XML/JSON文件与每个目录的mtime。
+    内容文件夹 × 目标子文件夹的查找、旧汉化包中 translation_cache.json 的查找都查询这个索引，不再反复 rglob。
+    目录中增删、改名文件或子目录都会改变该目录的mtime，因此只要记录的每个目录mtime都未变，索引就仍然有效。
+    路径均为相对目录根的 "/" 分隔字符串。匹配规则与 rglob 一致：只在Windows上不区分大小写；
+    查询目录之下的符号链接目录不展开（查询路径本身经过的链接照常生效）。
+    """
+
+    INDEXED_SUFFIXES = (".xml", ".json")
+    CASE_INSENSITIVE = os.name == 'nt'
+
+    def __init__(self, root: Path, directories: Dict[str, int], files: List[str], links: List[str]):
+        self.root = root
+        self.directories = directories  # 相对路径 -> mtime_ns；目录根为 ""，目录不存在时为空
+        self.folded_directories = {self.fold(rel) for rel in directories}
+        self.links = links  # 指向目录的符号链接
+        self.files = sorted(files, key=self.fold)
+        self.file_keys = [self.fold(rel) for rel in self.files]
+
+    @classmethod
+    def fold(cls, rel: str) -> str:
+        return rel.lower() if cls.CASE_INSENSITIVE else rel
+
+    @classmethod
+    def scan(cls, root: Path) -> 'ModFileIndex':
+        directories, files, links = {}, [], []
+        # 符号链接指向的目录也会被遍历（查询时再按位置取舍）；
+        # ancestors 为当前路径上各级目录的 (st_dev, st_ino)，用于避免链接成环
+        pending = [("", str(root), frozenset())]
+        while pending:
+            rel_dir, dir_path, ancestors = pending.pop()
+            try:
+                # 先记录mtime再列目录：遍历期间发生的变化会让下次校验失败，而不会被漏掉
+                dir_stat = os.stat(dir_path)
+                identity = (dir_stat.st_dev, dir_stat.st_ino)
+                if identity in ancestors: continue
+                ancestors = ancestors | {identity}
+                with os.scandir(dir_path) as entries:
+                    directories[rel_dir] = dir_stat.st_mtime_ns
+                    for entry in entries:
+                        rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        if entry.is_dir():
+                            if entry.is_symlink():
+                                links.append(rel)
+                            pending.append((rel, entry.path, ancestors))
+                        elif cls.fold(entry.name).endswith(cls.INDEXED_SUFFIXES) and entry.is_file():
+                            files.append(rel)
+            except OSError:
+                continue
+        return cls(root, directories, files, links)
+
+    def is_current(self) -> bool:
+        if "" not in self.directories: return False
+        try:
+            return all(os.stat(self.root / rel).st_mtime_ns == mtime for rel, mtime in self.directories.items())
+        except OSError:
+            return False
+
+    def is_dir(self, rel_dir: str) -> bool:
+        return self.fold(rel_dir) in self.folded_directories
+
+    def has_file(self, rel: str) -> bool:
+        key = self.fold(rel)
+        position = bisect.bisect_left(self.file_keys, key)
+        return position < len(self.file_keys) and self.file_keys[position] == key
+
+    def files_under(self, rel_dir: str, suffix: str) -> List[str]:
+        """返回 rel_dir 下（递归）所有以 suffix 结尾的文件的相对路径，相当于 (root / rel_dir).rglob("*" + suffix)。"""
+        prefix = self.fold(rel_dir) + "/" if rel_dir else ""
+        suffix = self.fold(suffix)
+        hidden = self.links_under(prefix)
+        found = []
+        for position in range(bisect.bisect_left(self.file_keys, prefix), len(self.file_keys)):
+            key = self.file_keys[position]
+            if not key.startswith(prefix): break
+            if key.endswith(suffix) and not key.startswith(hidden):
+                found.append(self.files[position])
+        return found
+
+    def files_named(self, name: str) -> List[str]:
+        """返回整个目录树中文件名为 name 的文件的相对路径，相当于 root.rglob(name)。"""
+        name = self.fold(name)
+        hidden = self.links_under("")
+        return [rel for rel, key in zip(self.files, self.file_keys)
+                if key.rsplit("/", 1)[-1] == name and not key.startswith(hidden)]
+
+    def path_sort_key(self, rel: str) -> List[str]:
+        """与 Path 对象的排序一致（同一根目录下按路径分段比较），但不必构造和比较 Path。"""
+        return self.fold(rel).split("/")
+
+    def links_under(self, prefix: str) -> tuple:
+        """prefix 之下的符号链接目录（"/" 结尾的前缀元组），rglob 不会展开它们。"""
+        return tuple(link + "/" for link in map(self.fold, self.links) if link.startswith(prefix))
+
+    def to_json(self) -> dict:
+        return {"directories": self.directories, "files": self.files, "links": self.links}
+
+
+class WorkshopFileIndex:
+    """
+    按目录缓存 ModFileIndex，并保存到 [system] 中的 file_index_cache 文件以便在多次运行之间复用。
+    每次查询都会校验目录mtime；任一目录变化时重新扫描该Mod。未配置缓存文件时只在单次运行内复用。
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_file: Optional[Path]):
+        self.cache_file = cache_file
+        self.indexes: Dict[str, ModFileIndex] = {}
+        self.dirty = False
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        if cache_file is not None and cache_file.is_file():
+            try:
+                data = json.loads(cache_file.read_text(encoding='utf-8'))
+                if data.get("version") == self.VERSION:
+                    self.indexes = {
+                        root: ModFileIndex(Path(root), entry["directories"], entry["files"], entry["links"])
+                        for root, entry in data["indexes"].items()}
+            except (json.JSONDecodeError, KeyError, TypeError, OSError) as e:
+                print(f"警告: 读取文件索引缓存失败，将重新扫描: {e}")
+
+    def get(self, root: Path) -> ModFileIndex:
+        key = str(root)
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None and index.is_current():
+                self.stats["reused"] += 1
+                return index
+            index = ModFileIndex.scan(root)
+            if index.directories:
+                self.stats["scanned"] += 1
+                self.indexes[key] = index
+                self.dirty = True
+            elif self.indexes.pop(key, None) is not None:  # 目录已不存在，不缓存
+                self.dirty = True
+            return index
+
+    def save(self):
+        with self.lock:
+            if self.cache_file is None or not self.dirty: return
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # 并行处理的项目可能同时保存同一个索引文件，临时文件名带上进程号以免互相覆盖
+            tmp_path = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+            with tmp_path.open('w', encoding='utf-8') as f:
+                json.dump({"version": self.VERSION,
+                           "indexes": {root: index.to_json() for root, index in self.indexes.items()}}, f,
+                          ensure_ascii=False)
+            os.replace(tmp_path, self.cache_file)
+            self.dirty = False
+
+
+_FILE_INDEXES: Dict[Optional[Path], WorkshopFileIndex] = {}
+
+
+def get_workshop_file_index() -> WorkshopFileIndex:
+    """按配置的缓存文件获取文件索引；同一进程内批量处理多个项目时复用。"""
+    cache_file_str = CONFIG['system'].get('file_index_cache', DEFAULT_CONFIG['system']['file_index_cache'])
+    cache_file = (BASE_WORKING_DIR / cache_file_str).resolve() if cache_file_str else None
+    if cache_file not in _FILE_INDEXES:
+        _FILE_INDEXES[cache_file] = WorkshopFileIndex(cache_file)
+    return _FILE_INDEXES[cache_file]
+
+
+def resolve_content_folder(path_str: str) -> Optional[str]:
+    """把 LoadFolders.xml 中的路径转换为相对Mod根目录的索引路径；指向Mod目录之外的路径返回None。"""
+    cleaned_path = path_str.strip().replace('\\', '/')
+    if cleaned_path == '/': return ""
+    if cleaned_path.startswith('/'): return None
+    rel = posixpath.normpath(cleaned_path)
+    if rel == '.': return ""
+    if rel == '..' or rel.startswith('../'): return None
+    return rel
+
+
+def find_source_files(mod_index: ModFileIndex, target_subfolders: List[str]) -> List[Path]:
     found_files_map = {}
-    load_folders_file = mod_path / "LoadFolders.xml"
+    mod_path = mod_index.root
     content_folders_in_order = []
 
-    if load_folders_file.is_file():
+    if mod_index.has_file("LoadFolders.xml"):
         try:
-            tree = etree.parse(str(load_folders_file))
+            tree = etree.parse(str(mod_path / "LoadFolders.xml"))
             versions = [""] + CONFIG['versions']['targets']
             for version in versions:
                 xpath_query = f'/loadFolders/li/text()' if not version else f'//v{version}/li/text()'
                 for path_str in tree.xpath(xpath_query):
-                    cleaned_path = path_str.strip().replace('\\', '/')
-                    full_path = mod_path if cleaned_path == '/' else mod_path / cleaned_path
-                    if full_path not in content_folders_in_order:
-                        content_folders_in_order.append(full_path)
+                    content_rel = resolve_content_folder(path_str)
+                    if content_rel is not None and content_rel not in content_folders_in_order:
+                        content_folders_in_order.append(content_rel)
         except etree.XMLSyntaxError:
             content_folders_in_order = []
 
     if not content_folders_in_order:
         print(f"  -> 未找到或无法解析LoadFolders.xml, 将在默认路径中扫描。")
-        content_folders_in_order.append(mod_path)
+        content_folders_in_order.append("")
         for version in CONFIG['versions']['targets']:
-            version_path = mod_path / version
-            if version_path.is_dir():
-                content_folders_in_order.append(version_path)
+            if mod_index.is_dir(version):
+                content_folders_in_order.append(version)
 
-    for content_path in content_folders_in_order:
-        if not content_path.is_dir(): continue
+    for content_rel in content_folders_in_order:
+        if not mod_index.is_dir(content_rel): continue
         for target in target_subfolders:
-            search_path = content_path / target
-            if search_path.is_dir():
-                for f in search_path.rglob("*.xml"):
-                    unique_key = f.relative_to(mod_path)
-                    found_files_map[unique_key] = f
-    return sorted(list(found_files_map.values()))
+            search_rel = f"{content_rel}/{target}" if content_rel else target
+            for rel in mod_index.files_under(search_rel, ".xml"):
+                found_files_map[rel] = mod_path / rel
+    return [found_files_map[rel] for rel in sorted(found_files_map, key=mod_index.path_sort_key)]
+
 
+class TranslationMemoryStore:
+    """
+    基于SQLite (WAL模式) 的持久化翻译记忆库，以 (Mod ID, key, 原文哈希) 为主键。
+    旧汉化包中的 translation_cache.json 只在文件变化时才会被重新导入，
+    同一个数据库文件在批量处理多个项目配置时共享。
+    只读模式(read_only=True，预估模式使用)下把已有的数据库复制到内存中，导入只作用于这份副本，磁盘上的文件保持不变。
+    """
 
-def build_translation_memory(prev_ids: List[str], workshop_path: Path) -> Dict[str, dict]:
-    if not prev_ids: return {}
+    def __init__(self, db_path: Path, read_only: bool = False):
+        self.db_path = db_path
+        if read_only:
+            self.conn = sqlite3.connect(":memory:")
+            if db_path.is_file():
+                # immutable=1: WAL模式的数据库以普通只读方式打开时仍会创建 -wal/-shm 文件
+                source = sqlite3.connect(f"{db_path.as_uri()}?mode=ro&immutable=1", uri=True)
+                try:
+                    source.backup(self.conn)
+                finally:
+                    source.close()
+        else:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(str(db_path))
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                mod_id TEXT NOT NULL, key TEXT NOT NULL, source_hash TEXT NOT NULL,
+                en TEXT NOT NULL, cn TEXT, context TEXT, source_file TEXT NOT NULL,
+                PRIMARY KEY (mod_id, key, source_hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_key ON entries (key, source_hash);
+            CREATE TABLE IF NOT EXISTS imported_files (
+                path TEXT PRIMARY KEY, mod_id TEXT NOT NULL, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def source_hash(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def import_cache_file(self, mod_id: str, file_path: Path) -> bool:
+        """导入一个 translation_cache.json；文件自上次导入后未变化时直接跳过并返回False。"""
+        stat = file_path.stat()
+        row = self.conn.execute("SELECT mtime_ns, size FROM imported_files WHERE path = ?",
+                                (str(file_path),)).fetchone()
+        if row == (stat.st_mtime_ns, stat.st_size):
+            return False
+
+        with file_path.open('r', encoding='utf-8') as f:
+            data = json.load(f)
+        rows = [(mod_id, key, self.source_hash(entry.get('en', '')), entry.get('en', ''), entry.get('cn'),
+                 entry.get('context'), str(file_path))
+                for key, entry in data.items() if isinstance(entry, dict) and not entry.get('validation')]
+        with self.conn:
+            self.conn.execute("DELETE FROM entries WHERE source_file = ?", (str(file_path),))
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO imported_files VALUES (?, ?, ?, ?)",
+                              (str(file_path), mod_id, stat.st_mtime_ns, stat.st_size))
+        return True
+
+    def count_entries(self, mod_ids: List[str]) -> int:
+        if not mod_ids: return 0
+        placeholders = ",".join("?" * len(mod_ids))
+        return self.conn.execute(f"SELECT COUNT(*) FROM entries WHERE mod_id IN ({placeholders})",
+                                 mod_ids).fetchone()[0]
+
+    def view(self, mod_ids: List[str]) -> 'TranslationMemory':
+        return TranslationMemory(self, mod_ids)
+
+    def close(self):
+        self.conn.close()
+
+
+class TranslationMemory:
+    """某个项目可见的翻译记忆（仅限其 previous 列表中的旧汉化包）。"""
+
+    MATCH_TIERS = ("exact", "normalized", "fuzzy", "similar", "miss")
+
+    def __init__(self, store: Optional[TranslationMemoryStore], mod_ids: List[str]):
+        self.store = store
+        self.mod_ids = list(mod_ids)
+        # 与旧版 memory.update 的覆盖顺序一致：列表中靠后的汉化包优先
+        self.priority = {mod_id: i for i, mod_id in enumerate(self.mod_ids)}
+        self.stats = Counter()
+        # 近似匹配提示的token统计：条目数、提示本身（变化片段+旧译文）的token数、不再附带的旧原文的token数
+        self.hint_stats = Counter()
+        self.similar_index = None
+        self.similar_cache = {}
+
+    def lookup(self, key: str) -> List[dict]:
+        """返回该 key 的全部记忆条目（不论原文是否变化），按优先级从高到低排列。"""
+        if self.store is None or not self.mod_ids: return []
+        placeholders = ",".join("?" * len(self.mod_ids))
+        rows = self.store.conn.execute(
+            f"SELECT mod_id, en, cn, context FROM entries WHERE key = ? AND mod_id IN ({placeholders})",
+            [key] + self.mod_ids).fetchall()
+        rows.sort(key=lambda row: self.priority[row[0]], reverse=True)
+        return [{'en': en, 'cn': cn, 'context': context} for _, en, cn, context in rows]
+
+    def _build_similar_index(self):
+        """为跨 key 的近似匹配构建词元倒排索引：每段原文只保留优先级最高的一条有效译文。"""
+        entries, postings = [], {}
+        if self.store is not None and self.mod_ids:
+            placeholders = ",".join("?" * len(self.mod_ids))
+            rows = self.store.conn.execute(
+                f"SELECT key, mod_id, en, cn, context FROM entries WHERE mod_id IN ({placeholders})",
+                self.mod_ids).fetchall()
+            rows.sort(key=lambda row: self.priority[row[1]], reverse=True)
+            seen = set()
+            for key, _, en, cn, context in rows:
+                if not isinstance(en, str) or not isinstance(cn, str) or en in seen: continue
+                if cn.startswith(ERROR_PREFIX) or cn.startswith(ORIGINAL_PREFIX): continue
+                seen.add(en)
+                tokens = set(GlossaryIndex.tokenize(en))
+                for token in tokens:
+                    postings.setdefault(token, []).append(len(entries))
+                entries.append(({'key': key, 'en': en, 'cn': cn, 'context': context}, tokens))
+        self.similar_index = (entries, postings)
+
+    def similar_entries(self, text: str, threshold: float, limit: int = 3) -> List[dict]:
+        """
+        跨 key 查找原文与 text 相近的记忆条目，交给 find_fuzzy 逐字比较。索引在第一次查询时构建。
+        候选须与 text 的词元 Dice 系数 (2|A∩B| / (|A|+|B|)) 不低于阈值；按前缀过滤只查最少见的
+        n - ceil(threshold * n / (2 - threshold)) + 1 个词元，满足条件的条目必定包含其中之一，
+        常见词的长倒排表不会被扫描。返回系数最高的至多 limit 个条目；同一段原文（如各材质的生成物品）只查询一次。
+        """
+        cache_key = (text, threshold, limit)
+        if cache_key in self.similar_cache: return self.similar_cache[cache_key]
+        if self.similar_index is None: self._build_similar_index()
+        entries, postings = self.similar_index
+        tokens = set(GlossaryIndex.tokenize(text))
+        scored = []
+        if tokens:
+            prefix_size = max(1, len(tokens) - math.ceil(threshold * len(tokens) / (2 - threshold)) + 1)
+            rarest = sorted(tokens, key=lambda token: len(postings.get(token, ())))[:prefix_size]
+            # 系数达到阈值时，两者的词元数之比必定在 [t/(2-t), (2-t)/t] 之内
+            min_size, max_size = threshold * len(tokens) / (2 - threshold), (2 - threshold) * len(tokens) / threshold
+            for index in {index for token in rarest for index in postings.get(token, ())}:
+                entry_tokens = entries[index][1]
+                if not min_size <= len(entry_tokens) <= max_size: continue
+                dice = 2 * len(tokens & entry_tokens) / (len(tokens) + len(entry_tokens))
+                if dice >= threshold: scored.append((-dice, index))
+            scored.sort()
+        result = self.similar_cache[cache_key] = [entries[index][0] for _, index in scored[:limit]]
+        return result
+
+    def fingerprint(self) -> str:
+        """可见旧汉化包缓存文件的指纹，任何一个被重新导入都会改变它。"""
+        if self.store is None or not self.mod_ids: return fingerprint([])
+        placeholders = ",".join("?" * len(self.mod_ids))
+        rows = self.store.conn.execute(
+            f"SELECT path, mod_id, mtime_ns, size FROM imported_files WHERE mod_id IN ({placeholders}) ORDER BY path",
+            self.mod_ids).fetchall()
+        return fingerprint([self.mod_ids, rows])
+
+    def report(self):
+        total = sum(self.stats.values())
+        if not total: return
+        labels = {"exact": "完全一致", "normalized": "仅空白/大小写/末尾标点变化", "fuzzy": "近似(提示模型更新)",
+                  "similar": "其它条目的近似译文(提示模型更新)", "miss": "未命中"}
+        parts = [f"{labels[tier]} {self.stats[tier]} ({self.stats[tier] / total:.1%})" for tier in self.MATCH_TIERS]
+        print(f"翻译记忆命中统计 (共 {total} 条): " + "，".join(parts))
+        if self.hint_stats["items"]:
+            print(f"近似匹配提示: {self.hint_stats['items']} 条，约 {self.hint_stats['hint_tokens']} 个输入token"
+                  f"（只发送原文的变化片段，省去整段旧原文约 {self.hint_stats['omitted_source_tokens']} 个token）")
+
+    def __len__(self) -> int:
+        return self.store.count_entries(self.mod_ids) if self.store is not None else 0
+
+
+_MEMORY_STORES: Dict[tuple, TranslationMemoryStore] = {}
+
+
+def close_translation_memory_stores():
+    for store in _MEMORY_STORES.values():
+        store.close()
+    _MEMORY_STORES.clear()
+
+
+def get_translation_memory_store() -> TranslationMemoryStore:
+    """按配置的数据库路径获取记忆库；同一进程内批量处理多个项目时复用同一个连接。预估模式下以只读方式打开。"""
+    db_path_str = CONFIG['system'].get('translation_memory_db', DEFAULT_CONFIG['system']['translation_memory_db'])
+    db_path = (BASE_WORKING_DIR / db_path_str).resolve()
+    read_only = CONFIG['system'].get('dry_run', False)
+    key = (db_path, read_only)
+    if key not in _MEMORY_STORES:
+        _MEMORY_STORES[key] = TranslationMemoryStore(db_path, read_only)
+    return _MEMORY_STORES[key]
+
+
+def build_translation_memory(prev_ids: List[str], workshop_path: Path) -> TranslationMemory:
+    if not prev_ids: return TranslationMemory(None, [])
     print("--- 正在构建三方校对记忆库 ---")
-    memory = {}
+    store = get_translation_memory_store()
+    file_index = get_workshop_file_index()
     mod_content_path = workshop_path / CONFIG['system']['rimworld_app_id']
+    imported_count = 0
+    from tqdm import tqdm
     for mod_id in tqdm(prev_ids, desc="扫描旧汉化包"):
         mod_path = mod_content_path / mod_id
         if not mod_path.is_dir():
             print(f"\n警告: 找不到Mod {mod_id}，跳过。")
             continue
-        for file_path in mod_path.rglob("translation_cache.json"):
+        for rel in file_index.get(mod_path).files_named("translation_cache.json"):
+            file_path = mod_path / rel
             try:
-                with file_path.open('r', encoding='utf-8') as f:
-                    memory.update(json.load(f))
+                imported_count += store.import_cache_file(mod_id, file_path)
             except (json.JSONDecodeError, IOError) as e:
                 print(f"  -> 警告: 读取或解析缓存文件失败: {file_path}, 错误: {e}")
-    print(f"\n构建完成！翻译记忆库包含 {len(memory)} 个条目。\n")
+    if not CONFIG['system'].get('dry_run', False):
+        file_index.save()
+    memory = store.view(prev_ids)
+    print(f"\n构建完成！本次导入 {imported_count} 个缓存文件，翻译记忆库包含 {len(memory)} 个条目。\n")
     return memory
 
 
-def get_setup_prompt() -> str:
+class GlossaryIndex:
+    """
+    术语表的词元前缀树索引，每次运行只构建一次。
+    术语与待查文本使用同一套分词和归一化（小写、去掉末尾的复数s），
+    查询时从文本的每个词元出发沿前缀树匹配，耗时与文本长度成正比，与术语表大小无关。
+    """
+
+    TERMINAL = ""  # 分词结果不会产生空字符串，可安全地用作终止标记
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['\-][a-z0-9]+)*")
+
+    def __init__(self, glossary: Dict[str, str]):
+        self.root = {}
+        for en, cn in glossary.items():
+            tokens = self.tokenize(en)
+            if not tokens: continue
+            node = self.root
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node[self.TERMINAL] = (en, cn)
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        tokens = cls.TOKEN_PATTERN.findall(text.lower())
+        return [t[:-1] if len(t) > 3 and t.endswith('s') and not t.endswith('ss') else t for t in tokens]
+
+    def find_terms(self, texts: List[str]) -> Dict[str, str]:
+        """返回在给定文本中出现过的术语 (英文 -> 中文)，按首次出现的顺序排列。"""
+        found = {}
+        for text in texts:
+            tokens = self.tokenize(text)
+            for start in range(len(tokens)):
+                node = self.root
+                for token in tokens[start:]:
+                    node = node.get(token)
+                    if node is None: break
+                    if self.TERMINAL in node:
+                        en, cn = node[self.TERMINAL]
+                        found.setdefault(en, cn)
+        return found
+
+
+def format_glossary(glossary: Dict[str, str]) -> str:
+    return "\n".join(f"- '{en.lower()}': '{cn}'" for en, cn in glossary.items())
+
+
+def get_setup_prompt(include_glossary: bool = True) -> str:
     base_system_prompt = """你是一个为游戏《边缘世界》(RimWorld) 设计的专业级翻译引擎。你的任务是将用户提供的JSON对象中的 `source_text` 字段翻译成简体中文，并填入 `translated_text` 字段。
 请严格遵守以下规则：
 1.  **保持键值不变**: 绝对不要修改 `key`、`source_text` 或 `context_info` 字段。
@@ -534,25 +1414,83 @@ def get_setup_prompt() -> str:
 3.  **利用上下文**: 如果提供了 `context_info` 字段，你必须参考它来生成更地道的翻译。例如，如果 `source_text` 是 "Bundle A"，而 `context_info` 包含 "Leathery"，你应该倾向于翻译成“A型皮革捆堆”或“A型皮革捆包”，而不是简单的“A型捆堆”。
 4.  **返回完整JSON**: 你的输出必须是完整的、包含所有原始条目的JSON数组。
 5.  **处理换行符标记**: 文本中的 `[BR]` 标记是换行符占位符，必须在译文中原样保留。"""
-    glossary_prompt_part = "6. **术语统一**: 这是最重要的规则。请严格参考以下术语表进行翻译...\n"
-    glossary_items = [f"- '{en.lower()}': '{cn}'" for en, cn in RIMWORLD_GLOSSARY.items()]
-    glossary_prompt_part += "\n".join(glossary_items)
+    if include_glossary:
+        glossary_prompt_part = "6. **术语统一**: 这是最重要的规则。请严格参考以下术语表进行翻译...\n"
+        glossary_prompt_part += format_glossary(PROJECT_GLOSSARY)
+    else:
+        glossary_prompt_part = "6. **术语统一**: 这是最重要的规则。每次请求若附带了术语表，请严格参考其中的译名进行翻译。"
     return f"{base_system_prompt}\n\n{glossary_prompt_part}\n\n我明白了这些规则，请开始提供需要翻译的JSON内容。"
 
 
 def convert_dict_to_json_items(data: Dict[str, dict]) -> List[Dict[str, str]]:
     items = []
     for k, v_dict in data.items():
-        items.append({
+        item = {
             "key": k,
             "source_text": v_dict['text'].replace('\\n', '[BR]').replace('\n', '[BR]'),
             "translated_text": "",
             "context_info": v_dict.get('context')
-        })
+        }
+        # 近似匹配的条目附带旧译文与原文的变化片段（不附带整段旧原文），模型只需在旧译文上做最小修改
+        if v_dict.get('previous_cn'):
+            item["previous_translation"] = v_dict['previous_cn'].replace('\\n', '[BR]')
+            item["source_changes"] = v_dict['source_changes']
+        items.append(item)
     return items
 
 
-def convert_parsed_json_to_dict(parsed_items: List[TranslationItem]) -> Dict[str, str]:
+# 译文必须原样保留的占位符与标记：{0}/{PAWN_label} 格式符、[PAWN_nameDef]/[BR] 方括号符号、<color=...>/<b> 等标签、换行
+# 方括号只匹配真正的语法/规则符号（带下划线前缀的 [PAWN_nameDef]、[RECIPIENT_label] 等）与 [BR]，
+# [Deprecated] 这样的普通方括号文字可以随译文一起翻译
+PLACEHOLDER_COMMON_PATTERN = r"\{[^{}\s]*\}|\[BR\]|</?[A-Za-z]+(?:=[^<>]*)?>|\\n|\n"
+PLACEHOLDER_PATTERN = re.compile(r"\[[A-Za-z][A-Za-z0-9]*_\w+\]|" + PLACEHOLDER_COMMON_PATTERN)
+# 规则字段（RulePack 的 rulesStrings 等）中 [adjective]、[name] 这样不带下划线的方括号也是语法符号，
+# 规则开头的 "keyword->"（可带 (p=2) 之类的参数）同样不能翻译，否则游戏中的语法解析会失败
+RULES_FIELD_PATTERN = re.compile(r"(?:^|\.)rulesStrings(?:\.|$)")
+RULES_PLACEHOLDER_PATTERN = re.compile(r"^[A-Za-z_]\w*(?:\([^()]*\))?->|\[[A-Za-z]\w*\]|" + PLACEHOLDER_COMMON_PATTERN,
+                                       re.MULTILINE)
+LINE_BREAK_TOKENS = {"[BR]", "\\n", "\n"}
+
+
+def extract_placeholders(text: str, pattern: re.Pattern = PLACEHOLDER_PATTERN) -> Counter:
+    """提取文本中的占位符与标记（多重集合）。[BR]、\\n 转义与实际换行都视为同一种换行符。"""
+    tokens = Counter()
+    for token in pattern.findall(text):
+        if token in LINE_BREAK_TOKENS:
+            tokens["\\n"] += 1
+        elif token.startswith("<"):
+            tokens[token.lower().replace(" ", "")] += 1
+        else:
+            tokens[token] += 1
+    return tokens
+
+
+def validate_translation(source_text: str, translated_text: str, key: Optional[str] = None) -> List[str]:
+    """
+    比较原文与译文中的占位符与标记，返回问题描述；一致时返回空列表。
+    key 是规则字段（路径中含 rulesStrings）时，不带下划线的 [word] 符号与 "keyword->" 前缀也必须原样保留。
+
+    >>> validate_translation("name->[adjective] [noun]", "name->[形容词] [名词]", "Names.rulePack.rulesStrings.0")
+    ['缺少 [adjective]×1, [noun]×1']
+    >>> validate_translation("name->[adjective] [noun]", "名字->[adjective][noun]", "Names.rulePack.rulesStrings.0")
+    ['缺少 name->×1']
+    >>> validate_translation("[Deprecated] Old gun", "[已弃用] 旧枪", "OldGun.label")
+    []
+    """
+    pattern = RULES_PLACEHOLDER_PATTERN if key and RULES_FIELD_PATTERN.search(key) else PLACEHOLDER_PATTERN
+    source_tokens = extract_placeholders(source_text, pattern)
+    translated_tokens = extract_placeholders(translated_text, pattern)
+    if source_tokens == translated_tokens: return []
+    problems = []
+    missing, extra = source_tokens - translated_tokens, translated_tokens - source_tokens
+    if missing:
+        problems.append("缺少 " + ", ".join(f"{token}×{count}" for token, count in missing.items()))
+    if extra:
+        problems.append("多出 " + ", ".join(f"{token}×{count}" for token, count in extra.items()))
+    return problems
+
+
+def convert_parsed_json_to_dict(parsed_items: List[TranslationRecord]) -> Dict[str, str]:
     final_dict = {}
     for item in parsed_items:
         normalized_text = item.translated_text.replace('[BR]', '\\n').replace('\n', '\\n')
@@ -560,113 +1498,1733 @@ def convert_parsed_json_to_dict(parsed_items: List[TranslationItem]) -> Dict[str
     return final_dict
 
 
-def translate_with_json_mode(client: genai.Client, history: List[types.Content],
-                             items_to_translate: List[Dict[str, str]]) -> Optional[List[TranslationItem]]:
-    user_prompt = f"请翻译以下JSON数组中的条目:\n{json.dumps(items_to_translate, indent=2, ensure_ascii=False)}"
-    current_contents = history + [types.Content(role="user", parts=[types.Part.from_text(text=user_prompt)])]
+class RateLimiter:
+    """
+    API请求的客户端限流器（令牌桶），同一进程内所有并发工作线程共享。
+    - 请求桶与token桶分别按 rpm/60、tpm/60 每秒的速度补充，容量只有一个请求与一秒的token量，
+      请求因此被均匀地排开，吞吐量贴近配额而不会超出；单个请求的token数超过桶容量时先透支，之后补足；
+    - 收到429时速率减半（最低为配置值的1/8），并让所有线程一起暂停到 retry-after 提示的时间
+      （没有提示时按指数退避）；之后每次成功的请求逐步恢复速率（加性增、乘性减）。
+    rpm/tpm 为0表示不限制该项，此时只在收到429时统一暂停。
+    """
 
-    ai_config = CONFIG.get('ai_settings', DEFAULT_CONFIG['ai_settings'])
-    max_retries = ai_config['max_retries']
-    base_delay = ai_config['retry_delay']
-    temperature = ai_config['temperature']
+    MIN_SCALE = 0.125
+    RECOVERY_STEP = 0.05
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.rpm, self.tpm = float(rpm or 0), float(tpm or 0)
+        self.token_capacity = max(1.0, self.tpm / 60)
+        self.scale = 1.0
+        self.condition = threading.Condition()
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.request_level, self.token_level = 1.0, self.token_capacity
+        self.stats = {"requests": 0, "rate_limited": 0, "waited": 0.0}
+
+    def _refill(self, now: float):
+        elapsed, self.updated = now - self.updated, now
+        if self.rpm:
+            self.request_level = min(1.0, self.request_level + elapsed * self.rpm * self.scale / 60)
+        if self.tpm:
+            self.token_level = min(self.token_capacity, self.token_level + elapsed * self.tpm * self.scale / 60)
+
+    def acquire(self, tokens: int):
+        """阻塞直到可以发出一个估算为 tokens 个token的请求。"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if self.rpm and self.request_level < 1:
+                    wait = max(wait, (1 - self.request_level) * 60 / (self.rpm * self.scale))
+                needed = min(tokens, self.token_capacity)
+                if self.tpm and self.token_level < needed:
+                    wait = max(wait, (needed - self.token_level) * 60 / (self.tpm * self.scale))
+                if wait <= 0: break
+                self.condition.wait(wait)
+                self.stats["waited"] += time.monotonic() - now
+            if self.rpm: self.request_level -= 1
+            if self.tpm: self.token_level -= tokens
+            self.stats["requests"] += 1
+
+    def on_success(self, estimated_tokens: int, actual_tokens: Optional[int] = None):
+        """请求成功：逐步恢复速率，并用API返回的实际token数修正token桶。"""
+        with self.condition:
+            self.scale = min(1.0, self.scale + self.RECOVERY_STEP)
+            if self.tpm and actual_tokens:
+                self.token_level -= actual_tokens - estimated_tokens
+            self.condition.notify_all()
+
+    def on_rate_limited(self, delay: float):
+        """收到429：所有线程暂停 delay 秒，并降低速率（同一次暂停期间的多个429只降速一次）。"""
+        with self.condition:
+            now = time.monotonic()
+            self.stats["rate_limited"] += 1
+            if now >= self.blocked_until:
+                self.scale = max(self.MIN_SCALE, self.scale / 2)
+            self.blocked_until = max(self.blocked_until, now + delay)
+            self.request_level = min(self.request_level, 0.0)
+            self.token_level = min(self.token_level, 0.0)
+            self.condition.notify_all()
+
+    def summary(self) -> dict:
+        """配置的速率、当前的速率比例与累计统计（并行处理项目时也可以通过代理读取）。"""
+        with self.condition:
+            return {"rpm": self.rpm, "tpm": self.tpm, "scale": self.scale, "stats": dict(self.stats)}
+
+    def report(self):
+        summary = self.summary()
+        stats = summary["stats"]
+        if not stats["requests"]: return
+        rpm, tpm = summary["rpm"], summary["tpm"]
+        limits = [f"{rpm:g} 请求/分钟" if rpm else "", f"{tpm:g} token/分钟" if tpm else ""]
+        limits_text = "、".join(text for text in limits if text) or "未配置速率上限"
+        print(f"限流统计 ({limits_text}): {stats['requests']} 次请求，收到 {stats['rate_limited']} 次429，"
+              f"累计等待 {stats['waited']:.1f} 秒，当前速率为配置值的 {summary['scale']:.0%}。")
+
+
+_RATE_LIMITERS: Dict[tuple, RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+# 并行处理项目时由父进程启动的限流器服务，fork 出的工作进程通过它共享同一组限流器
+_RATE_LIMITER_MANAGER = None
+
+
+def create_shared_rate_limiter(key: tuple) -> RateLimiter:
+    """在限流器服务进程中执行：同一 (模型, rpm, tpm) 的所有请求方得到同一个限流器。"""
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            _RATE_LIMITERS[key] = RateLimiter(key[1], key[2])
+        return _RATE_LIMITERS[key]
+
+
+def start_rate_limiter_manager(context):
+    """
+    启动托管限流器的服务进程。并行处理项目时各工作进程通过代理调用服务进程中的同一组令牌桶，
+    所有项目合计的请求速率因此仍不超过配置的配额，429 引起的暂停与降速也对所有进程同时生效；
+    限流统计相应地是所有项目的合计。
+    """
+    from multiprocessing.managers import BaseManager, BaseProxy
+
+    class RateLimiterProxy(BaseProxy):
+        _exposed_ = ("acquire", "on_success", "on_rate_limited", "summary")
+
+        def acquire(self, tokens: int):
+            self._callmethod("acquire", (tokens,))
+
+        def on_success(self, estimated_tokens: int, actual_tokens: Optional[int] = None):
+            self._callmethod("on_success", (estimated_tokens, actual_tokens))
+
+        def on_rate_limited(self, delay: float):
+            self._callmethod("on_rate_limited", (delay,))
+
+        def summary(self) -> dict:
+            return self._callmethod("summary")
+
+        report = RateLimiter.report  # 在调用方进程中打印
+
+    class RateLimiterManager(BaseManager):
+        pass
+
+    RateLimiterManager.register("rate_limiter", callable=create_shared_rate_limiter, proxytype=RateLimiterProxy)
+    manager = RateLimiterManager(ctx=context)
+    manager.start()
+    return manager
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    取得当前模型的共享限流器。速率按 [system.rate_limits."模型名"] 中的 rpm/tpm 设置，
+    未单独设置时使用 requests_per_minute / tokens_per_minute；开启旧的 slow_mode 时相当于每 slow_mode_delay 秒一个请求。
+    并行处理项目时返回限流器服务中对应限流器的代理。
+    """
+    system_config = CONFIG['system']
+    defaults = DEFAULT_CONFIG['system']
+    model = system_config['gemini_model']
+    limits = system_config.get('rate_limits', {}).get(model, {})
+    rpm = limits.get('rpm', system_config.get('requests_per_minute', defaults['requests_per_minute']))
+    tpm = limits.get('tpm', system_config.get('tokens_per_minute', defaults['tokens_per_minute']))
+    if not rpm and system_config.get('slow_mode', False):
+        rpm = 60 / max(0.001, system_config.get('slow_mode_delay', defaults['slow_mode_delay']))
+    key = (model, rpm, tpm)
+    with _RATE_LIMITERS_LOCK:
+        if key not in _RATE_LIMITERS:
+            _RATE_LIMITERS[key] = (RateLimiter(rpm, tpm) if _RATE_LIMITER_MANAGER is None
+                                   else _RATE_LIMITER_MANAGER.rate_limiter(key))
+        return _RATE_LIMITERS[key]
+
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    """从API错误中读取建议的重试等待秒数（响应头 retry-after 或错误详情中的 RetryInfo.retryDelay）。"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        try:
+            value = headers.get('retry-after')
+            if value: return float(value)
+        except (TypeError, ValueError):
+            pass
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(error, 'details', None) or error))
+    return float(match.group(1)) if match else None
+
+
+# --- 翻译后端 ---
 
-    for attempt in range(max_retries):
+class BackendError(Exception):
+    """翻译后端的请求失败（不会自动重试）。"""
+
+
+class BackendRateLimitError(BackendError):
+    """翻译后端的频率限制 (429)。retry_after 为服务端建议的等待秒数，没有时为None。"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BatchRequestError(Exception):
+    """
+    与请求内容无关的失败：频率限制重试耗尽（配额用完）或请求本身失败（服务错误、网络中断）。
+    拆分批次重试无济于事，只会成倍增加请求，因此调用方应放弃整个批次。
+    """
+
+
+class TranslationBackend(ABC):
+    """
+    翻译后端接口（抽象基类，未实现 translate_batch 的后端在创建时就会报错）。contents 是与具体API无关的消息列表（{"role": "user"/"model", "text": ...}），
+    translate_batch 发送一次请求并返回 (解析出的条目列表或None, 实际输入token数, 输出token数)，
+    后端无法提供的token数为None；条目列表为None表示模型给出了空结果；频率限制抛出 BackendRateLimitError，其它失败抛出 BackendError。
+    重试、限流与失败恢复都在后端之外统一处理。
+    """
+
+    name = "翻译后端"
+
+    @abstractmethod
+    def translate_batch(self, contents: List[Dict[str, str]], items: List[Dict[str, str]]
+                        ) -> tuple[Optional[List[TranslationRecord]], Optional[int], Optional[int]]:
+        """发送一次请求，返回 (解析出的条目列表或None, 实际输入token数, 输出token数)。"""
+
+    def count_tokens(self, contents: List[Dict[str, str]]) -> int:
+        """估算请求的输入token数（本地估算，不调用API）。"""
+        return estimate_contents_tokens(contents)
+
+
+class GeminiBackend(TranslationBackend):
+    """通过 google-genai 的JSON模式调用 Gemini。客户端在第一个需要调用API的批次出现时才创建。"""
+
+    name = "Gemini"
+
+    def __init__(self, client: Optional[genai.Client] = None):
+        self._client = client
+        self.lock = threading.Lock()
+
+    @property
+    def client(self) -> genai.Client:
+        with self.lock:
+            if self._client is None:
+                self._client = create_client()
+            return self._client
+
+    def translate_batch(self, contents: List[Dict[str, str]], items: List[Dict[str, str]]
+                        ) -> tuple[Optional[List[TranslationRecord]], Optional[int], Optional[int]]:
         try:
-            response = client.models.generate_content(
+            response = self.client.models.generate_content(
                 model=CONFIG['system']['gemini_model'],
-                contents=current_contents,
+                contents=[types.Content(role=message["role"], parts=[types.Part.from_text(text=message["text"])])
+                          for message in contents],
                 # 这是JSON模式的核心配置
                 config=types.GenerateContentConfig(
                     response_mime_type="application/json",
-                    response_schema=TranslationResponse,
-                    temperature=temperature
+                    response_schema=response_models()[1],
+                    temperature=CONFIG.get('ai_settings', DEFAULT_CONFIG['ai_settings'])['temperature']
                 )
             )
-            if hasattr(response, 'parsed') and response.parsed is not None:
-                return response.parsed.translations
-            else:
-                print("  -> 警告: API返回了空结果，可能是因为安全设置。")
-                return None
-
-        except APIError as e:
-            if e.code == 429 and attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                print(f"\n  -> 警告: 触发API频率限制。将在 {delay:.1f} 秒后重试 (第 {attempt + 1}/{max_retries} 次)...")
-                time.sleep(delay)
-            else:
-                print(f"在JSON模式下调用 Gemini 时发生API错误: {e}")
-                return None
+        except genai_errors.APIError as e:
+            if e.code == 429:
+                raise BackendRateLimitError(str(e), parse_retry_after(e)) from e
+            raise BackendError(f"API错误: {e}") from e
         except Exception as e:
             # 捕获和报告解析错误
-            print(f"在JSON模式下调用或解析Gemini响应时发生未知错误: {e}")
-            return None
+            raise BackendError(f"调用或解析响应时发生未知错误: {e}") from e
+        usage = getattr(response, 'usage_metadata', None)
+        parsed = getattr(response, 'parsed', None)
+        return ((parsed.translations if parsed is not None else None), getattr(usage, 'prompt_token_count', None),
+                getattr(usage, 'candidates_token_count', None))
 
-    print(f"  -> 错误: 重试 {max_retries} 次后仍失败。")
-    return None
 
+class MockBackend(TranslationBackend):
+    """
+    离线的确定性模拟后端，不联网也不消耗配额，用于基准测试与端到端回归测试。
+    译文为 "模拟译文: " 加原文（保留全部占位符）。可按 [system.mock_backend] 中的设置模拟请求延迟，
+    并按概率模拟429、请求失败与响应截断（丢失末尾的若干条目）。
+    随机性只取决于 seed、请求的条目与该请求的第几次重试，同样的输入总是得到同样的结果。
+    """
 
-def translate_and_save(client: genai.Client, history: List[types.Content], targets: Dict[str, dict],
-                       memory: Dict[str, dict], output_file_path: Path) -> Dict[str, dict]:
-    ERROR_PREFIX, ORIGINAL_PREFIX = "【API错误】", "【原文】"
-    to_translate_dict, final_translation_dict, new_cache_data = {}, {}, {}
+    name = "模拟后端"
+    TRANSLATION_PREFIX = "模拟译文: "
+
+    def __init__(self, settings: dict):
+        self.latency = float(settings.get('latency', 0.0))
+        self.rate_limit_probability = float(settings.get('rate_limit_probability', 0.0))
+        self.retry_after = settings.get('retry_after', 1.0)
+        self.failure_probability = float(settings.get('failure_probability', 0.0))
+        self.truncate_probability = float(settings.get('truncate_probability', 0.0))
+        self.seed = settings.get('seed', 0)
+        self.call_counts = Counter()
+        self.lock = threading.Lock()
+
+    def translate_batch(self, contents: List[Dict[str, str]], items: List[Dict[str, str]]
+                        ) -> tuple[Optional[List[TranslationRecord]], Optional[int], Optional[int]]:
+        request_key = fingerprint([self.seed, [[item['key'], item['source_text']] for item in items]])
+        with self.lock:
+            self.call_counts[request_key] += 1
+            attempt = self.call_counts[request_key]
+        rng = random.Random(f"{request_key}:{attempt}")
+        TranslationItem, TranslationResponse = response_models()
+        if self.latency:
+            time.sleep(self.latency * (0.5 + rng.random()))
+        if rng.random() < self.rate_limit_probability:
+            raise BackendRateLimitError("模拟的 429 RESOURCE_EXHAUSTED", self.retry_after)
+        if rng.random() < self.failure_probability:
+            raise BackendError("模拟的请求失败")
+        translations = [TranslationItem(key=item['key'], source_text=item['source_text'],
+                                        translated_text=self.TRANSLATION_PREFIX + item['source_text'])
+                        for item in items]
+        if len(translations) > 1 and rng.random() < self.truncate_probability:
+            translations = translations[:rng.randint(1, len(translations) - 1)]
+        response_tokens = estimate_tokens(TranslationResponse(translations=translations).model_dump_json())
+        return translations, self.count_tokens(contents), response_tokens
+
+
+def create_backend() -> TranslationBackend:
+    """按 [system] 中的 translation_backend 创建翻译后端："gemini"(默认) 或 "mock"(离线模拟)。"""
+    backend_name = CONFIG['system'].get('translation_backend', DEFAULT_CONFIG['system']['translation_backend'])
+    if backend_name == "mock":
+        settings = {**DEFAULT_CONFIG['system']['mock_backend'], **CONFIG['system'].get('mock_backend', {})}
+        print("使用离线模拟翻译后端，不会调用任何API。")
+        return MockBackend(settings)
+    if backend_name != "gemini":
+        print(f"错误: 未知的翻译后端 '{backend_name}'，可选值为 \"gemini\" 或 \"mock\"。")
+        sys.exit(1)
+    get_api_key()  # 尽早发现缺失的密钥；客户端本身延迟到第一次请求时创建
+    return GeminiBackend()
 
-    for key, new_data in targets.items():
-        new_en_text = new_data['text']
-        new_context = new_data.get('context')
-        if key in memory:
-            old_data = memory[key]
-            is_en_text_same = new_en_text == old_data.get('en', '')
-            is_context_same = new_context == old_data.get('context')
-            is_cn_text_valid = not (isinstance(old_data.get('cn'), str) and (
-                        old_data['cn'].startswith(ERROR_PREFIX) or old_data['cn'].startswith(ORIGINAL_PREFIX)))
-            if is_en_text_same and is_context_same and is_cn_text_valid:
-                final_translation_dict[key] = old_data['cn']
-                new_cache_data[key] = {'en': new_en_text, 'cn': old_data['cn'], 'context': new_context}
+
+def build_request_contents(history: List[Dict[str, str]], items_to_translate: List[Dict[str, str]],
+                           glossary: Optional[Dict[str, str]] = None) -> List[Dict[str, str]]:
+    """在对话历史之后追加本批次的请求（术语、近似匹配说明与待翻译的JSON条目）。"""
+    user_prompt = f"请翻译以下JSON数组中的条目:\n{json.dumps(items_to_translate, indent=2, ensure_ascii=False)}"
+    if any("previous_translation" in item for item in items_to_translate):
+        user_prompt = ("带有 `previous_translation` 的条目在翻译记忆中有原文相近的旧译文，`source_changes` 以 "
+                       "`\"旧片段\" → \"新片段\"`、`+ \"新增片段\"`、`- \"删除片段\"` 列出 `source_text` 相对旧原文的变化"
+                       "（为空表示原文相同）。请以旧译文为基础，只按这些变化做最小改动后填入 `translated_text`。\n\n"
+                       + user_prompt)
+    if glossary:
+        user_prompt = f"本批次涉及的术语 (请严格遵循):\n{format_glossary(glossary)}\n\n{user_prompt}"
+    return history + [{"role": "user", "text": user_prompt}]
+
+
+def translate_with_json_mode(backend: TranslationBackend, history: List[Dict[str, str]],
+                             items_to_translate: List[Dict[str, str]],
+                             glossary: Optional[Dict[str, str]] = None) -> Optional[List[TranslationRecord]]:
+    current_contents = build_request_contents(history, items_to_translate, glossary)
+
+    ai_config = CONFIG.get('ai_settings', DEFAULT_CONFIG['ai_settings'])
+    max_retries = ai_config['max_retries']
+    base_delay = ai_config['retry_delay']
+    rate_limiter = get_rate_limiter()
+    request_tokens = backend.count_tokens(current_contents)
+
+    with RUN_METRICS.request(len(items_to_translate), request_tokens) as record:
+        for attempt in range(max_retries):
+            record["attempts"] += 1
+            try:
+                rate_limiter.acquire(request_tokens)
+                call_started = time.perf_counter()
+                try:
+                    translations, prompt_tokens, response_tokens = backend.translate_batch(current_contents,
+                                                                                           items_to_translate)
+                finally:
+                    record["latency"] += time.perf_counter() - call_started
+                record["prompt_tokens"], record["response_tokens"] = prompt_tokens, response_tokens
+                rate_limiter.on_success(request_tokens, prompt_tokens)
+                if translations is not None:
+                    record["ok"] = True
+                    return translations
+                else:
+                    record["error"] = "empty"
+                    print("  -> 警告: API返回了空结果，可能是因为安全设置。")
+                    return None
+
+            except BackendRateLimitError as e:
+                record["rate_limited"] += 1
+                record["error"] = str(e)
+                if attempt < max_retries - 1:
+                    delay = e.retry_after if e.retry_after is not None else base_delay * (2 ** attempt) + random.uniform(0, 1)
+                    print(f"\n  -> 警告: 触发API频率限制。所有请求将暂停 {delay:.1f} 秒并降低速率后重试 (第 {attempt + 1}/{max_retries} 次)...")
+                    # 暂停由共享的限流器统一执行，下一次 acquire 会等到暂停结束
+                    rate_limiter.on_rate_limited(delay)
+                else:
+                    print(f"在JSON模式下调用 {backend.name} 时发生API错误: {e}")
+                    raise BatchRequestError(f"触发频率限制，重试 {max_retries} 次后仍失败") from e
+            except BackendError as e:
+                record["error"] = str(e)
+                print(f"在JSON模式下调用 {backend.name} 时发生错误: {e}")
+                raise BatchRequestError(f"请求失败: {e}") from e
+
+        raise BatchRequestError(f"重试 {max_retries} 次后仍失败")
+
+
+ERROR_PREFIX, ORIGINAL_PREFIX = "【API错误】", "【原文】"
+
+
+MATCH_TOKEN_PATTERN = re.compile(r"(\{[^{}]*\}|\[[^\[\]]*\])")
+TRAILING_PUNCTUATION = ".!?:;,。！？：；，…"
+
+
+def normalize_for_match(text: str) -> str:
+    """
+    合并连续空白、忽略大小写并去掉末尾标点，用于判断原文是否只有这些无关紧要的变化。
+    数字（含小数点、千位分隔符）与 {...}、[...] 占位符原样保留，它们的任何变化都需要重新翻译。
+    """
+    parts = MATCH_TOKEN_PATTERN.split(" ".join(text.split()))
+    normalized = "".join(part if i % 2 else part.casefold() for i, part in enumerate(parts))
+    return normalized.rstrip(TRAILING_PUNCTUATION + " ")
+
+
+def match_memory(new_data: dict, candidates: List[dict], fuzzy_threshold: float) -> tuple[str, Optional[dict]]:
+    """
+    在同一 key 的记忆条目中按层级匹配，返回 (层级, 条目)：
+    - exact: 原文与上下文完全一致，直接复用。
+    - normalized: 上下文一致且原文仅有空白、大小写或末尾标点差异，直接复用。
+    - fuzzy: 原文相似度不低于阈值，作为“更新旧译文”的提示交给模型。
+    - miss: 无可用条目（plan_translation 随后会跨 key 查找近似译文，命中时记为 similar）。
+    """
+    new_en_text, new_context = new_data['text'], new_data.get('context')
+    valid = [c for c in candidates if isinstance(c.get('cn'), str) and not (
+            c['cn'].startswith(ERROR_PREFIX) or c['cn'].startswith(ORIGINAL_PREFIX))]
+    for old_data in valid:
+        if old_data.get('en', '') == new_en_text and old_data.get('context') == new_context:
+            return "exact", old_data
+    normalized_text = normalize_for_match(new_en_text)
+    for old_data in valid:
+        if old_data.get('context') == new_context and normalize_for_match(old_data.get('en', '')) == normalized_text:
+            return "normalized", old_data
+
+    best = find_fuzzy(new_en_text, valid, fuzzy_threshold)
+    return ("fuzzy", best) if best is not None else ("miss", None)
+
+
+def find_fuzzy(new_en_text: str, candidates: List[dict], fuzzy_threshold: float) -> Optional[dict]:
+    """
+    返回原文与 new_en_text 相似度最高且不低于阈值的条目；阈值为1时关闭近似匹配。
+    SequenceMatcher 缓存第二个序列的索引，因此把 new_en_text 固定为第二个序列，只替换候选原文。
+    """
+    best, best_ratio = None, 0.0
+    if fuzzy_threshold < 1:
+        matcher = difflib.SequenceMatcher(None, autojunk=False)
+        matcher.set_seq2(new_en_text)
+        for old_data in candidates:
+            old_en_text = old_data.get('en', '')
+            # 相似度不超过 2*较短长度/总长度，长度相差太大的候选无需比较
+            if 2 * min(len(old_en_text), len(new_en_text)) < fuzzy_threshold * (len(old_en_text) + len(new_en_text)):
                 continue
-        to_translate_dict[key] = new_data
+            matcher.set_seq1(old_en_text)
+            # quick_ratio 是相似度的上界，达不到阈值或当前最佳的候选无需精确比较
+            if matcher.quick_ratio() < max(fuzzy_threshold, best_ratio): continue
+            ratio = matcher.ratio()
+            if ratio >= fuzzy_threshold and ratio > best_ratio:
+                best, best_ratio = old_data, ratio
+    return best
 
-    if to_translate_dict:
-        if CONFIG['system'].get('slow_mode', False): time.sleep(CONFIG['system'].get('slow_mode_delay', 2))
-        json_items_to_translate = convert_dict_to_json_items(to_translate_dict)
-        parsed_result = translate_with_json_mode(client, history, json_items_to_translate)
 
-        if parsed_result:
-            translated_dict = convert_parsed_json_to_dict(parsed_result)
-            response_for_history = TranslationResponse(translations=parsed_result)
-            history.append(types.Content(role="user", parts=[
-                types.Part.from_text(text=json.dumps(json_items_to_translate, ensure_ascii=False))]))
-            history.append(types.Content(role="model", parts=[
-                types.Part.from_text(text=response_for_history.model_dump_json(indent=2))]))
-
-            for key, original_data in to_translate_dict.items():
-                translated_text = translated_dict.get(key, f"{ORIGINAL_PREFIX}{original_data['text']}")
-                final_translation_dict[key] = translated_text
-                new_cache_data[key] = {'en': original_data['text'], 'cn': translated_text,
-                                       'context': original_data.get('context')}
+DIFF_TOKEN_PATTERN = re.compile(r"\s+|\w+|[^\w\s]")
+
+
+def describe_source_changes(old_text: str, new_text: str) -> str:
+    """
+    按单词比较新旧原文，把变化概括为 `"旧片段" → "新片段"`、`+ "新增片段"`、`- "删除片段"`，
+    代替整段旧原文发给模型。换行按提示中的 [BR] 形式显示，原文相同时返回空字符串。
+    """
+    old_tokens = DIFF_TOKEN_PATTERN.findall(old_text.replace('\\n', '[BR]').replace('\n', '[BR]'))
+    new_tokens = DIFF_TOKEN_PATTERN.findall(new_text.replace('\\n', '[BR]').replace('\n', '[BR]'))
+    changes = []
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False).get_opcodes():
+        old_part = json.dumps("".join(old_tokens[i1:i2]), ensure_ascii=False)
+        new_part = json.dumps("".join(new_tokens[j1:j2]), ensure_ascii=False)
+        if op == "replace":
+            changes.append(f"{old_part} → {new_part}")
+        elif op == "delete":
+            changes.append(f"- {old_part}")
+        elif op == "insert":
+            changes.append(f"+ {new_part}")
+    return "; ".join(changes)
+
+
+def plan_translation(targets: Dict[str, dict], memory: TranslationMemory) -> tuple[Dict[str, str], Dict[str, dict], Dict[str, dict]]:
+    """根据记忆库拆分条目：返回 (已确定的译文, 新缓存条目, 需要调用API翻译的条目)。"""
+    to_translate_dict, final_translation_dict, new_cache_data = {}, {}, {}
+    fuzzy_threshold = float(CONFIG.get('ai_settings', {}).get(
+        'fuzzy_match_threshold', DEFAULT_CONFIG['ai_settings']['fuzzy_match_threshold']))
+
+    for key, new_data in targets.items():
+        tier, old_data = match_memory(new_data, memory.lookup(key), fuzzy_threshold)
+        if tier == "miss" and fuzzy_threshold < 1:
+            # 同一 key 下没有可用的旧译文时，再在其它条目中查找原文相近的译文作为提示
+            candidates = [c for c in memory.similar_entries(new_data['text'], fuzzy_threshold) if c['key'] != key]
+            old_data = find_fuzzy(new_data['text'], candidates, fuzzy_threshold)
+            if old_data is not None: tier = "similar"
+        memory.stats[tier] += 1
+        if tier in ("exact", "normalized"):
+            final_translation_dict[key] = old_data['cn']
+            new_cache_data[key] = {'en': new_data['text'], 'cn': old_data['cn'], 'context': new_data.get('context')}
+        elif tier in ("fuzzy", "similar"):
+            source_changes = describe_source_changes(old_data['en'], new_data['text'])
+            to_translate_dict[key] = dict(new_data, previous_cn=old_data['cn'], source_changes=source_changes)
+            memory.hint_stats["items"] += 1
+            memory.hint_stats["hint_tokens"] += estimate_tokens(source_changes) + estimate_tokens(old_data['cn'])
+            memory.hint_stats["omitted_source_tokens"] += estimate_tokens(old_data['en'])
+        else:
+            to_translate_dict[key] = new_data
+    return final_translation_dict, new_cache_data, to_translate_dict
+
+
+def apply_translation_result(to_translate_dict: Dict[str, dict], parsed_result: Optional[List[TranslationRecord]],
+                             final_translation_dict: Dict[str, str], new_cache_data: Dict[str, dict],
+                             error_keys: Optional[set] = None):
+    """把API结果（或失败标记）合并进最终译文与缓存。error_keys 中的条目最后一次请求失败，标记为API错误。"""
+    translated_dict = convert_parsed_json_to_dict(parsed_result) if parsed_result else None
+    for key, original_data in to_translate_dict.items():
+        if translated_dict is not None and not (error_keys and key in error_keys):
+            translated_text = translated_dict.get(key, f"{ORIGINAL_PREFIX}{original_data['text']}")
         else:  # API call or parsing failed
-            for key, original_data in to_translate_dict.items():
-                error_text = f"{ERROR_PREFIX}{original_data['text']}"
-                final_translation_dict[key] = error_text
-                new_cache_data[key] = {'en': original_data['text'], 'cn': error_text,
-                                       'context': original_data.get('context')}
+            translated_text = f"{ERROR_PREFIX}{original_data['text']}"
+        final_translation_dict[key] = translated_text
+        new_cache_data[key] = {'en': original_data['text'], 'cn': translated_text,
+                               'context': original_data.get('context')}
 
-    if not final_translation_dict: return {}
 
+def write_translation_file(final_translation_dict: Dict[str, str], output_file_path: Path):
     output_file_path.parent.mkdir(parents=True, exist_ok=True)
     root = etree.Element("LanguageData")
     for key, value in sorted(final_translation_dict.items()):
         etree.SubElement(root, key).text = value
     tree = etree.ElementTree(root)
     tree.write(str(output_file_path), encoding='utf-8', xml_declaration=True, pretty_print=True)
-    return new_cache_data
 
 
-def process_standard_translation(client: genai.Client, history: List[types.Content], mod_path: Path, mod_info: Dict,
-                                 memory: Dict, output_path: Path) -> Dict[str, dict]:
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：ASCII字符约4个一个token，中文等其它字符约1个一个token。"""
+    ascii_count = len(text.encode('ascii', 'ignore'))
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+
+def estimate_contents_tokens(contents: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(message["text"]) for message in contents)
+
+
+def get_batch_token_budget() -> int:
+    """当前模型单个批次的token预算，可在 [ai_settings.batch_token_budgets] 中按模型名单独配置。"""
+    ai_config = CONFIG.get('ai_settings', {})
+    per_model = ai_config.get('batch_token_budgets', {})
+    default_budget = ai_config.get('batch_token_budget', DEFAULT_CONFIG['ai_settings']['batch_token_budget'])
+    return int(per_model.get(CONFIG['system']['gemini_model'], default_budget))
+
+
+class ConversationHistory:
+    """
+    单个Mod的对话历史。系统提示词始终保留，之后的问答按 [ai_settings] 中的 history_policy 裁剪：
+    - "full": 保留全部问答（旧行为，提示词长度随批次数增长）。
+    - "window": 只保留最近 history_max_exchanges 轮问答。
+    - "tokens": 保留估算token数不超过 history_max_tokens 的最近若干轮问答。
+    - "digest": 以一条紧凑的“已确定译名”摘要替代旧问答，并附带最近 history_max_exchanges 轮问答。
+    """
+
+    DIGEST_MAX_SOURCE_CHARS = 60
+
+    def __init__(self, system_prompt: str):
+        ai_config = CONFIG.get('ai_settings', {})
+        defaults = DEFAULT_CONFIG['ai_settings']
+        self.policy = ai_config.get('history_policy', defaults['history_policy'])
+        self.max_exchanges = int(ai_config.get('history_max_exchanges', defaults['history_max_exchanges']))
+        self.max_tokens = int(ai_config.get('history_max_tokens', defaults['history_max_tokens']))
+        self.digest_size = int(ai_config.get('history_digest_size', defaults['history_digest_size']))
+        self.head = [
+            {"role": "user", "text": system_prompt},
+            {"role": "model", "text": "好的，我明白了，请提供需要翻译的内容。"}
+        ]
+        self.exchanges = deque()  # (user_message, model_message, 估算token数)
+        self.digest = {}  # 短文本原文 -> 译文，按最近使用排序
+
+    def append(self, json_items: List[Dict[str, str]], parsed_result: List[TranslationRecord]):
+        user_text = json.dumps(json_items, ensure_ascii=False)
+        model_text = response_models()[1](translations=parsed_result).model_dump_json(indent=2)
+        self.exchanges.append(({"role": "user", "text": user_text}, {"role": "model", "text": model_text},
+                               estimate_tokens(user_text) + estimate_tokens(model_text)))
+
+        if self.policy == "digest":
+            # 只收录标签一类的短文本，它们正是需要保持译名一致的部分
+            source_by_key = {item['key']: item['source_text'] for item in json_items}
+            for item in parsed_result:
+                source_text = source_by_key.get(item.key)
+                if source_text and len(source_text) <= self.DIGEST_MAX_SOURCE_CHARS and item.translated_text:
+                    self.digest.pop(source_text, None)
+                    self.digest[source_text] = item.translated_text
+            while len(self.digest) > self.digest_size:
+                self.digest.pop(next(iter(self.digest)))
+
+        if self.policy in ("window", "digest"):
+            while len(self.exchanges) > self.max_exchanges:
+                self.exchanges.popleft()
+        elif self.policy == "tokens":
+            total = sum(tokens for _, _, tokens in self.exchanges)
+            while len(self.exchanges) > 1 and total > self.max_tokens:
+                total -= self.exchanges.popleft()[2]
+
+    def build_contents(self) -> List[Dict[str, str]]:
+        """生成发送给API的历史消息列表（快照）。"""
+        contents = list(self.head)
+        if self.policy == "digest" and self.digest:
+            digest_text = "以下是本Mod中已确定的译名，后续翻译请保持一致：\n" + "\n".join(
+                f"- '{en}': '{cn}'" for en, cn in self.digest.items())
+            contents.append({"role": "user", "text": digest_text})
+            contents.append({"role": "model", "text": "好的，我会沿用这些译名。"})
+        for user_message, model_message, _ in self.exchanges:
+            contents.append(user_message)
+            contents.append(model_message)
+        return contents
+
+
+# --- Def/Patch 文件的中间表示 ---
+
+DEF_IR_VERSION = 2
+
+
+def extract_field_paths(element: etree._Element, translatable_tags: List[str]) -> Dict[str, str]:
+    """
+    收集元素所有子孙节点中的可翻译字段，返回 {路径: 文本}。
+    路径由标签名组成，li 节点用它在同级 li 中的序号代替（如 comps.2.stages.0.label）。
+    单次自顶向下遍历，序号随遍历递增计算，耗时与子树大小成线性关系；
+    遍历按文档顺序进行，同一路径出现多次时以最后一次为准。
+    """
+    tags = set(translatable_tags)
+    fields = {}
+    stack = [(element, "")]
+    while stack:
+        node, path = stack.pop()
+        if node is not element and node.tag in tags and node.text and node.text.strip():
+            fields[path] = node.text.strip()
+        children = []
+        li_index = 0
+        for child in node:
+            tag = child.tag
+            if not isinstance(tag, str): continue
+            if tag == 'li':
+                part = str(li_index)
+                li_index += 1
+            else:
+                part = tag
+            children.append((child, f"{path}.{part}" if path else part))
+        stack.extend(reversed(children))
+    return fields
+
+
+TEMPLATE_XPATH = '//*[self::Defs or self::Patch]/*|//value/*'
+DEF_XPATH = '//*[defName] | //*[@Abstract="True" and @Name]'
+# 流式解析时的等价查询：在根节点的每个子元素的子树内进行（此时子元素的父节点仍是根节点）
+STREAM_TEMPLATE_XPATH = 'descendant-or-self::*[parent::Defs or parent::Patch or parent::value]'
+STREAM_DEF_XPATH = 'descendant-or-self::*[defName] | descendant-or-self::*[@Abstract="True" and @Name]'
+
+
+def build_template_ir(element: etree._Element, translatable_tags: List[str]) -> dict:
+    current_name_node = element.find("defName")
+    current_name = current_name_node.text.strip() if current_name_node is not None and current_name_node.text else element.get(
+        "Name")
+    parent_name = element.get("ParentName")
+    template = {"name": current_name, "parent": parent_name.strip() if parent_name else None,
+                "template_name": None, "fields": {}}
+    if element.get("Abstract", "False").lower() == 'true' and element.get("Name"):
+        template["template_name"] = element.get("Name")
+        template["fields"] = extract_field_paths(element, translatable_tags)
+    return template
+
+
+def build_def_ir(element: etree._Element, translatable_tags: List[str]) -> dict:
+    fields = extract_field_paths(element, translatable_tags)
+    def_name_node = element.find("defName")
+    return {
+        "type": element.tag,
+        "def_name": def_name_node.text.strip() if def_name_node is not None and def_name_node.text else None,
+        "name": element.get("Name"),
+        "parent": element.get("ParentName"),
+        "abstract": element.get("Abstract", "False").lower() == 'true',
+        "fields": fields,
+        "stuff_categories": [str(text) for text in element.xpath("stuffCategories/li/text()")],
+    }
+
+
+def parse_def_file(file_path: Path) -> Optional[dict]:
+    """
+    解析一个Def/Patch文件（每次运行只解析一次），生成全局学习与注入式翻译共用的紧凑中间表示：
+    - templates: Defs/Patch根节点及 value 节点下的定义，记录名称、父类、抽象模板名及其全部可翻译字段（含嵌套路径）；
+    - defs: 含 defName 或为带 Name 的抽象定义的元素，记录类型、名称、父类、抽象标记、
+      全部可翻译字段（路径 -> 文本）与 stuffCategories。
+    结果可JSON序列化，便于缓存到磁盘。解析失败时返回None。
+    开启 [system] 中的 streaming_extraction 时改用 iterparse 流式解析，结果完全相同。
+    """
+    translatable_tags = CONFIG['rules'].get('translatable_def_tags', [])
+    if is_streaming_extraction():
+        return stream_def_file(file_path, translatable_tags)
+    return parse_def_tree(file_path, translatable_tags)
+
+
+def parse_def_tree(file_path: Path, translatable_tags: List[str]) -> Optional[dict]:
+    """把整个文件读入一棵树后提取中间表示。"""
+    parser = etree.XMLParser(remove_blank_text=True, recover=True)
+    try:
+        tree = etree.parse(str(file_path), parser)
+    except etree.XMLSyntaxError as e:
+        print(f"警告：解析XML文件时发生错误 {file_path}: {e}")
+        return None
+    if tree.getroot() is None:
+        print(f"警告：解析XML文件时发生错误 {file_path}: 未找到根元素")
+        return None
+
+    templates = [build_template_ir(element, translatable_tags) for element in tree.xpath(TEMPLATE_XPATH)
+                 if isinstance(element.tag, str)]
+    defs = [build_def_ir(element, translatable_tags) for element in tree.xpath(DEF_XPATH)]
+    return {"templates": templates, "defs": defs}
+
+
+class DefParseError(Exception):
+    """Def/Patch文件解析失败（警告已打印）。"""
+
+
+class DefStreamFallback(Exception):
+    """根节点本身就是一个定义（极少见），它的字段需要整棵树，只能改用完整解析。"""
+
+
+def iter_def_file(file_path: Path, translatable_tags: List[str]) -> Iterator[tuple[List[dict], List[dict]]]:
+    """
+    用 iterparse 流式提取中间表示：根节点的每个子元素（即每个顶层定义或补丁操作）解析完毕后，
+    立即在它的子树内提取模板与定义，按文档顺序给出 (templates, defs)，然后清空并移除这个子元素。
+    内存中始终只有一个顶层元素的子树，调用方可以边解析边消费，不必组装整个文件的中间表示。
+    各子树互不重叠且按文档顺序出现，全部拼接起来与 parse_def_tree 的结果完全相同。
+    需要改用完整解析时抛出 DefStreamFallback，解析失败时打印警告并抛出 DefParseError，
+    两种情况下调用方都应丢弃此前已经得到的部分。
+    """
+    template_query = etree.XPath(STREAM_TEMPLATE_XPATH)
+    def_query = etree.XPath(STREAM_DEF_XPATH)
+    root = None
+    try:
+        for _, element in etree.iterparse(str(file_path), remove_blank_text=True, recover=True):
+            if root is None:
+                # 第一个结束事件发生时根节点（及其属性）已经存在
+                root = element.getroottree().getroot()
+                if root.get("Abstract") == "True" and root.get("Name"):
+                    raise DefStreamFallback()
+            if element.getparent() is not root: continue
+            if element.tag == "defName":
+                raise DefStreamFallback()
+            yield ([build_template_ir(node, translatable_tags) for node in template_query(element)],
+                   [build_def_ir(node, translatable_tags) for node in def_query(element)])
+            # 清空已处理的顶层元素，并移除它之前的兄弟节点（含注释）
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del root[0]
+    except etree.XMLSyntaxError as e:
+        print(f"警告：解析XML文件时发生错误 {file_path}: {e}")
+        raise DefParseError() from e
+    if root is None:
+        print(f"警告：解析XML文件时发生错误 {file_path}: 未找到根元素")
+        raise DefParseError()
+
+
+def stream_def_file(file_path: Path, translatable_tags: List[str]) -> Optional[dict]:
+    """
+    流式解析并组装整个文件的中间表示，结果与 parse_def_tree 完全相同。
+    解析树的内存占用与文件大小无关，但组装出的中间表示仍随文件中的可翻译文本增长。
+    """
+    templates, defs = [], []
+    try:
+        for chunk_templates, chunk_defs in iter_def_file(file_path, translatable_tags):
+            templates.extend(chunk_templates)
+            defs.extend(chunk_defs)
+    except DefStreamFallback:
+        return parse_def_tree(file_path, translatable_tags)
+    except DefParseError:
+        return None
+    return {"templates": templates, "defs": defs}
+
+
+def spill_def_file(file_path: Path, chunk_file: Path) -> bool:
+    """
+    流式提取模式下对文件的唯一一次解析：用 iter_def_file 逐个提取顶层元素，把 (templates, defs) 逐行写入
+    JSON Lines 分块文件，全局学习与注入阶段之后都从这个文件中逐行读取，内存中始终只有一个顶层元素的内容。
+    需要完整解析时整个文件写成一行；解析失败时不写出文件并返回False。
+    """
+    translatable_tags = CONFIG['rules'].get('translatable_def_tags', [])
+    # 并行处理的项目可能同时写出同一个分块文件，先写临时文件再替换，读取方不会看到写了一半的文件
+    tmp_path = chunk_file.with_name(f"{chunk_file.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_path.open('w', encoding='utf-8') as f:
+            try:
+                for chunk in iter_def_file(file_path, translatable_tags):
+                    f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            except DefStreamFallback:
+                ir = parse_def_tree(file_path, translatable_tags)
+                if ir is None: raise DefParseError()
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps([ir["templates"], ir["defs"]], ensure_ascii=False) + "\n")
+    except DefParseError:
+        tmp_path.unlink(missing_ok=True)
+        return False
+    os.replace(tmp_path, chunk_file)
+    return True
+
+
+def _remove_chunk_dir(path: str, owner_pid: int):
+    # fork 出的工作进程继承了同一个对象，只由创建目录的进程删除
+    if os.getpid() == owner_pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class ParsedDefCache:
+    """
+    Def/Patch文件中间表示的缓存。同一次运行内每个文件只解析一次；
+    配置了 parse_cache_dir 时还会按文件内容哈希缓存到磁盘，供之后的运行复用。
+    流式提取模式(streaming=True)下解析结果不在内存中保留：每个文件只流式解析一次，逐个顶层元素写入分块文件
+    (见 spill_def_file，配置了 parse_cache_dir 时就是磁盘缓存，否则写入本次运行的临时目录)，
+    全局学习阶段与注入阶段都从分块文件中逐行读取，内存中不会留下整个Mod乃至整个文件的中间表示。
+    只读模式(read_only=True，预估模式使用)下仍会读取已有的磁盘缓存，但不创建目录、也不写入新的缓存文件。
+    """
+
+    def __init__(self, cache_dir: Optional[Path], streaming: bool = False, read_only: bool = False):
+        self.cache_dir = cache_dir
+        self.streaming = streaming
+        self.read_only = read_only
+        self.memo = {}
+        self.chunk_files: Dict[str, Optional[Path]] = {}
+        self.temp_dir: Optional[Path] = None
+        self.tags_fingerprint = fingerprint([DEF_IR_VERSION, CONFIG['rules'].get('translatable_def_tags', [])])
+        if cache_dir is not None and not read_only:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _cache_file(self, file_path: Path, sha1: Optional[str]) -> Optional[Path]:
+        if self.cache_dir is None: return None
+        return self.cache_dir / f"{fingerprint([self.tags_fingerprint, sha1 or file_sha1(file_path)])}.json"
+
+    @staticmethod
+    def _read(cache_file: Optional[Path]) -> Optional[dict]:
+        if cache_file is None or not cache_file.is_file(): return None
+        try:
+            with cache_file.open('r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return None
+
+    def _load(self, file_path: Path, cache_file: Optional[Path]) -> bool:
+        """从内存或磁盘缓存中取得中间表示，取到时返回True。"""
+        key = str(file_path)
+        if key in self.memo: return True
+        ir = self._read(cache_file)
+        if ir is None: return False
+        self.memo[key] = ir
+        return True
+
+    def _store(self, file_path: Path, cache_file: Optional[Path], ir: Optional[dict]):
+        self.memo[str(file_path)] = ir
+        if cache_file is not None and ir is not None and not self.read_only:
+            # 并行处理的项目可能同时写出同一个缓存文件，先写临时文件再替换，读取方不会看到写了一半的文件
+            tmp_path = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+            with tmp_path.open('w', encoding='utf-8') as f:
+                json.dump(ir, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_file)
+
+    def get(self, file_path: Path, sha1: Optional[str] = None) -> Optional[dict]:
+        """整个文件的中间表示（默认模式）。"""
+        if str(file_path) in self.memo: return self.memo[str(file_path)]
+        cache_file = self._cache_file(file_path, sha1)
+        if not self._load(file_path, cache_file):
+            self._store(file_path, cache_file, parse_def_file(file_path))
+        return self.memo[str(file_path)]
+
+    def _chunk_target(self, file_path: Path, sha1: Optional[str]) -> tuple[Path, bool]:
+        """流式提取模式下文件的分块文件路径，以及它是否已经存在（之前的运行或本次运行已经写出）。"""
+        name = f"{fingerprint([self.tags_fingerprint, sha1 or file_sha1(file_path)])}.jsonl"
+        if self.cache_dir is not None:
+            cached = self.cache_dir / name
+            if cached.is_file(): return cached, True
+            if not self.read_only: return cached, False
+        if self.temp_dir is None:
+            self.temp_dir = Path(tempfile.mkdtemp(prefix="rimworld_defs_"))
+            weakref.finalize(self, _remove_chunk_dir, str(self.temp_dir), os.getpid())
+        target = self.temp_dir / name
+        return target, target.is_file()
+
+    def _chunk_file(self, file_path: Path, sha1: Optional[str]) -> Optional[Path]:
+        key = str(file_path)
+        if key not in self.chunk_files:
+            target, exists = self._chunk_target(file_path, sha1)
+            self.chunk_files[key] = target if exists or spill_def_file(file_path, target) else None
+        return self.chunk_files[key]
+
+    def iter_chunks(self, file_path: Path, sha1: Optional[str] = None) -> Iterator[tuple[List[dict], List[dict]]]:
+        """
+        按文档顺序给出文件的 (templates, defs)：流式提取模式下逐行读取分块文件（不存在时先流式解析写出），
+        否则整个文件作为一块从中间表示中给出。解析失败的文件什么也不给出。
+        """
+        if not self.streaming:
+            ir = self.get(file_path, sha1)
+            if ir is not None:
+                yield ir["templates"], ir["defs"]
+            return
+        chunk_file = self._chunk_file(file_path, sha1)
+        if chunk_file is None: return
+        with chunk_file.open('r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def iter_defs(self, file_path: Path) -> Iterator[dict]:
+        """按文档顺序逐个给出文件中的定义（见 iter_chunks）。"""
+        for _, defs in self.iter_chunks(file_path):
+            yield from defs
+
+    def prefetch(self, files: List[Path], source_states: Dict[str, dict], executor: Optional[ProcessPoolExecutor]):
+        """
+        用进程池并行解析尚未缓存的文件。各文件的解析结果相互独立，按提交顺序取回后写入缓存，
+        之后的 get 与串行运行得到完全相同的结果。未提供进程池时什么也不做（按需串行解析）；
+        流式提取模式下由工作进程直接写出分块文件。
+        """
+        if executor is None: return
+        pending = []
+        for file_path in dict.fromkeys(files):
+            key = str(file_path)
+            sha1 = source_states.get(key, {}).get("sha1")
+            if self.streaming:
+                if key in self.chunk_files: continue
+                target, exists = self._chunk_target(file_path, sha1)
+                if exists:
+                    self.chunk_files[key] = target
+                else:
+                    pending.append((file_path, target))
+            elif key not in self.memo:
+                cache_file = self._cache_file(file_path, sha1)
+                if not self._load(file_path, cache_file):
+                    pending.append((file_path, cache_file))
+        if not pending: return
+        chunksize = max(1, len(pending) // (get_scan_workers() * 4))
+        if self.streaming:
+            results = executor.map(spill_def_file, *zip(*pending), chunksize=chunksize)
+            for (file_path, target), written in zip(pending, results):
+                self.chunk_files[str(file_path)] = target if written else None
+            return
+        results = executor.map(parse_def_file, [file_path for file_path, _ in pending], chunksize=chunksize)
+        for (file_path, cache_file), ir in zip(pending, results):
+            self._store(file_path, cache_file, ir)
+
+
+# --- 并行扫描 ---
+
+def get_parse_cache_dir() -> Optional[Path]:
+    parse_cache_dir_str = CONFIG['system'].get('parse_cache_dir', DEFAULT_CONFIG['system']['parse_cache_dir'])
+    return BASE_WORKING_DIR / parse_cache_dir_str if parse_cache_dir_str else None
+
+
+def is_streaming_extraction() -> bool:
+    return CONFIG['system'].get('streaming_extraction', DEFAULT_CONFIG['system']['streaming_extraction'])
+
+
+def get_helper_root() -> Optional[Path]:
+    helper_root_path_str = CONFIG.get('system', {}).get('helper_files_root')
+    return BASE_WORKING_DIR / helper_root_path_str if helper_root_path_str else None
+
+
+def get_scan_workers() -> int:
+    """全局学习阶段使用的进程数。0 表示使用全部CPU核心，1 表示串行扫描。"""
+    workers = CONFIG['system'].get('scan_workers', DEFAULT_CONFIG['system']['scan_workers'])
+    return max(1, workers or os.cpu_count() or 1)
+
+
+def init_scan_worker(config: dict):
+    """进程池中每个工作进程的初始化：同步主进程的配置（spawn 方式启动时不会继承全局变量）。"""
+    global CONFIG
+    CONFIG = config
+
+
+def collect_mod_source_files(mod_index: ModFileIndex, helper_index: Optional[ModFileIndex]
+                             ) -> tuple[List[Path], List[Path], List[Path]]:
+    """收集一个Mod的Defs/Patches/Scenarios文件、辅助文件与英文语言文件（可在工作进程中执行）。"""
+    def_files = find_source_files(mod_index, ["Defs", "Patches", "Scenarios"])
+    helper_files = helper_index.files_under("", ".xml") if helper_index is not None else []
+    english_files = find_source_files(mod_index, ["Languages/English"])
+    return def_files, helper_files, english_files
+
+
+# --- 增量运行 ---
+
+def file_sha1(file_path: Path) -> str:
+    digest = hashlib.sha1()
+    with file_path.open('rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(obj) -> str:
+    """对可JSON序列化的对象求稳定哈希。"""
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def is_failed_translation(text) -> bool:
+    return isinstance(text, str) and (text.startswith(ERROR_PREFIX) or text.startswith(ORIGINAL_PREFIX))
+
+
+class RunManifest:
+    """
+    增量运行清单，保存在汉化包目录旁。对每个Mod记录：
+    - sources: 源文件的内容哈希、mtime与大小（mtime与大小未变时直接沿用旧哈希，不必重读文件）；
+    - knowledge: 该Mod对全局知识库的贡献，源文件未变时无需重新解析；
+    - fingerprints: 配置、翻译记忆与所用父类模板的指纹；
+    - outputs: 每个产出文件的输入指纹与内容哈希。
+    源文件与指纹都未变、产出完好且上次没有失败条目的Mod会被整体跳过；
+    需要重新处理的Mod中，输入未变的产出文件直接沿用上次的译文，不调用API也不重写。
+    读取上次的记录与保存本次的记录相互独立：rebuild (--rebuild) 时忽略上次的记录、完整重新处理，
+    但仍然记录并保存本次的状态，之后的增量运行与重建后的产出比较。
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path, enabled: bool = True, rebuild: bool = False):
+        self.path = path
+        self.enabled = enabled
+        self.reuse_previous = enabled and not rebuild
+        self.data = {"version": self.VERSION, "ir_version": DEF_IR_VERSION, "mods": {}}
+        if self.reuse_previous and path.is_file():
+            try:
+                with path.open('r', encoding='utf-8') as f:
+                    loaded = json.load(f)
+                if loaded.get("version") == self.VERSION and loaded.get("ir_version") == DEF_IR_VERSION:
+                    self.data = loaded
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"  -> 警告: 增量清单读取失败，将完整重建: {e}")
+        self.skipped_mods = 0
+        self.reused_outputs = 0
+
+    def mod_record(self, mod_id: str) -> dict:
+        return self.data["mods"].get(mod_id, {}) if self.reuse_previous else {}
+
+    def source_states(self, mod_id: str, files: List[Path]) -> Dict[str, dict]:
+        previous = self.mod_record(mod_id).get("sources", {})
+        states = {}
+        for file_path in files:
+            stat = file_path.stat()
+            old = previous.get(str(file_path))
+            if old and old["mtime_ns"] == stat.st_mtime_ns and old["size"] == stat.st_size:
+                sha1 = old["sha1"]
+            else:
+                sha1 = file_sha1(file_path)
+            states[str(file_path)] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": sha1}
+        return states
+
+    def sources_unchanged(self, mod_id: str, states: Dict[str, dict]) -> bool:
+        previous = self.mod_record(mod_id).get("sources")
+        if previous is None: return False
+        return {k: v["sha1"] for k, v in previous.items()} == {k: v["sha1"] for k, v in states.items()}
+
+    @staticmethod
+    def output_intact(file_path: Path, record: dict) -> bool:
+        if not file_path.is_file(): return False
+        stat = file_path.stat()
+        if stat.st_mtime_ns == record.get("mtime_ns") and stat.st_size == record.get("size"): return True
+        return file_sha1(file_path) == record.get("sha1")
+
+    def can_skip_mod(self, mod_id: str, states: Dict[str, dict], fingerprints: dict, output_path: Path) -> bool:
+        record = self.mod_record(mod_id)
+        if not record or record.get("has_errors", True): return False
+        if not self.sources_unchanged(mod_id, states) or record.get("fingerprints") != fingerprints: return False
+        return all(self.output_intact(output_path / rel, out) for rel, out in record.get("outputs", {}).items())
+
+    def update_mod(self, mod_id: str, record: dict):
+        self.data["mods"][mod_id] = record
+        self.save()
+
+    def save(self):
+        if not self.enabled: return
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        if self.enabled and (self.skipped_mods or self.reused_outputs):
+            print(f"增量运行: 跳过 {self.skipped_mods} 个未变化的Mod，沿用 {self.reused_outputs} 个未变化的输出文件。")
+
+
+class ModIncrementalState:
+    """单个Mod在本次运行中的增量状态，收集新的产出记录并在Mod结束时写回清单。"""
+
+    def __init__(self, manifest: RunManifest, mod_id: str, output_path: Path, cache_file_path: Path,
+                 sources: Dict[str, dict], knowledge: dict, fingerprints: dict):
+        self.manifest = manifest
+        self.mod_id = mod_id
+        self.output_path = output_path
+        self.cache_file_path = cache_file_path
+        self.sources = sources
+        self.knowledge = knowledge
+        self.fingerprints = fingerprints
+        self.previous_outputs = manifest.mod_record(mod_id).get("outputs", {})
+        self.outputs = {}
+        self.has_errors = False
+        self.old_cache = {}
+        if manifest.reuse_previous and self.previous_outputs and cache_file_path.is_file():
+            try:
+                with cache_file_path.open('r', encoding='utf-8') as f:
+                    self.old_cache = json.load(f)
+            except (json.JSONDecodeError, IOError):
+                self.old_cache = {}
+
+    def output_fingerprint(self, targets: Dict[str, dict]) -> str:
+        return fingerprint([self.fingerprints["config"], self.fingerprints["memory"], targets])
+
+    def reuse_output(self, output_file_path: Path, targets: Dict[str, dict]) -> Optional[Dict[str, dict]]:
+        """输入未变且产出完好时，返回上次的缓存条目；否则返回None。"""
+        rel = output_file_path.relative_to(self.output_path).as_posix()
+        record = self.previous_outputs.get(rel)
+        if not record or record["fingerprint"] != self.output_fingerprint(targets): return None
+        if not all(key in self.old_cache for key in targets): return None
+        if not self.manifest.output_intact(output_file_path, record): return None
+        self.outputs[rel] = record
+        self.manifest.reused_outputs += 1
+        return {key: entry for key, entry in self.old_cache.items() if key in targets}
+
+    def record_output(self, output_file_path: Path, targets: Dict[str, dict], cache_entries: Dict[str, dict]):
+        if any(is_failed_translation(entry.get('cn')) or entry.get('validation') for entry in cache_entries.values()):
+            self.has_errors = True  # 含失败或未通过校验的条目的文件不登记，下次运行会重新翻译
+            return
+        rel = output_file_path.relative_to(self.output_path).as_posix()
+        stat = output_file_path.stat()
+        self.outputs[rel] = {"fingerprint": self.output_fingerprint(targets), "sha1": file_sha1(output_file_path),
+                             "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def finish(self):
+        if self.cache_file_path.is_file():
+            rel = self.cache_file_path.relative_to(self.output_path).as_posix()
+            stat = self.cache_file_path.stat()
+            self.outputs[rel] = {"fingerprint": None, "sha1": file_sha1(self.cache_file_path),
+                                 "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        self.manifest.update_mod(self.mod_id, {
+            "sources": self.sources, "knowledge": self.knowledge, "fingerprints": self.fingerprints,
+            "outputs": self.outputs, "has_errors": self.has_errors})
+
+
+def scan_knowledge(files_to_scan: List[Path], parsed_defs: ParsedDefCache,
+                   source_states: Dict[str, dict]) -> dict:
+    """从文件的中间表示中提取其对全局知识库的贡献（可JSON序列化，便于写入增量清单）。"""
+    ops, parents = [], set()
+    for file_path in files_to_scan:
+        for templates, _ in parsed_defs.iter_chunks(file_path, source_states.get(str(file_path), {}).get("sha1")):
+            for template in templates:
+                if template["parent"]:
+                    parents.add(template["parent"])
+                if template["name"] and template["parent"]:
+                    ops.append(["inherit", template["name"], template["parent"]])
+                if template["template_name"]:
+                    ops.append(["abstract", template["template_name"], template["fields"]])
+    return {"ops": ops, "parents": sorted(parents)}
+
+
+def merge_knowledge(knowledge: dict, abstract_defs: Dict, def_inheritance_map: Dict):
+    for op, name, value in knowledge["ops"]:
+        if op == "inherit":
+            def_inheritance_map[name] = value
+        else:
+            abstract_defs.setdefault(name, {}).update(value)
+
+
+class InheritanceResolver:
+    """
+    父类模板解析器。resolve(name) 返回模板 name 与其全部祖先合并后的字段（路径 -> 文本）：
+    自身字段在前，祖先按继承链由近及远补充自身没有的路径，与逐级向上查找的结果一致。
+    每个模板只计算一次并缓存，之后每个Def的查询都是O(1)；继承环会被检测并报告，
+    环上每个模板按“遇到重复即停止”的规则各自解析。
+    """
+
+    def __init__(self, abstract_defs: Dict, def_inheritance_map: Dict):
+        self.abstract_defs = abstract_defs
+        self.def_inheritance_map = def_inheritance_map
+        self.memo = {}
+        self.reported_cycles = set()
+
+    def _merge(self, name: str, inherited: Dict[str, str]) -> Dict[str, str]:
+        merged = dict(self.abstract_defs.get(name, {}))
+        for path, text in inherited.items():
+            if path not in merged:
+                merged[path] = text
+        return merged
+
+    def resolve(self, name: Optional[str]) -> Dict[str, str]:
+        if not name: return {}
+        if name in self.memo: return self.memo[name]
+
+        # 沿继承链向上，直到链尾、已缓存的模板或重复出现的模板（即继承环）
+        chain, positions = [], {}
+        current = name
+        while current and current not in self.memo and current not in positions:
+            positions[current] = len(chain)
+            chain.append(current)
+            current = self.def_inheritance_map.get(current)
+
+        if current and current in positions:
+            cycle = chain[positions[current]:]
+            if frozenset(cycle) not in self.reported_cycles:
+                self.reported_cycles.add(frozenset(cycle))
+                print(f"  -> 警告: 检测到循环继承: {' -> '.join(cycle + [current])}")
+            # 环上每个模板的继承链是环的一个轮转，分别计算
+            for i, member in enumerate(cycle):
+                rotation = cycle[i:] + cycle[:i]
+                merged = {}
+                for ancestor in reversed(rotation):
+                    merged = self._merge(ancestor, merged)
+                self.memo[member] = merged
+            chain = chain[:positions[current]]
+            inherited = self.memo[current]
+        else:
+            inherited = self.memo.get(current, {}) if current else {}
+
+        for ancestor in reversed(chain):
+            inherited = self._merge(ancestor, inherited)
+            self.memo[ancestor] = inherited
+        return self.memo[name]
+
+
+def knowledge_fingerprint(parents: List[str], resolver: InheritanceResolver) -> str:
+    """某个Mod实际引用的父类模板（合并后的字段）的指纹，其它Mod改动了这些模板时该Mod需要重新处理。"""
+    return fingerprint({name: resolver.resolve(name) for name in parents})
+
+
+def get_config_fingerprint() -> str:
+    """影响译文的配置项指纹：规则、术语表、材质库、生成规则与模型。"""
+    return fingerprint({
+        "versions": CONFIG['versions'], "rules": CONFIG['rules'], "glossary": PROJECT_GLOSSARY,
+        "stuffs": PROJECT_STUFFS, "generative_rules": CONFIG.get('generative_rules', {}),
+        "model": CONFIG['system']['gemini_model'],
+    })
+
+
+class CheckpointJournal:
+    """
+    翻译检查点日志（JSONL，只追加）。每个API批次一返回就把其中成功的译文写入日志并刷新到磁盘，
+    即使运行中途因配额耗尽、Ctrl-C或异常而中断，已付费的结果也不会丢失。
+    以 --resume 重新运行时先回放日志，其中已有的条目（同一输出文件、key、原文与上下文）直接采用，
+    不会再次请求API。运行正常结束后日志会被删除，因此日志存在即说明上次运行没有完成：
+    此时必须指定 --resume 继续，或指定 --discard-journal 明确丢弃，否则拒绝运行，以免覆盖已付费的译文。
+    """
+
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = path
+        self.entries = {}
+        self.replayed = 0
+        self.lock = threading.Lock()
+        if path.is_file():
+            if resume:
+                with path.open('r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            row = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # 中断时可能留下不完整的最后一行
+                        self.entries[(row["file"], row["key"], row["en"], row["context"])] = row["cn"]
+                print(f"  -> 已从检查点日志恢复 {len(self.entries)} 条译文: {path}")
+            else:
+                print(f"  -> 已按 --discard-journal 丢弃上次中断运行的检查点日志，将重新开始: {path}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = path.open('a' if resume else 'w', encoding='utf-8')
+
+    @staticmethod
+    def is_unfinished(path: Path) -> bool:
+        """是否存在上次未完成运行留下的、含有译文的检查点日志。"""
+        return path.is_file() and path.stat().st_size > 0
+
+    def lookup(self, output_file_path: Path, key: str, data: dict) -> Optional[str]:
+        return self.entries.get((str(output_file_path), key, data['text'], data.get('context')))
+
+    def record_batch(self, routes: List[tuple], parsed_result: List[TranslationRecord]):
+        """记录一个批次中模型返回了译文的条目（可在工作线程中调用）。"""
+        translated_dict = convert_parsed_json_to_dict(parsed_result)
+        lines = [json.dumps({"file": str(unit["output_file_path"]), "key": key, "en": data['text'],
+                             "context": data.get('context'), "cn": translated_dict[key]}, ensure_ascii=False) + "\n"
+                 for unit, key, data in routes if key in translated_dict]
+        with self.lock:
+            self.file.write("".join(lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self, completed: bool):
+        self.file.close()
+        if completed:
+            self.path.unlink(missing_ok=True)
+        elif self.path.is_file() and self.path.stat().st_size:
+            print(f"运行未完成，已完成批次的译文保存在检查点日志中，使用 --resume 重新运行即可继续: {self.path}")
+
+
+class TranslationScheduler:
+    """
+    并发翻译调度器。
+    - 待翻译条目先进入打包缓冲区，跨文件、跨Def类型按估算的token预算打包成批次，
+      超出预算的文件会被拆分到多个批次中；结果按条目路由回各自的输出文件。
+    - 以线程池执行API批次，同时在途的批次数不超过 concurrency。
+    - 批次严格按提交顺序结算（追加对话历史、写出XML、写出缓存），因此产出顺序与文件布局与串行运行相同。
+    - 第 i 个批次要等第 i-concurrency 个批次结算后才会提交，它看到的对话历史因此是确定的；
+      但它看不到仍在途的批次的对话历史，所以译文本身可能与串行运行不同。
+    - 开启去重时，原文与上下文类别都相同的条目在整次运行中只发送一次，译文分发给所有相同条目。
+    - 提供检查点日志时，每个批次的结果一返回就写入日志；日志中已有的条目不再请求。
+    """
+
+    def __init__(self, backend: TranslationBackend, concurrency: int = 1, token_budget: int = 6000,
+                 glossary_index: Optional[GlossaryIndex] = None, deduplicate: bool = True,
+                 journal: Optional[CheckpointJournal] = None):
+        self.backend = backend
+        self.journal = journal
+        self.glossary_index = glossary_index
+        self.deduplicate = deduplicate
+        self.dedup_leaders = {}  # (原文, 上下文类别) -> {"result": 已确定的译文或None, "followers": [...]}
+        self.stats = {"batches": 0, "dedup_items": 0, "dedup_tokens": 0, "undeduplicated_batches": 0,
+                      "retry_requests": 0, "retried_items": 0, "recovered_items": 0, "failed_items": 0}
+        self.validation_issues = {}  # id(Mod缓存字典) -> 校验未通过的条目
+        self.max_attempts = max(1, int(CONFIG.get('ai_settings', {}).get(
+            'item_max_attempts', DEFAULT_CONFIG['ai_settings']['item_max_attempts'])))
+        self._shadow_tokens = 0  # 不去重时缓冲区的token数，用于估算节省的调用次数
+        self.concurrency = max(1, int(concurrency))
+        self.token_budget = max(1, int(token_budget))
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="translate")
+        self.in_flight = deque()  # 按提交顺序排列的 (future, batch)
+        self.ordered_outputs = deque()  # 按提交顺序排列的待写出文件与回调
+        self._reset_buffer(None)
+
+    def _reset_buffer(self, history: Optional[ConversationHistory]):
+        self.buffer = {"history": history, "items": [], "routes": [], "keys": set(), "tokens": 0}
+
+    def _request(self, history: List[Dict[str, str]], json_items: List[Dict[str, str]],
+                 glossary: Optional[Dict[str, str]]) -> Optional[List[TranslationRecord]]:
+        return translate_with_json_mode(self.backend, history, json_items, glossary)
+
+    def _translate_with_recovery(self, history: List[Dict[str, str]], json_items: List[Dict[str, str]],
+                                 glossary: Optional[Dict[str, str]]) -> tuple[List[TranslationRecord], Counter, set, dict, int]:
+        """
+        翻译一个批次，并尽量挽回失败的条目：
+        - 模型正确返回（key存在、译文非空且占位符与标记和原文一致）的条目直接保留，
+          只把缺失或校验未通过的条目放进一个小的后续批次重新请求；
+        - 模型给出空的或无法解析的响应时把条目对半拆分后分别重试，递归地把导致失败的条目隔离出来；
+        - 缺失条目的重新请求与单个条目的重试，都以每个条目最多请求 item_max_attempts 次为限；
+        - 频率限制重试耗尽或请求本身失败 (BatchRequestError) 与条目内容无关，不拆分，
+          本批次尚未完成的条目全部标记为失败（不写入检查点日志，之后的运行会重新翻译）；
+        - 用完请求次数后仍未通过校验的条目保留最后一次的译文，由调用方报告并标记为待重新翻译。
+        返回 (按原顺序排列的结果, 各条目的请求次数, 最后一次请求失败的条目key,
+              曾经校验未通过的条目 {key: {"problems": 最近一次的问题, "fixed": 最终是否通过}}, 额外请求数)。
+        """
+        results, attempts, error_keys, invalid = {}, Counter(), set(), {}
+        last_invalid = {}  # key -> 最近一次未通过校验的译文
+        extra_requests = 0
+        groups = [json_items]
+        while groups:
+            group = groups.pop()
+            for item in group:
+                attempts[item['key']] += 1
+            if group is not json_items:
+                extra_requests += 1
+                if self.glossary_index is not None:
+                    glossary = self.glossary_index.find_terms([item['source_text'] for item in group])
+            try:
+                parsed = self._request(history, group, glossary)
+            except BatchRequestError as e:
+                unfinished = [item['key'] for pending in [group] + groups for item in pending]
+                print(f"  -> 错误: {e}，放弃本批次尚未完成的 {len(unfinished)} 个条目。")
+                error_keys.update(unfinished)
+                break
+
+            if parsed is None:
+                if len(group) > 1:
+                    middle = len(group) // 2
+                    groups.extend([group[middle:], group[:middle]])
+                elif attempts[group[0]['key']] < self.max_attempts:
+                    groups.append(group)
+                else:
+                    error_keys.add(group[0]['key'])
+                continue
+
+            returned = {item.key: item for item in parsed if item.translated_text and item.translated_text.strip()}
+            missing = []
+            for item in group:
+                key = item['key']
+                problems = validate_translation(item['source_text'], returned[key].translated_text, key) if key in returned else None
+                if problems:
+                    invalid[key] = {"problems": problems, "fixed": False}
+                    last_invalid[key] = returned[key]
+                elif key in invalid and key in returned:
+                    invalid[key]["fixed"] = True
+                if key in returned and not problems:
+                    results[key] = returned[key]
+                    error_keys.discard(key)
+                elif attempts[key] < self.max_attempts:
+                    missing.append(item)
+            if missing:
+                groups.append(missing)
+
+        # 始终未通过校验的条目保留最后一次的译文，好过用原文覆盖一个多半只差一个标记的译文
+        for key, item in last_invalid.items():
+            if key not in results:
+                results[key] = item
+                error_keys.discard(key)
+        ordered = [results[item['key']] for item in json_items if item['key'] in results]
+        return ordered, attempts, error_keys, invalid, extra_requests
+
+    def _call_api(self, history: List[Dict[str, str]], json_items: List[Dict[str, str]],
+                  glossary: Optional[Dict[str, str]], routes: List[tuple]):
+        parsed_result, attempts, error_keys, invalid, extra_requests = self._translate_with_recovery(
+            history, json_items, glossary)
+        if parsed_result and self.journal is not None:
+            # 未通过校验的译文不写入检查点日志，--resume 时会重新请求
+            self.journal.record_batch(routes, [item for item in parsed_result
+                                               if item.key not in invalid or invalid[item.key]["fixed"]])
+        return parsed_result, attempts, error_keys, invalid, extra_requests
+
+    def add_file(self, history: ConversationHistory, targets: Dict[str, dict], memory: TranslationMemory,
+                 output_file_path: Path, cache: Dict[str, dict], incremental: Optional[ModIncrementalState] = None):
+        """登记一个输出文件：命中记忆库的条目直接采用，其余条目进入打包缓冲区等待翻译。"""
+        if incremental is not None:
+            reused_entries = incremental.reuse_output(output_file_path, targets)
+            if reused_entries is not None:
+                self.ordered_outputs.append({"kind": "file", "final": {}, "cache_entries": reused_entries,
+                                             "output_file_path": output_file_path, "cache": cache, "pending": 0,
+                                             "order": list(reused_entries), "targets": targets, "incremental": None})
+                self._flush_outputs()
+                return
+
+        final_translation_dict, new_cache_data, to_translate_dict = plan_translation(targets, memory)
+        unit = {"kind": "file", "final": final_translation_dict, "cache_entries": new_cache_data,
+                "output_file_path": output_file_path, "cache": cache, "pending": len(to_translate_dict),
+                # 缓存条目按“记忆库命中在前、新翻译在后”的固定顺序写出，与结算先后无关
+                "order": list(new_cache_data) + list(to_translate_dict),
+                "targets": targets, "incremental": incremental}
+        self.ordered_outputs.append(unit)
+
+        # 不同Mod使用各自的对话历史，批次不跨越历史边界
+        if self.buffer["history"] is not history:
+            self._flush_buffer()
+            self._reset_buffer(history)
+            if self._shadow_tokens:
+                self.stats["undeduplicated_batches"] += 1
+                self._shadow_tokens = 0
+
+        for key, data in to_translate_dict.items():
+            journaled_text = self.journal.lookup(output_file_path, key, data) if self.journal is not None else None
+            if journaled_text is not None:
+                # 上次中断前已翻译完成的条目，直接采用并作为去重的已确定译文
+                self.journal.replayed += 1
+                self._resolve_item(unit, key, data, journaled_text)
+                if self.deduplicate:
+                    self.dedup_leaders.setdefault((data['text'], data.get('context_class', data.get('context'))),
+                                                  {"result": journaled_text, "followers": []})
+                continue
+
+            json_item = convert_dict_to_json_items({key: data})[0]
+            item_tokens = estimate_tokens(json.dumps(json_item, ensure_ascii=False))
+            if self._shadow_tokens + item_tokens > self.token_budget and self._shadow_tokens:
+                self.stats["undeduplicated_batches"] += 1
+                self._shadow_tokens = 0
+            self._shadow_tokens += item_tokens
+
+            if self.deduplicate:
+                dedup_key = (data['text'], data.get('context_class', data.get('context')))
+                leader = self.dedup_leaders.get(dedup_key)
+                if leader is None:
+                    self.dedup_leaders[dedup_key] = {"result": None, "followers": []}
+                else:
+                    self.stats["dedup_items"] += 1
+                    self.stats["dedup_tokens"] += item_tokens
+                    if leader["result"] is not None:
+                        self._resolve_item(unit, key, data, leader["result"])
+                    else:
+                        leader["followers"].append((unit, key, data))
+                    continue
+
+            # 同一批次内的key必须唯一才能正确路由结果
+            if key in self.buffer["keys"] or self.buffer["tokens"] + item_tokens > self.token_budget:
+                self._flush_buffer()
+            self.buffer["items"].append(json_item)
+            self.buffer["routes"].append((unit, key, data))
+            self.buffer["keys"].add(key)
+            self.buffer["tokens"] += item_tokens
+
+        self._flush_outputs()
+
+    @staticmethod
+    def _resolve_item(unit: dict, key: str, data: dict, translated_text: str):
+        unit["final"][key] = translated_text
+        unit["cache_entries"][key] = {'en': data['text'], 'cn': translated_text, 'context': data.get('context')}
+        unit["pending"] -= 1
+
+    def add_callback(self, callback: Callable[[], None]):
+        """登记一个回调，它会在此前登记的所有文件写出之后按顺序执行。"""
+        self.ordered_outputs.append({"kind": "callback", "callback": callback})
+        self._flush_outputs()
+
+    def _flush_buffer(self):
+        """把缓冲区中已打包的条目作为一个批次提交。"""
+        history = self.buffer["history"]
+        if not self.buffer["items"]: return
+        while len(self.in_flight) >= self.concurrency:
+            self._settle_next()
+        batch = {"history": history, "items": self.buffer["items"], "routes": self.buffer["routes"]}
+        self.stats["batches"] += 1
+        glossary = None
+        if self.glossary_index is not None:
+            glossary = self.glossary_index.find_terms([item['source_text'] for item in batch["items"]])
+        future = self.executor.submit(self._call_api, history.build_contents(), batch["items"], glossary,
+                                      batch["routes"])
+        self.in_flight.append((future, batch))
+        self._reset_buffer(history)
+
+    def _settle_next(self):
+        future, batch = self.in_flight.popleft()
+        with PHASE_TIMER.phase("translation"):
+            parsed_result, attempts, error_keys, invalid, extra_requests = future.result()
+        if parsed_result:
+            returned_keys = {item.key for item in parsed_result}
+            batch["history"].append([item for item in batch["items"] if item['key'] in returned_keys], parsed_result)
+        self.stats["retry_requests"] += extra_requests
+
+        # 将批次内的条目按所属文件分组后合并结果
+        units_in_batch = {}
+        for unit, key, data in batch["routes"]:
+            units_in_batch.setdefault(id(unit), (unit, {}))[1][key] = data
+        for unit, to_translate_dict in units_in_batch.values():
+            apply_translation_result(to_translate_dict, parsed_result, unit["final"], unit["cache_entries"],
+                                     error_keys)
+            unit["pending"] -= len(to_translate_dict)
+            for key in to_translate_dict:
+                unresolved = key in invalid and not invalid[key]["fixed"]
+                if unresolved:
+                    # 保留的译文仍未通过校验：在缓存中标记，该文件不登记为完成，下次运行会重新翻译
+                    unit["cache_entries"][key]["validation"] = invalid[key]["problems"]
+                if attempts[key] > 1:
+                    # 记录需要多次请求才得到结果（或最终失败）的条目的请求次数
+                    unit["cache_entries"][key]["attempts"] = attempts[key]
+                    self.stats["retried_items"] += 1
+                    if not is_failed_translation(unit["final"][key]) and not unresolved:
+                        self.stats["recovered_items"] += 1
+                if is_failed_translation(unit["final"][key]):
+                    self.stats["failed_items"] += 1
+                if key in invalid:
+                    # 校验未通过的条目按Mod（以Mod的缓存字典区分）汇总，在Mod处理完毕时报告
+                    self.validation_issues.setdefault(id(unit["cache"]), []).append({
+                        "file": unit["output_file_path"].name, "key": key, "source": to_translate_dict[key]['text'],
+                        "translation": unit["final"][key], **invalid[key]})
+
+        if self.deduplicate:
+            for unit, key, data in batch["routes"]:
+                dedup_key = (data['text'], data.get('context_class', data.get('context')))
+                leader = self.dedup_leaders[dedup_key]
+                translated_text = unit["final"][key]
+                problems = unit["cache_entries"][key].get("validation")
+                for follower in leader["followers"]:
+                    self._resolve_item(*follower, translated_text)
+                    if problems:
+                        follower[0]["cache_entries"][follower[1]]["validation"] = problems
+                leader["followers"] = []
+                # 失败或未通过校验的结果不复用，之后再遇到相同原文时重新请求
+                if is_failed_translation(translated_text) or problems:
+                    del self.dedup_leaders[dedup_key]
+                else:
+                    leader["result"] = translated_text
+        self._flush_outputs()
+
+    def _flush_outputs(self):
+        while self.ordered_outputs:
+            entry = self.ordered_outputs[0]
+            if entry["kind"] == "file":
+                if entry["pending"] > 0: return
+                if entry["final"]:
+                    with PHASE_TIMER.phase("write"):
+                        write_translation_file(entry["final"], entry["output_file_path"])
+                        if entry["incremental"] is not None:
+                            entry["incremental"].record_output(entry["output_file_path"], entry["targets"],
+                                                               entry["cache_entries"])
+                if entry["cache_entries"]:
+                    entry["cache"].update((key, entry["cache_entries"][key]) for key in entry["order"])
+            else:
+                entry["callback"]()
+            self.ordered_outputs.popleft()
+
+    def drain(self):
+        """提交缓冲区剩余条目，等待所有在途批次完成并写出全部剩余产出。"""
+        self._flush_buffer()
+        while self.in_flight:
+            self._settle_next()
+        self._flush_outputs()
+
+    def report_deduplication(self):
+        if not self.deduplicate or not self.stats["dedup_items"]: return
+        undeduplicated = self.stats["undeduplicated_batches"] + (1 if self._shadow_tokens else 0)
+        saved_calls = max(0, undeduplicated - self.stats["batches"])
+        print(f"去重统计: {self.stats['dedup_items']} 个条目复用了相同原文的译文，"
+              f"估计节省 {self.stats['dedup_tokens']} 个输入token、{saved_calls} 次API调用。")
+
+    def report_validation(self, cache: Dict[str, dict], mod_name: str) -> List[dict]:
+        """打印并返回某个Mod的占位符/标记校验报告（在该Mod的全部文件写出后调用）。"""
+        issues = self.validation_issues.pop(id(cache), [])
+        if issues:
+            fixed = sum(1 for issue in issues if issue["fixed"])
+            print(f"  -> 校验报告 '{mod_name}': {len(issues)} 个条目的占位符或标记与原文不一致，"
+                  f"重新请求后修复 {fixed} 个，{len(issues) - fixed} 个仍不一致（已保留最后一次的译文，下次运行会重新翻译）。")
+            for issue in issues:
+                if not issue["fixed"]:
+                    print(f"     {issue['file']} / {issue['key']}: {'; '.join(issue['problems'])}")
+        return issues
+
+    def report_recovery(self):
+        if not self.stats["retried_items"]: return
+        print(f"失败恢复: {self.stats['retried_items']} 个条目经过重试，其中 {self.stats['recovered_items']} 个最终成功，"
+              f"额外请求 {self.stats['retry_requests']} 次；仍有 {self.stats['failed_items']} 个条目翻译失败。")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class DryRunScheduler(TranslationScheduler):
+    """
+    预估模式 (--dry-run) 使用的调度器：与正式运行完全相同地查询记忆库、去重并按token预算打包批次，
+    但不调用API、不写出任何文件。每个批次按实际会发送的内容（系统提示词、术语、对话历史与条目）估算token数，
+    并以原文充当译文推进对话历史；与正式运行一样，批次要等到前 concurrency 个批次之前的批次结算后才进入历史，
+    使历史部分的估算符合配置的裁剪策略与并发数。
+    """
+
+    DEFAULT_REQUEST_SECONDS = 20.0
+
+    def __init__(self, output_path: Path, concurrency: int, token_budget: int,
+                 glossary_index: Optional[GlossaryIndex] = None, deduplicate: bool = True):
+        super().__init__(None, concurrency, token_budget, glossary_index, deduplicate)
+        self.output_path = output_path
+        self.flushed_items = 0
+        self.unsettled = deque()  # 模拟“在途”批次: (对话历史, 条目, 模拟译文)
+        self.breakdown = {}  # (Mod名, 类别) -> Counter
+        self.totals = Counter()
+
+    def _group_of(self, output_file_path: Path) -> tuple[str, str]:
+        """由输出路径 Cont/<Mod>/Languages/ChineseSimplified/<Keyed|DefInjected/<Def类型>>/... 得到 (Mod名, 类别)。"""
+        parts = output_file_path.relative_to(self.output_path).parts
+        category = parts[5] if parts[4] == "DefInjected" and len(parts) > 6 else parts[4]
+        return parts[1], category
+
+    def add_file(self, history: ConversationHistory, targets: Dict[str, dict], memory: TranslationMemory,
+                 output_file_path: Path, cache: Dict[str, dict], incremental: Optional[ModIncrementalState] = None):
+        group = self._group_of(output_file_path)
+        queued_before = self.flushed_items + len(self.buffer["items"])
+        dedup_before = self.stats["dedup_items"]
+        super().add_file(history, targets, memory, output_file_path, cache, incremental)
+        counts = self.breakdown.setdefault(group, Counter())
+        counts["entries"] += len(targets)
+        counts["api_items"] += self.flushed_items + len(self.buffer["items"]) - queued_before
+        counts["deduplicated"] += self.stats["dedup_items"] - dedup_before
+
+    def add_callback(self, callback: Callable[[], None]):
+        pass  # 回调负责写出缓存与清单，预估模式不执行
+
+    def _flush_outputs(self):
+        # 文件单元只用于归类统计，不写出
+        self.ordered_outputs.clear()
+
+    def _flush_buffer(self):
+        history, items = self.buffer["history"], self.buffer["items"]
+        if not items: return
+        while len(self.unsettled) >= self.concurrency:
+            self.unsettled[0][0].append(*self.unsettled.popleft()[1:])
+        glossary = None
+        if self.glossary_index is not None:
+            glossary = self.glossary_index.find_terms([item['source_text'] for item in items])
+        history_contents = history.build_contents()
+        contents = build_request_contents(history_contents, items, glossary)
+        system_tokens = estimate_contents_tokens(history.head)
+        history_tokens = estimate_contents_tokens(history_contents) - system_tokens
+        glossary_tokens = estimate_tokens(format_glossary(glossary)) if glossary else 0
+        total_tokens = estimate_contents_tokens(contents)
+        TranslationItem, TranslationResponse = response_models()
+        parsed = [TranslationItem(key=item['key'], source_text=item['source_text'], translated_text=item['source_text'])
+                  for item in items]
+        response_tokens = estimate_tokens(TranslationResponse(translations=parsed).model_dump_json())
+        self.unsettled.append((history, items, parsed))
+
+        self.stats["batches"] += 1
+        self.totals.update({"requests": 1, "system": system_tokens, "history": history_tokens,
+                            "glossary": glossary_tokens, "payload": total_tokens - system_tokens - history_tokens - glossary_tokens,
+                            "prompt": total_tokens, "response": response_tokens})
+        for item, (unit, _, _) in zip(items, self.buffer["routes"]):
+            group = self._group_of(unit["output_file_path"])
+            self.breakdown.setdefault(group, Counter())["payload_tokens"] += estimate_tokens(
+                json.dumps(item, ensure_ascii=False))
+        # 批次不跨越对话历史（即Mod）的边界
+        mod_name = self._group_of(self.buffer["routes"][0][0]["output_file_path"])[0]
+        self.breakdown.setdefault((mod_name, "*"), Counter())["requests"] += 1
+        self.flushed_items += len(items)
+        self._reset_buffer(history)
+
+    def estimate_seconds(self, request_seconds: float) -> float:
+        """按配置的速率上限与并发数估算翻译阶段的墙钟耗时（取速率限制与请求延迟两者中较慢的一方）。"""
+        limits = get_rate_limiter().summary()
+        requests, tokens = self.totals["requests"], self.totals["prompt"]
+        rate_bound = max(requests * 60 / limits["rpm"] if limits["rpm"] else 0.0,
+                         tokens * 60 / limits["tpm"] if limits["tpm"] else 0.0)
+        latency_bound = -(-requests // self.concurrency) * request_seconds
+        return max(rate_bound, latency_bound)
+
+    def report_estimate(self, previous_report_path: Path):
+        print("\n--- 预估结果 (未调用API) ---")
+        mods = []
+        for mod_name, category in self.breakdown:
+            if mod_name not in mods: mods.append(mod_name)
+        print(f"{'Mod / 类别':<40}{'条目':>8}{'复用':>8}{'去重':>8}{'发送API':>8}{'payload token':>15}")
+        for mod_name in mods:
+            groups = {category: counts for (name, category), counts in self.breakdown.items()
+                      if name == mod_name and category != "*"}
+            mod_totals = sum(groups.values(), Counter())
+            requests = self.breakdown.get((mod_name, "*"), Counter())["requests"]
+            rows = [(f"{mod_name} ({requests} 个请求)", mod_totals)] + [(f"  {category}", counts)
+                                                                     for category, counts in sorted(groups.items())]
+            for label, counts in rows:
+                reused = counts["entries"] - counts["api_items"] - counts["deduplicated"]
+                print(f"{label:<40}{counts['entries']:>8}{reused:>8}{counts['deduplicated']:>8}"
+                      f"{counts['api_items']:>8}{counts['payload_tokens']:>15}")
+
+        totals = self.totals
+        print(f"\n预计 {totals['requests']} 个API请求，输入约 {totals['prompt']} token "
+              f"(系统提示词 {totals['system']}、对话历史 {totals['history']}、术语 {totals['glossary']}、条目 {totals['payload']})，"
+              f"输出约 {totals['response']} token。未计入失败重试。")
+
+        request_seconds, source = self.DEFAULT_REQUEST_SECONDS, "默认值"
+        if previous_report_path.is_file():
+            try:
+                with previous_report_path.open('r', encoding='utf-8') as f:
+                    previous = json.load(f).get("requests", {})
+                if previous.get("calls"):
+                    request_seconds = previous["latency_total"] / previous["calls"]
+                    source = f"上次运行报告 {previous_report_path.name}"
+            except (json.JSONDecodeError, IOError, KeyError, TypeError):
+                pass
+        seconds = self.estimate_seconds(request_seconds)
+        limiter_summary = get_rate_limiter().summary()
+        rpm, tpm = limiter_summary["rpm"], limiter_summary["tpm"]
+        limits = [f"{rpm:g} 请求/分钟" if rpm else "", f"{tpm:g} token/分钟" if tpm else ""]
+        print(f"预计翻译耗时约 {seconds / 60:.1f} 分钟 (并发 {self.concurrency}，"
+              f"速率上限: {'、'.join(text for text in limits if text) or '未配置'}，"
+              f"每个请求按 {request_seconds:.1f} 秒计，来自{source})。")
+
+
+def process_standard_translation(scheduler: TranslationScheduler, history: ConversationHistory, mod_path: Path,
+                                 mod_info: Dict, memory: TranslationMemory, output_path: Path, mod_cache: Dict[str, dict],
+                                 english_files: List[Path], incremental: Optional[ModIncrementalState] = None):
     print(f"  -> 开始进行标准接口翻译...")
-    mod_cache = {}
-    english_files = find_source_files(mod_path, ["Languages/English"])
-    if not english_files: return mod_cache
+    if not english_files: return
 
     print(f"  -> 找到 {len(english_files)} 个标准语言文件...")
     for file_path in english_files:
@@ -682,14 +3240,73 @@ def process_standard_translation(client: genai.Client, history: List[types.Conte
         safe_mod_name = "".join(c for c in mod_info['name'] if c.isalnum() or c in " .-_").strip()
         output_file = output_path / "Cont" / safe_mod_name / "Languages" / "ChineseSimplified" / output_relative_path
 
-        new_cache_entries = translate_and_save(client, history, nested_targets, memory, output_file)
-        mod_cache.update(new_cache_entries)
-    return mod_cache
+        scheduler.add_file(history, nested_targets, memory, output_file, mod_cache, incremental)
 
 
-def process_def_injection_translation(client: genai.Client, history: List[types.Content], mod_path: Path,
-                                      mod_info: Dict, memory: Dict, output_path: Path, abstract_defs: Dict,
-                                      def_inheritance_map: Dict, files_to_scan: List[Path]) -> Dict[str, dict]:
+def collect_injection_targets(def_irs: Iterable[dict], resolver: InheritanceResolver) -> Dict[str, Dict[str, dict]]:
+    """
+    把一个文件中的定义转换为注入式翻译条目，按Def类型分组返回 {Def类型: {key: 条目}}。
+    定义可以逐块给出（见 ParsedDefCache.iter_defs），无需先组装整个文件的中间表示。
+    """
+    targets_by_type = {}
+    for def_ir in def_irs:
+        # --- 1. 继承逻辑回归：为当前元素构建包含所有父类信息的完整字段字典 ---
+        # 首先获取当前元素自己的所有可翻译字段（路径已在解析阶段生成）
+        fields = dict(def_ir["fields"])
+
+        # 然后，用父类链合并后的字段（已缓存）填充子类没有的字段
+        for path, text in resolver.resolve(def_ir["parent"]).items():
+            if path not in fields:  # 只填充子类没有的
+                fields[path] = text
+
+        # 如果继承后依然没有任何可翻译字段，则跳过
+        if not fields: continue
+
+        # --- 2. 分类处理：根据Def类型决定最终的翻译Key ---
+        def_type = def_ir["type"]
+        targets = targets_by_type.setdefault(def_type, {})
+
+        # --- 路径A：具体定义 (Concrete Def) ---
+        if not def_ir["abstract"]:
+            def_name = def_ir["def_name"]
+            if def_name is not None:
+                for path, text in fields.items():
+                    key = f"{def_name}.{path}"
+                    context = f"Path: {path} in Def '{def_name}'"
+                    targets[key] = {"text": text, "context": context}
+
+        # --- 路径B：抽象定义 (Abstract Def) ---
+        else:
+            stuff_category_names = def_ir["stuff_categories"]
+            # B1: 如果是“抽象生成器”，则为每个生成的物品创建条目
+            if stuff_category_names:
+                base_name_for_generation = def_ir["name"]
+                if not base_name_for_generation: continue
+
+                pattern = CONFIG.get('generative_rules', {}).get('prediction_pattern',
+                                                                 '{base_name}{stuff_defName}')
+                for cat_name in stuff_category_names:
+                    cat_name = cat_name.strip()
+                    if cat_name in PROJECT_STUFFS:
+                        for stuff in PROJECT_STUFFS[cat_name]:
+                            generated_def_name = pattern.format(base_name=base_name_for_generation,
+                                                                stuff_defName=stuff['defName'])
+                            for path, text in fields.items():
+                                key = f"{generated_def_name}.{path}"
+                                context = f"Generated item. Path: {path} in Def '{generated_def_name}'"
+                                # 同一模板生成的各材质物品原文相同，归为同一上下文类别以便去重
+                                context_class = f"Generated item. Path: {path} in template '{base_name_for_generation}'"
+                                targets[key] = {"text": text, "context": context,
+                                                "context_class": context_class}
+            # B2: 如果是“纯抽象父类”，则忽略 (不进入任何分支)
+    return targets_by_type
+
+
+def process_def_injection_translation(scheduler: TranslationScheduler, history: ConversationHistory, mod_path: Path,
+                                      mod_info: Dict, memory: TranslationMemory, output_path: Path,
+                                      resolver: InheritanceResolver, files_to_scan: List[Path],
+                                      mod_cache: Dict[str, dict], parsed_defs: ParsedDefCache,
+                                      incremental: Optional[ModIncrementalState] = None):
     """
     处理注入式翻译（v11 - 继承逻辑回归最终版）。
     - 恢复了v8版本完整且正确的继承逻辑，确保所有字段都能从父类获取。
@@ -700,140 +3317,86 @@ def process_def_injection_translation(client: genai.Client, history: List[types.
 
     if not files_to_scan:
         print("  -> 没有需要注入翻译的文件。")
-        return {}
+        return
 
-    print(f"  -> 正在解析 {len(files_to_scan)} 个定义/补丁/辅助文件...")
+    print(f"  -> 正在提取 {len(files_to_scan)} 个定义/补丁/辅助文件...")
     all_targets_grouped = {}
-    parser = etree.XMLParser(remove_blank_text=True, recover=True)
-    translatable_tags = CONFIG['rules'].get('translatable_def_tags', [])
-
-    for file_path in files_to_scan:
-        try:
-            tree = etree.parse(str(file_path), parser)
-
-            for element in tree.xpath('//*[defName] | //*[@Abstract="True" and @Name]'):
-                # --- 1. 继承逻辑回归：为当前元素构建包含所有父类信息的完整字段字典 ---
-                fields = {}
-                # 首先获取当前元素自己的所有可翻译字段
-                for sub in element.xpath(".//*"):  # 深度扫描所有子孙节点
-                    if sub.tag in translatable_tags and sub.text and sub.text.strip():
-                        # 使用路径生成逻辑作为key
-                        path_parts = []
-                        curr = sub
-                        while curr is not None and curr != element:
-                            parent = curr.getparent()
-                            if parent is None: break
-                            tag_name = curr.tag
-                            if tag_name == 'li':
-                                index = len(curr.xpath("preceding-sibling::li"))
-                                path_parts.insert(0, str(index))
-                            else:
-                                path_parts.insert(0, tag_name)
-                            curr = parent
-                        path_string = ".".join(path_parts)
-                        fields[path_string] = sub.text.strip()
-
-                # 然后，向上查找父类，用父类的字段填充子类没有的字段
-                current_parent_name = element.get("ParentName")
-                visited_parents = set()
-                while current_parent_name and current_parent_name not in visited_parents:
-                    visited_parents.add(current_parent_name)
-                    if current_parent_name in abstract_defs:
-                        # abstract_defs 已经包含了父类的所有字段及其路径
-                        for path, text in abstract_defs[current_parent_name].items():
-                            if path not in fields:  # 只填充子类没有的
-                                fields[path] = text
-                    current_parent_name = def_inheritance_map.get(current_parent_name)
-
-                # 如果继承后依然没有任何可翻译字段，则跳过
-                if not fields: continue
-
-                # --- 2. 分类处理：根据Def类型决定最终的翻译Key ---
-                is_abstract = element.get("Abstract", "False").lower() == 'true'
-                def_type = element.tag
-                filename = file_path.name
-                if def_type not in all_targets_grouped: all_targets_grouped[def_type] = {}
-                if filename not in all_targets_grouped[def_type]: all_targets_grouped[def_type][filename] = {}
-
-                # --- 路径A：具体定义 (Concrete Def) ---
-                if not is_abstract:
-                    def_name_node = element.find("defName")
-                    if def_name_node is not None and def_name_node.text:
-                        def_name = def_name_node.text.strip()
-                        for path, text in fields.items():
-                            key = f"{def_name}.{path}"
-                            context = f"Path: {path} in Def '{def_name}'"
-                            all_targets_grouped[def_type][filename][key] = {"text": text, "context": context}
-
-                # --- 路径B：抽象定义 (Abstract Def) ---
-                else:
-                    stuff_category_names = element.xpath("stuffCategories/li/text()")
-                    # B1: 如果是“抽象生成器”，则为每个生成的物品创建条目
-                    if stuff_category_names:
-                        base_name_for_generation = element.get("Name")
-                        if not base_name_for_generation: continue
-
-                        pattern = CONFIG.get('generative_rules', {}).get('prediction_pattern',
-                                                                         '{base_name}{stuff_defName}')
-                        for cat_name in stuff_category_names:
-                            cat_name = cat_name.strip()
-                            if cat_name in VANILLA_STUFFS:
-                                for stuff in VANILLA_STUFFS[cat_name.strip()]:
-                                    generated_def_name = pattern.format(base_name=base_name_for_generation,
-                                                                        stuff_defName=stuff['defName'])
-                                    for path, text in fields.items():
-                                        key = f"{generated_def_name}.{path}"
-                                        context = f"Generated item. Path: {path} in Def '{generated_def_name}'"
-                                        all_targets_grouped[def_type][filename][key] = {"text": text,
-                                                                                        "context": context}
-                    # B2: 如果是“纯抽象父类”，则忽略 (不进入任何分支)
-
-        except etree.XMLSyntaxError as e:
-            print(f"警告：解析XML文件时发生错误 {file_path}: {e}")
-            continue
-
-    if not all_targets_grouped:
+    safe_mod_name = "".join(c for c in mod_info['name'] if c.isalnum() or c in " .-_").strip()
+    found_targets = False
+
+    def submit(def_type: str, filename: str, targets: Dict[str, dict]):
+        if not targets: return
+        print(f"    -> 正在处理来自 {filename} 的 {len(targets)} 个 {def_type} 条目")
+        safe_def_type_name = def_type.replace('.', '_')
+        output_dir = output_path / "Cont" / safe_mod_name / "Languages" / "ChineseSimplified" / "DefInjected" / safe_def_type_name
+        output_file_path = output_dir / filename
+        scheduler.add_file(history, targets, memory, output_file_path, mod_cache, incremental)
+
+    # 流式模式下，同名文件全部提取完后立即把对应的输出文件交给调度器（同名文件的条目会合并到同一个输出文件），
+    # 翻译与后续文件的提取同时进行，也不必把整个Mod的条目都留在内存中。
+    # 同名文件的条目要全部提取出来才能判断输出文件能否增量复用、才能写出，这是交给调度器的最小粒度
+    streaming = is_streaming_extraction()
+    last_index_of_name = {file_path.name: i for i, file_path in enumerate(files_to_scan)}
+
+    for position, file_path in enumerate(files_to_scan):
+        if streaming and found_targets:
+            # 上一个文件是其文件名的最后一次出现时，对应的各输出文件已经完整
+            previous_name = files_to_scan[position - 1].name
+            if last_index_of_name[previous_name] == position - 1:
+                for def_type, files in all_targets_grouped.items():
+                    if previous_name in files:
+                        submit(def_type, previous_name, files.pop(previous_name))
+
+        file_targets = collect_injection_targets(parsed_defs.iter_defs(file_path), resolver)
+        for def_type, targets in file_targets.items():
+            found_targets = True
+            all_targets_grouped.setdefault(def_type, {}).setdefault(file_path.name, {}).update(targets)
+
+    if not found_targets:
         print("  -> 未找到可供注入翻译的条目。")
-        return {}
+        return
 
     # (后续的翻译和保存逻辑无需修改)
-    safe_mod_name = "".join(c for c in mod_info['name'] if c.isalnum() or c in " .-_").strip()
-    mod_cache = {}
     for def_type, files in all_targets_grouped.items():
         for filename, targets in files.items():
-            if not targets: continue
-            print(f"    -> 正在处理来自 {filename} 的 {len(targets)} 个 {def_type} 条目")
-            safe_def_type_name = def_type.replace('.', '_')
-            output_dir = output_path / "Cont" / safe_mod_name / "Languages" / "ChineseSimplified" / "DefInjected" / safe_def_type_name
-            output_file_path = output_dir / filename
-            new_cache_entries = translate_and_save(client, history, targets, memory, output_file_path)
-            mod_cache.update(new_cache_entries)
-    return mod_cache
+            submit(def_type, filename, targets)
 
 
-def main(config: dict):
-    global CONFIG
+def main(config: dict, shared: Optional['BatchSharedState'] = None):
+    """
+    处理一个汉化项目。批量模式下传入 shared，复用其中的API客户端与解析缓存，
+    并跳过下载（所有项目涉及的Mod已在开始前统一下载）。
+    """
+    global CONFIG, PROJECT_GLOSSARY, PROJECT_STUFFS
     CONFIG = config
+    PHASE_TIMER.reset()
+    RUN_METRICS.reset()
 
     # --- 应用自定义配置 ---
     custom_glossary = CONFIG.get('custom_glossary', {})
+    PROJECT_GLOSSARY = {**RIMWORLD_GLOSSARY, **custom_glossary}
     if custom_glossary:
-        RIMWORLD_GLOSSARY.update(custom_glossary)
         print(f"自定义术语表已加载，共更新/添加 {len(custom_glossary)} 个术语。")
 
+    PROJECT_STUFFS = {category: list(stuffs) for category, stuffs in VANILLA_STUFFS.items()}
     custom_stuff_list = CONFIG.get('generative_rules', {}).get('custom_stuff', [])
     if custom_stuff_list:
         count = 0
         for stuff in custom_stuff_list:
             category = stuff.get('category')
             if category:
-                if category not in VANILLA_STUFFS: VANILLA_STUFFS[category] = []
-                VANILLA_STUFFS[category].append(stuff)
+                PROJECT_STUFFS.setdefault(category, []).append(stuff)
                 count += 1
         print(f"自定义材质库已加载，共添加 {count} 种新材质。")
 
     # --- 正常流程 ---
-    client = setup_environment()
+    # 预估模式 (--dry-run) 不下载、不创建API客户端，也不写出任何产出：
+    # 文件索引、解析缓存与翻译记忆库只读不写，清单与检查点日志不会创建
+    dry_run = CONFIG['system'].get('dry_run', False)
+    if dry_run:
+        backend = None
+    else:
+        backend = shared.get_backend() if shared is not None else setup_environment()
     workshop_path = get_workshop_content_path()
     prev_ids = parse_ids(CONFIG['mod_ids'].get('previous', ''))
     new_ids = parse_ids(CONFIG['mod_ids']['translate'])
@@ -841,8 +3404,22 @@ def main(config: dict):
         print("警告: 'translate' 列表为空，无可翻译的Mod。")
         return
 
+    output_base_dir = CONFIG.get('system', {}).get('output_base_dir', 'translation_output')
+    output_path = BASE_WORKING_DIR / output_base_dir / CONFIG['pack_info']['name'].replace(" ", "_")
+    journal_path = output_path.parent / f"{output_path.name}.journal.jsonl"
+    resume = CONFIG['system'].get('resume', False)
+    if (not dry_run and not resume and not CONFIG['system'].get('discard_journal', False)
+            and CheckpointJournal.is_unfinished(journal_path)):
+        print(f"错误: 发现上次未完成运行的检查点日志，其中保存着已付费的译文: {journal_path}")
+        print("       请使用 --resume 继续上次的运行，或使用 --discard-journal 丢弃这些译文并重新开始。")
+        return
+
     all_mod_ids = list(set(prev_ids + new_ids))
-    download_with_steamcmd(all_mod_ids)
+    if dry_run:
+        print("预估模式: 跳过下载，使用本地创意工坊目录中已有的Mod文件。")
+    elif shared is None or not shared.downloaded:
+        with PHASE_TIMER.phase("download"):
+            download_with_steamcmd(all_mod_ids, workshop_path)
 
     mod_info_map = {}
     mod_content_path = workshop_path / CONFIG['system']['rimworld_app_id']
@@ -856,96 +3433,195 @@ def main(config: dict):
             mod_info_map[mod_id] = info
             print(f"  > 找到Mod: {info['name']} (packageId: {info['packageId']})")
 
-    output_base_dir = CONFIG.get('system', {}).get('output_base_dir', 'translation_output')
-    output_path = BASE_WORKING_DIR / output_base_dir / CONFIG['pack_info']['name'].replace(" ", "_")
-    output_path.mkdir(exist_ok=True, parents=True)
-    print(f"\n汉化包将生成在: {output_path.resolve()}")
+    if not dry_run:
+        output_path.mkdir(exist_ok=True, parents=True)
+        print(f"\n汉化包将生成在: {output_path.resolve()}")
 
     # --- 全局学习阶段 ---
     print("\n--- 全局学习阶段: 扫描所有目标Mod以构建知识库 ---")
     abstract_defs, def_inheritance_map = {}, {}
-    parser = etree.XMLParser(remove_blank_text=True, recover=True)
+    incremental_enabled = CONFIG['system'].get('incremental', DEFAULT_CONFIG['system']['incremental'])
+    manifest = RunManifest(output_path.parent / f"{output_path.name}.manifest.json", incremental_enabled,
+                           CONFIG['system'].get('rebuild', False))
+    config_fingerprint = get_config_fingerprint()
+    parsed_defs = shared.parsed_def_cache(get_parse_cache_dir()) if shared is not None else ParsedDefCache(
+        get_parse_cache_dir(), is_streaming_extraction(), read_only=dry_run)
 
-    helper_root_path_str = CONFIG.get('system', {}).get('helper_files_root')
-    helper_root_path = BASE_WORKING_DIR / helper_root_path_str if helper_root_path_str else None
+    helper_root_path = get_helper_root()
 
     # 创建字典来存储每个mod需要注入翻译的文件列表
-    def_files_for_mods = {}
-
-    for mod_id in tqdm(new_ids, desc="构建全局知识库"):
-        mod_path = mod_content_path / mod_id
-
-        # 收集Defs/Patches/Scenarios文件
-        files_to_scan = find_source_files(mod_path, ["Defs", "Patches", "Scenarios"])
-
-        # 添加辅助文件
-        if helper_root_path and helper_root_path.is_dir():
-            mod_helper_path = helper_root_path / mod_id
-            if mod_helper_path.is_dir():
-                helper_files = list(mod_helper_path.rglob("*.xml"))
+    def_files_for_mods, english_files_for_mods = {}, {}
+    source_states_for_mods, knowledge_for_mods = {}, {}
+
+    # 文件收集与XML解析可分散到多个进程；结果按Mod顺序合并，与串行扫描完全一致
+    scan_workers = get_scan_workers()
+    scan_executor = None
+    if scan_workers > 1:
+        scan_executor = ProcessPoolExecutor(max_workers=scan_workers, initializer=init_scan_worker, initargs=(CONFIG,))
+        print(f"并行扫描已启用，使用 {scan_workers} 个进程。")
+    try:
+        with PHASE_TIMER.phase("knowledge"):
+            # 目录遍历在主进程中进行（索引按目录mtime缓存，多数情况下无需遍历），查找与LoadFolders解析可分散到工作进程
+            file_index = get_workshop_file_index()
+            mod_indexes = [file_index.get(mod_content_path / mod_id) for mod_id in new_ids]
+            helper_indexes = [file_index.get(helper_root_path / mod_id)
+                              if helper_root_path and helper_root_path.is_dir() else None for mod_id in new_ids]
+            if not dry_run:
+                file_index.save()
+            scan_map = scan_executor.map if scan_executor else map
+            collected = list(scan_map(collect_mod_source_files, mod_indexes, helper_indexes))
+
+            rescan_ids = []
+            for mod_id, (files_to_scan, helper_files, english_files) in zip(new_ids, collected):
+                # 添加辅助文件
                 if helper_files:
                     print(f"\n  -> 为Mod {mod_id} 找到 {len(helper_files)} 个辅助文件。")
                     files_to_scan.extend(helper_files)
 
-        # 存储这个mod需要注入翻译的文件列表
-        def_files_for_mods[mod_id] = files_to_scan
-
-        # 使用完整的文件列表构建知识库
-        for file_path in files_to_scan:
-            try:
-                tree = etree.parse(str(file_path), parser)
-                for element in tree.xpath('//*[self::Defs or self::Patch]/*|//value/*'):
-                    if not isinstance(element.tag, str): continue
-                    current_name_node = element.find("defName")
-                    current_name = current_name_node.text.strip() if current_name_node is not None and current_name_node.text else element.get(
-                        "Name")
-                    parent_name = element.get("ParentName")
-                    if current_name and parent_name:
-                        def_inheritance_map[current_name] = parent_name.strip()
-                    if element.get("Abstract", "False").lower() == 'true' and element.get("Name"):
-                        template_name = element.get("Name")
-                        if template_name not in abstract_defs: abstract_defs[template_name] = {}
-                        for sub in element:
-                            if isinstance(sub.tag, str) and sub.tag in CONFIG['rules'][
-                                'translatable_def_tags'] and sub.text:
-                                abstract_defs[template_name][sub.tag] = sub.text.strip()
-            except etree.XMLSyntaxError:
-                continue
-    print(f"  -> 全局知识库构建完毕，包含 {len(abstract_defs)} 个抽象模板。")
-
-    translation_memory = build_translation_memory(prev_ids, workshop_path)
+                # 存储这个mod需要注入翻译的文件列表
+                def_files_for_mods[mod_id] = files_to_scan
+                english_files_for_mods[mod_id] = english_files
+
+                states = manifest.source_states(mod_id, files_to_scan + english_files)
+                source_states_for_mods[mod_id] = states
+                # 源文件与配置（可翻译标签等）都未变化时直接沿用清单中记录的知识库贡献，无需重新解析
+                mod_record = manifest.mod_record(mod_id)
+                if (manifest.sources_unchanged(mod_id, states) and "knowledge" in mod_record
+                        and mod_record.get("fingerprints", {}).get("config") == config_fingerprint):
+                    knowledge_for_mods[mod_id] = mod_record["knowledge"]
+                else:
+                    rescan_ids.append(mod_id)
+
+            parsed_defs.prefetch([f for mod_id in rescan_ids for f in def_files_for_mods[mod_id]],
+                                 {k: v for mod_id in rescan_ids for k, v in source_states_for_mods[mod_id].items()},
+                                 scan_executor)
+            from tqdm import tqdm
+            for mod_id in tqdm(new_ids, desc="构建全局知识库"):
+                if mod_id not in knowledge_for_mods:
+                    knowledge_for_mods[mod_id] = scan_knowledge(def_files_for_mods[mod_id], parsed_defs,
+                                                                source_states_for_mods[mod_id])
+                merge_knowledge(knowledge_for_mods[mod_id], abstract_defs, def_inheritance_map)
+            print(f"  -> 全局知识库构建完毕，包含 {len(abstract_defs)} 个抽象模板。")
+            resolver = InheritanceResolver(abstract_defs, def_inheritance_map)
+
+            with PHASE_TIMER.phase("memory"):
+                translation_memory = build_translation_memory(prev_ids, workshop_path)
+            memory_fingerprint = translation_memory.fingerprint()
+
+            # 预先判定需要重新处理的Mod，并行解析它们尚未缓存的定义文件，供注入式翻译使用
+            fingerprints_for_mods, skippable_mods = {}, set()
+            for mod_id in mod_info_map:
+                fingerprints_for_mods[mod_id] = {"config": config_fingerprint, "memory": memory_fingerprint,
+                                                 "knowledge": knowledge_fingerprint(knowledge_for_mods[mod_id]["parents"],
+                                                                                    resolver)}
+                if manifest.can_skip_mod(mod_id, source_states_for_mods[mod_id], fingerprints_for_mods[mod_id],
+                                         output_path):
+                    skippable_mods.add(mod_id)
+            pending_ids = [mod_id for mod_id in mod_info_map if mod_id not in skippable_mods]
+            parsed_defs.prefetch([f for mod_id in pending_ids for f in def_files_for_mods[mod_id]],
+                                 {k: v for mod_id in pending_ids for k, v in source_states_for_mods[mod_id].items()},
+                                 scan_executor)
+    finally:
+        if scan_executor is not None:
+            scan_executor.shutdown()
 
     # --- 翻译阶段 ---
     print("\n--- 开始“三方校对”翻译流程 ---")
-    system_prompt = get_setup_prompt()
-    for mod_id, mod_info in mod_info_map.items():
-        print(f"\n>>> 正在处理 Mod '{mod_info['name']}' ({mod_id})...")
-        mod_path = mod_content_path / mod_id
-        conversation_history = [
-            types.Content(role="user", parts=[types.Part.from_text(text=system_prompt)]),
-            types.Content(role="model", parts=[types.Part.from_text(text="好的，我明白了，请提供需要翻译的内容。")])
-        ]
-        current_mod_cache = {}
-        cache1 = process_standard_translation(client, conversation_history, mod_path, mod_info, translation_memory,
-                                              output_path)
-        current_mod_cache.update(cache1)
-
-        # 将这个mod对应的、已包含辅助文件的列表传递给函数
-        files_for_this_mod = def_files_for_mods.get(mod_id, [])
-        cache2 = process_def_injection_translation(client, conversation_history, mod_path, mod_info, translation_memory,
-                                                   output_path, abstract_defs, def_inheritance_map,
-                                                   files_to_scan=files_for_this_mod)
-        current_mod_cache.update(cache2)
-
-        if current_mod_cache:
+    glossary_mode = CONFIG.get('ai_settings', {}).get('glossary_mode', DEFAULT_CONFIG['ai_settings']['glossary_mode'])
+    glossary_index = None
+    if glossary_mode == "filtered":
+        glossary_index = GlossaryIndex(PROJECT_GLOSSARY)
+        print(f"术语表索引已构建 ({len(PROJECT_GLOSSARY)} 个术语)，每个请求只附带其中实际出现的术语。")
+    system_prompt = get_setup_prompt(include_glossary=glossary_index is None)
+    concurrency = CONFIG.get('ai_settings', {}).get('concurrency', DEFAULT_CONFIG['ai_settings']['concurrency'])
+    deduplicate = CONFIG.get('ai_settings', {}).get('deduplicate', DEFAULT_CONFIG['ai_settings']['deduplicate'])
+    if dry_run:
+        journal = None
+        scheduler = DryRunScheduler(output_path, concurrency, get_batch_token_budget(), glossary_index, deduplicate)
+    else:
+        journal = CheckpointJournal(journal_path, resume)
+        scheduler = TranslationScheduler(backend, concurrency, get_batch_token_budget(), glossary_index, deduplicate,
+                                         journal)
+    if scheduler.concurrency > 1 and not dry_run:
+        print(f"并发翻译已启用，最多同时进行 {scheduler.concurrency} 个API请求。")
+
+    def write_mod_cache(mod_info: Dict, mod_cache: Dict[str, dict]):
+        if mod_cache:
             safe_mod_name = "".join(c for c in mod_info['name'] if c.isalnum() or c in " .-_").strip()
             cache_file_path = output_path / "Cont" / safe_mod_name / "translation_cache.json"
             cache_file_path.parent.mkdir(exist_ok=True, parents=True)
             with cache_file_path.open('w', encoding='utf-8') as f:
-                json.dump(current_mod_cache, f, ensure_ascii=False, indent=4)
+                json.dump(mod_cache, f, ensure_ascii=False, indent=4)
             print(f"  -> 已为 Mod '{mod_info['name']}' 生成新的翻译缓存。")
         print(f"<<< Mod '{mod_info['name']}' 处理完毕。")
 
+    completed = False
+    validation_reports = {}
+    validation_report_path = output_path.parent / f"{output_path.name}.validation.json"
+    try:
+        for mod_id, mod_info in mod_info_map.items():
+            print(f"\n>>> 正在处理 Mod '{mod_info['name']}' ({mod_id})...")
+            mod_path = mod_content_path / mod_id
+            knowledge = knowledge_for_mods[mod_id]
+            fingerprints = fingerprints_for_mods[mod_id]
+            if mod_id in skippable_mods:
+                manifest.skipped_mods += 1
+                print(f"<<< Mod '{mod_info['name']}' 的源文件与配置均未变化，沿用上次的产出。")
+                continue
+
+            safe_mod_name = "".join(c for c in mod_info['name'] if c.isalnum() or c in " .-_").strip()
+            incremental = ModIncrementalState(manifest, mod_id, output_path,
+                                              output_path / "Cont" / safe_mod_name / "translation_cache.json",
+                                              source_states_for_mods[mod_id], knowledge, fingerprints)
+            conversation_history = ConversationHistory(system_prompt)
+            # 翻译结果由调度器按登记顺序结算后写入此字典
+            current_mod_cache = {}
+            with PHASE_TIMER.phase("extraction"):
+                process_standard_translation(scheduler, conversation_history, mod_path, mod_info, translation_memory,
+                                             output_path, current_mod_cache, english_files_for_mods[mod_id], incremental)
+
+                # 将这个mod对应的、已包含辅助文件的列表传递给函数
+                files_for_this_mod = def_files_for_mods.get(mod_id, [])
+                process_def_injection_translation(scheduler, conversation_history, mod_path, mod_info, translation_memory,
+                                                  output_path, resolver, files_to_scan=files_for_this_mod, mod_cache=current_mod_cache,
+                                                  parsed_defs=parsed_defs, incremental=incremental)
+
+            def finish_mod(info=mod_info, cache=current_mod_cache, state=incremental):
+                with PHASE_TIMER.phase("write"):
+                    write_mod_cache(info, cache)
+                    state.finish()
+                issues = scheduler.report_validation(cache, info['name'])
+                if issues: validation_reports[info['name']] = issues
+
+            scheduler.add_callback(finish_mod)
+        with PHASE_TIMER.phase("translation"):
+            scheduler.drain()
+        if dry_run:
+            translation_memory.report()
+            manifest.report()
+            scheduler.report_deduplication()
+            scheduler.report_estimate(output_path.parent / f"{output_path.name}.run.json")
+            completed = True
+            return
+        scheduler.report_deduplication()
+        scheduler.report_recovery()
+        get_rate_limiter().report()
+        if validation_reports:
+            with validation_report_path.open('w', encoding='utf-8') as f:
+                json.dump(validation_reports, f, ensure_ascii=False, indent=4)
+            print(f"占位符/标记校验报告已写入: {validation_report_path}")
+        else:
+            validation_report_path.unlink(missing_ok=True)
+        translation_memory.report()
+        manifest.report()
+        if journal.replayed:
+            print(f"检查点恢复: {journal.replayed} 个条目沿用了中断前的译文，未重新请求API。")
+        completed = True
+    finally:
+        scheduler.shutdown()
+        if journal is not None:
+            journal.close(completed)
+
     # --- 在所有翻译完成后，再生成元数据 ---
     print("\n--- 所有翻译任务完成，正在根据实际产出生成最终元数据 ---")
     cont_dir = output_path / "Cont"
@@ -957,10 +3633,25 @@ def main(config: dict):
         print("警告: 未生成任何有效的翻译内容，将不创建元数据文件。")
     else:
         print(f"检测到 {len(final_mod_info_map)} 个Mod已成功生成翻译，将为它们创建元数据。")
-        create_about_file(output_path, final_mod_info_map)
-        create_load_folders_file(output_path, final_mod_info_map)
-        create_self_translation(output_path)
-
+        with PHASE_TIMER.phase("packaging"):
+            create_about_file(output_path, final_mod_info_map)
+            create_load_folders_file(output_path, final_mod_info_map)
+            create_self_translation(output_path)
+
+    PHASE_TIMER.report()
+    if CONFIG['system'].get('run_report', DEFAULT_CONFIG['system']['run_report']):
+        RUN_METRICS.write_report(output_path.parent / f"{output_path.name}.run.json", {
+            "pack": CONFIG['pack_info']['name'],
+            "mods": len(mod_info_map),
+            "cache": {"memory": {tier: translation_memory.stats[tier] for tier in TranslationMemory.MATCH_TIERS},
+                      "memory_hints": dict(translation_memory.hint_stats),
+                      "deduplicated": scheduler.stats["dedup_items"], "journal_replayed": journal.replayed,
+                      "skipped_mods": manifest.skipped_mods, "reused_outputs": manifest.reused_outputs,
+                      "file_index": dict(get_workshop_file_index().stats)},
+            "scheduler": dict(scheduler.stats),
+            "rate_limiter": get_rate_limiter().summary()["stats"],
+            "validation_issues": sum(len(issues) for issues in validation_reports.values()),
+        })
     print(f"\n汉化包 '{CONFIG['pack_info']['name']}' 已在以下路径生成完毕: \n{output_path.resolve()}")
 
 
@@ -1005,9 +3696,149 @@ def load_config(config_path: Path | str) -> Optional[dict]:
     return config
 
 
+# --- 批量模式 ---
+
+class BatchSharedState:
+    """
+    批量处理多个项目时共享的状态：后端配置相同的项目共用一个翻译后端，所有项目涉及的Mod在开始前统一下载，
+    旧汉化包也只导入翻译记忆库一次。Def/Patch文件在项目通过增量检查、确实需要解析时才解析，
+    结果按可翻译标签配置缓存，之后的项目不再重复解析。
+    """
+
+    def __init__(self):
+        self.backends = {}
+        self.downloaded = False
+        self.parsed_caches = {}
+
+    def get_backend(self) -> TranslationBackend:
+        """按当前项目的后端配置取得共享的翻译后端（后端类型或模拟后端设置不同的项目不共用）。"""
+        system_config = CONFIG['system']
+        key = fingerprint([system_config.get('translation_backend', DEFAULT_CONFIG['system']['translation_backend']),
+                           system_config.get('mock_backend', {})])
+        if key not in self.backends:
+            self.backends[key] = setup_environment()
+        return self.backends[key]
+
+    def parsed_def_cache(self, cache_dir: Optional[Path]) -> ParsedDefCache:
+        """按缓存目录、可翻译标签与提取模式取得共享的解析缓存（标签不同的项目解析结果不同，不能共用）。"""
+        streaming = is_streaming_extraction()
+        key = fingerprint([str(cache_dir), DEF_IR_VERSION, CONFIG['rules'].get('translatable_def_tags', []), streaming])
+        if key not in self.parsed_caches:
+            self.parsed_caches[key] = ParsedDefCache(cache_dir, streaming)
+        return self.parsed_caches[key]
+
+
+def prepare_batch(configs: List[dict]) -> BatchSharedState:
+    """
+    批量模式的共享准备阶段：检查各项目的翻译后端，统一下载全部Mod，导入各项目的旧汉化包。
+    定义文件不在这里解析：未变化的项目会被增量检查整体跳过，解析推迟到各项目确实需要时进行。
+    """
+    global CONFIG
+    shared = BatchSharedState()
+    for config in configs:
+        CONFIG = config
+        shared.get_backend()  # 尽早发现缺失的密钥或SteamCMD
+    CONFIG = configs[0]
+    workshop_path = get_workshop_content_path()
+
+    all_mod_ids = []
+    for config in configs:
+        for mod_id in parse_ids(config['mod_ids'].get('previous', '')) + parse_ids(config['mod_ids']['translate']):
+            if mod_id not in all_mod_ids: all_mod_ids.append(mod_id)
+    print(f"\n--- 批量模式: {len(configs)} 个项目共涉及 {len(all_mod_ids)} 个不同的Mod，统一下载与解析 ---")
+    download_with_steamcmd(all_mod_ids, workshop_path)
+    shared.downloaded = True
+
+    for config in configs:
+        CONFIG = config
+        build_translation_memory(parse_ids(CONFIG['mod_ids'].get('previous', '')), workshop_path)
+    return shared
+
+
+# 并行处理项目时由父进程设置，fork 出的工作进程直接继承其中的下载状态与已解析的内容
+_BATCH_SHARED: Optional[BatchSharedState] = None
+
+
+def run_batch_project(config: dict, log_path: Path) -> Optional[str]:
+    """在工作进程中处理一个项目，全部输出写入日志文件。成功时返回None，否则返回错误信息。"""
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with log_path.open('w', encoding='utf-8') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            main(config, _BATCH_SHARED)
+        except Exception as e:
+            traceback.print_exc()
+            return str(e)
+    return None
+
+
+def run_batch(projects: List[tuple[Path, dict]], parallel_projects: int = 1):
+    """
+    批量处理多个项目：先对所有项目涉及的Mod统一完成下载、解析与记忆库导入，
+    再基于这份共享状态逐个（或并行）执行各项目的翻译与打包。
+    """
+    global _BATCH_SHARED, _RATE_LIMITER_MANAGER
+    shared = prepare_batch([config for _, config in projects])
+    total = len(projects)
+
+    if parallel_projects > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        print("警告: 当前平台不支持 fork，无法并行处理项目，将逐个处理。")
+        parallel_projects = 1
+
+    if parallel_projects <= 1:
+        for i, (config_file_path, config) in enumerate(projects, 1):
+            print(f"\n{'=' * 25} 开始处理项目 {i}/{total}: {config_file_path.name} {'=' * 25}")
+            try:
+                main(config, shared)
+            except Exception as e:
+                print(f"\n{'!' * 10} 在处理项目 {config_file_path.name} 时发生严重错误: {e} {'!' * 10}")
+                traceback.print_exc()
+            print(f"{'=' * 25} 项目 {config_file_path.name} 处理完毕 {'=' * 25}")
+        return
+
+    print(f"\n将同时处理 {parallel_projects} 个项目，各项目的输出写入各自的日志文件。")
+    # API客户端与SQLite连接不能跨进程使用，工作进程按各自项目的配置重新创建
+    close_translation_memory_stores()
+    shared.backends = {}
+    _BATCH_SHARED = shared
+    log_paths = []
+    for config_file_path, config in projects:
+        output_base_dir = config['system'].get('output_base_dir', DEFAULT_CONFIG['system']['output_base_dir'])
+        log_paths.append(BASE_WORKING_DIR / output_base_dir / f"{config['pack_info']['name'].replace(' ', '_')}.log")
+    context = multiprocessing.get_context("fork")
+    # 限流器由独立的服务进程托管，所有工作进程合计的请求速率不超过配置的配额
+    _RATE_LIMITER_MANAGER = start_rate_limiter_manager(context)
+    try:
+        with ProcessPoolExecutor(max_workers=parallel_projects, mp_context=context) as executor:
+            futures = {executor.submit(run_batch_project, config, log_path): (config_file_path, log_path)
+                       for (config_file_path, config), log_path in zip(projects, log_paths)}
+            for future in as_completed(futures):
+                config_file_path, log_path = futures[future]
+                try:
+                    error = future.result()
+                except Exception as e:
+                    error = str(e)
+                if error:
+                    print(f"{'!' * 10} 项目 {config_file_path.name} 处理失败: {error}，详见 {log_path} {'!' * 10}")
+                else:
+                    print(f"项目 {config_file_path.name} 处理完毕，日志: {log_path}")
+    finally:
+        _RATE_LIMITER_MANAGER.shutdown()
+        _RATE_LIMITER_MANAGER = None
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="RimWorld Mod 自动化翻译脚本。")
     parser.add_argument("config_path", type=str, help="要使用的项目配置文件(.toml)或包含配置文件的目录的路径")
+    parser.add_argument("--rebuild", action="store_true", help="忽略增量运行清单，完整重新处理所有Mod")
+    parser.add_argument("--resume", action="store_true", help="回放上次中断运行的检查点日志，已完成的批次不再请求API")
+    parser.add_argument("--discard-journal", action="store_true",
+                        help="丢弃上次中断运行的检查点日志并重新开始 (未指定 --resume 或此项时，存在未完成的日志会拒绝运行)")
+    parser.add_argument("--parallel-projects", type=int, default=1,
+                        help="处理目录时同时处理的项目数 (需要支持 fork 的平台)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="只预估：不下载、不调用API、不写出产出，按Mod与Def类型统计需要翻译的条目、token数与预计耗时")
+    parser.add_argument("--profile", type=Path, metavar="PATH",
+                        help="用 cProfile 分析本次运行，把结果保存到 PATH (可用 snakeviz 等工具查看) 并打印耗时最多的函数")
     args = parser.parse_args()
 
     input_path = Path(args.config_path)
@@ -1033,17 +3864,45 @@ if __name__ == "__main__":
     total_files = len(toml_files_to_process)
     print(f"\n准备开始批量处理，共计 {total_files} 个项目。")
 
-    for i, config_file_path in enumerate(toml_files_to_process, 1):
-        print(f"\n{'=' * 25} 开始处理项目 {i}/{total_files}: {config_file_path.name} {'=' * 25}")
+    projects = []
+    for config_file_path in toml_files_to_process:
         config_data = load_config(config_file_path)
+        if config_data and args.rebuild:
+            config_data['system']['rebuild'] = True
+        if config_data and args.resume:
+            config_data['system']['resume'] = True
+        if config_data and args.discard_journal:
+            config_data['system']['discard_journal'] = True
+        if config_data and args.dry_run:
+            config_data['system']['dry_run'] = True
         if config_data:
-            try:
-                main(config_data)
-            except Exception as e:
-                print(f"\n{'!' * 10} 在处理项目 {config_file_path.name} 时发生严重错误: {e} {'!' * 10}")
-                import traceback
-
-                traceback.print_exc()
+            projects.append((config_file_path, config_data))
         else:
             print(f"跳过项目 {config_file_path.name}。")
-        print(f"{'=' * 25} 项目 {config_file_path.name} 处理完毕 {'=' * 25}")
\ No newline at end of file
+
+    # 并行处理项目时，分析结果只包含父进程（共享的下载与解析阶段）
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        if len(projects) > 1 and not args.dry_run:
+            run_batch(projects, args.parallel_projects)
+        else:
+            # 单个项目，或预估模式（不下载、不调用API，无需批量模式的共享准备）
+            for i, (config_file_path, config_data) in enumerate(projects, 1):
+                print(f"\n{'=' * 25} 开始处理项目 {i}/{len(projects)}: {config_file_path.name} {'=' * 25}")
+                try:
+                    main(config_data)
+                except Exception as e:
+                    print(f"\n{'!' * 10} 在处理项目 {config_file_path.name} 时发生严重错误: {e} {'!' * 10}")
+                    traceback.print_exc()
+                print(f"{'=' * 25} 项目 {config_file_path.name} 处理完毕 {'=' * 25}")
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(str(args.profile))
+            print(f"\n性能分析结果已保存到: {args.profile}，累计耗时最多的函数:")
+            import pstats
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)